@@ -0,0 +1,282 @@
+"""
+Fakes for running Chiru without connecting to Discord or Redis.
+"""
+import collections
+import itertools
+import os
+import re
+import sys
+import tempfile
+
+import aioredis
+import discord
+import discord.http
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from bot import Chiru, _get_command_prefix  # noqa: E402
+
+TIMESTAMP = "2016-10-18T12:00:00.000000+00:00"
+
+
+class FakeUser:
+    def __init__(self, id: str, name: str, bot: bool = False):
+        self.id = id
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+        self.roles = []
+
+
+class FakeServer:
+    def __init__(self, id: str, name: str):
+        self.id = id
+        self.name = name
+        self.members = []
+        self.roles = []
+
+
+class FakeChannel:
+    def __init__(self, id: str, name: str, server: FakeServer):
+        self.id = id
+        self.name = name
+        self.server = server
+        self.is_private = False
+
+
+class FakeMessage:
+    def __init__(self, content: str, author: FakeUser, channel: FakeChannel):
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.server = channel.server
+        self.mentions = []
+        self.channel_mentions = []
+        self.role_mentions = []
+
+
+def make_bot(config: dict = None) -> Chiru:
+    """
+    Create a Chiru instance from a config dict, without logging in.
+    """
+    config = dict(config or {})
+    config.setdefault("oauth2_token", "")
+    config.setdefault("redis", {"host": "127.0.0.1", "port": 6379})
+
+    fd, path = tempfile.mkstemp(suffix=".yml")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            yaml.dump(config, f)
+
+        argv = sys.argv[:]
+        sys.argv[1:] = [path]
+        try:
+            bot = Chiru(command_prefix=_get_command_prefix, description="Benchmark")
+        finally:
+            sys.argv[:] = argv
+    finally:
+        os.remove(path)
+
+    bot.connection.user = FakeUser("1", "Chiru", bot=True)
+    return bot
+
+
+def _encode(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
+
+
+class FakeRedis(aioredis.Redis):
+    """
+    An in-process stand-in for a Redis connection, implementing the commands Chiru uses.
+
+    Values are stored and returned as bytes, like a real server. Every command is counted in `calls`.
+    """
+
+    def __init__(self):
+        # Deliberately doesn't call super().__init__; there is no connection.
+        self.data = {}
+        self.calls = collections.Counter()
+
+    async def get(self, key):
+        self.calls["get"] += 1
+        return self.data.get(key)
+
+    async def set(self, key, value, *, expire=0, pexpire=0, exist=None):
+        self.calls["set"] += 1
+        self.data[key] = _encode(value)
+        return True
+
+    async def mget(self, key, *keys):
+        self.calls["mget"] += 1
+        return [self.data.get(k) for k in (key,) + keys]
+
+    async def mset(self, key, value, *pairs):
+        self.calls["mset"] += 1
+        pairs = (key, value) + pairs
+        for k, v in zip(pairs[::2], pairs[1::2]):
+            self.data[k] = _encode(v)
+        return True
+
+    async def delete(self, key, *keys):
+        self.calls["delete"] += 1
+        return sum(self.data.pop(k, None) is not None for k in (key,) + keys)
+
+    async def sadd(self, key, member, *members):
+        self.calls["sadd"] += 1
+        s = self.data.setdefault(key, set())
+        before = len(s)
+        s.update(_encode(m) for m in (member,) + members)
+        return len(s) - before
+
+    async def srem(self, key, member, *members):
+        self.calls["srem"] += 1
+        s = self.data.get(key, set())
+        before = len(s)
+        s.difference_update(_encode(m) for m in (member,) + members)
+        return before - len(s)
+
+    async def smembers(self, key):
+        self.calls["smembers"] += 1
+        return list(self.data.get(key, ()))
+
+    async def hget(self, key, field):
+        self.calls["hget"] += 1
+        return self.data.get(key, {}).get(_encode(field))
+
+    async def hgetall(self, key):
+        self.calls["hgetall"] += 1
+        return dict(self.data.get(key, {}))
+
+    async def hset(self, key, field, value):
+        self.calls["hset"] += 1
+        h = self.data.setdefault(key, {})
+        new = _encode(field) not in h
+        h[_encode(field)] = _encode(value)
+        return int(new)
+
+    async def hdel(self, key, field, *fields):
+        self.calls["hdel"] += 1
+        h = self.data.get(key, {})
+        return sum(h.pop(_encode(f), None) is not None for f in (field,) + fields)
+
+    async def publish(self, channel, message):
+        self.calls["publish"] += 1
+        return 0
+
+
+class _FakeConnectionContext:
+    def __init__(self, redis: FakeRedis):
+        self._redis = redis
+
+    async def __aenter__(self) -> FakeRedis:
+        return self._redis
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeRedisPool:
+    """
+    Stands in for the aioredis pool; every connection is the same FakeRedis.
+    """
+
+    def __init__(self):
+        self.redis = FakeRedis()
+
+    def get(self):
+        return _FakeConnectionContext(self.redis)
+
+
+class FakeHTTPClient(discord.http.HTTPClient):
+    """
+    A discord.py HTTP client that answers every request in-process.
+
+    Sending or editing a message returns a message payload, so the rest of discord.py builds real Message objects
+    from it. Every request is counted in `requests`, by method and route.
+    """
+    _MESSAGE_ROUTE = re.compile(r"/channels/(\d+)/messages(?:/(\d+))?$")
+    _ID = re.compile(r"/\d+")
+
+    def __init__(self, user: dict, *, loop=None):
+        super().__init__(loop=loop)
+        self.user = user
+        self.requests = collections.Counter()
+        self._ids = itertools.count(10 ** 17)
+
+    async def request(self, method, url, *, bucket=None, **kwargs):
+        self.requests["{} {}".format(method, self._ID.sub("/{id}", url[len(self.API_BASE):]))] += 1
+
+        match = self._MESSAGE_ROUTE.search(url)
+        if match is not None and method in ("POST", "PATCH"):
+            payload = kwargs.get("json", {})
+            return {
+                "id": match.group(2) or str(next(self._ids)),
+                "channel_id": match.group(1),
+                "content": payload.get("content", ""),
+                "author": self.user,
+                "timestamp": TIMESTAMP,
+                "tts": payload.get("tts", False),
+                "mentions": [],
+                "mention_roles": [],
+                "embeds": [],
+                "attachments": [],
+                "type": 0
+            }
+
+        return None if method == "DELETE" else {}
+
+
+def user_payload(id: str, name: str, bot: bool = False) -> dict:
+    return {"id": id, "username": name, "discriminator": "0001", "avatar": None, "bot": bot}
+
+
+def server_payload(id: str, name: str, members: list, roles: list) -> dict:
+    """
+    Build a GUILD_CREATE payload for a server with a single text channel, whose ID is the server's.
+
+    :param members: A list of (user payload, role IDs) tuples.
+    :param roles: A list of (role ID, name) tuples.
+    """
+    return {
+        "id": id,
+        "name": name,
+        "owner_id": members[0][0]["id"] if members else None,
+        "large": False,
+        "member_count": len(members),
+        "roles": [{"id": id, "name": "@everyone", "permissions": 104324161, "position": 0}] + [
+            {"id": role_id, "name": role_name, "permissions": 0, "position": i + 1}
+            for i, (role_id, role_name) in enumerate(roles)
+        ],
+        "channels": [{"id": id, "name": "general", "type": 0, "position": 0, "permission_overwrites": []}],
+        "members": [{"user": user, "roles": list(role_ids), "joined_at": TIMESTAMP} for user, role_ids in members]
+    }
+
+
+def install_fakes(bot: Chiru) -> FakeRedisPool:
+    """
+    Swap the bot's Redis pool and discord.py HTTP client for in-process fakes, and give it a real user object.
+    """
+    me = user_payload("1", "Chiru", bot=True)
+    bot.connection.user = discord.User(**me)
+    bot.http = FakeHTTPClient(me, loop=bot.loop)
+
+    pool = FakeRedisPool()
+    bot._redis = pool
+    return pool
+
+
+def add_server(bot: Chiru, payload: dict) -> discord.Server:
+    return bot.connection._add_server_from_data(payload)
+
+
+def make_message(bot: Chiru, channel: discord.Channel, author: dict, content: str, id: str = "1") -> discord.Message:
+    """
+    Build a real discord.py message, as if it had come in through MESSAGE_CREATE.
+    """
+    return discord.Message(channel=channel, id=id, channel_id=channel.id, content=content, author=author,
+                           timestamp=TIMESTAMP, mentions=[], mention_roles=[], embeds=[], attachments=[], type=0)
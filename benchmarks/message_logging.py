@@ -0,0 +1,63 @@
+"""
+Benchmark of the per-message logging overhead in `Chiru.on_message`, through `Chiru._log_message`.
+
+Records are written to /dev/null by the bot's own stderr handler. With `logging.threaded`, the handler is the one
+`Chiru.main()` binds for the lifetime of `run()`.
+
+Run with `python benchmarks/message_logging.py [iterations]`.
+"""
+import os
+import sys
+import time
+
+from fakes import FakeChannel, FakeMessage, FakeServer, FakeUser, make_bot
+
+# After fakes, which puts the repository root on the path.
+import bot as chiru_bot
+
+
+def _message():
+    server = FakeServer("198101180180594688", "Test server")
+    channel = FakeChannel("200", "general", server)
+    return FakeMessage("hello world " * 4, FakeUser("300", "someone"), channel)
+
+
+def run(name, logging_cfg, iterations):
+    bot = make_bot({"logging": logging_cfg})
+    message = _message()
+    timings = {}
+
+    def log_messages(*args, **kwargs):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            bot._log_message(message)
+        timings["logged"] = time.perf_counter() - start
+
+    # Stands in for discord.py's Client.run, so the handler is set up and torn down by the real Chiru._run.
+    bot.run = log_messages
+    start = time.perf_counter()
+    bot._run()
+    # Includes closing the threaded handler, which waits for its queue to be written.
+    total = time.perf_counter() - start
+
+    print("{:<20} {:>8.2f} us/message logging, {:>8.2f} us/message until written"
+          .format(name, timings["logged"] / iterations * 1e6, total / iterations * 1e6))
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    with open(os.devnull, 'w') as devnull:
+        stream = chiru_bot._stderr_handler.stream
+        chiru_bot._stderr_handler.stream = devnull
+        try:
+            run("stream", {}, iterations)
+            run("stream, 10%", {"sample_rate": 0.1}, iterations)
+            run("threaded", {"threaded": True}, iterations)
+            run("threaded, 10%", {"threaded": True, "sample_rate": 0.1}, iterations)
+        finally:
+            chiru_bot._stderr_handler.stream = stream
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Microbenchmark of messages per second through `Chiru.on_message`, using synthetic messages.
+
+Run with `python benchmarks/on_message.py [messages] [command ratio]`.
+"""
+import random
+import sys
+import time
+
+from fakes import FakeChannel, FakeMessage, FakeServer, FakeUser, make_bot
+
+CHATTER = [
+    "hello", "lol", "has anyone seen the new episode", "brb", "chiruno is best girl",
+    "can someone help me with asyncio", "gg", "what", "ok",
+]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    command_ratio = float(sys.argv[2]) if len(sys.argv) > 2 else 0.01
+
+    bot = make_bot({"logging": {"messages": "none"}})
+
+    invoked = 0
+
+    @bot.command(name="bench")
+    async def bench():
+        nonlocal invoked
+        invoked += 1
+
+    server = FakeServer("100", "Benchmark server")
+    channel = FakeChannel("200", "general", server)
+    author = FakeUser("300", "someone")
+
+    messages = []
+    for _ in range(count):
+        if random.random() < command_ratio:
+            messages.append(FakeMessage("chiru bench", author, channel))
+        else:
+            messages.append(FakeMessage(random.choice(CHATTER), author, channel))
+
+    async def run():
+        start = time.perf_counter()
+        for message in messages:
+            await bot.on_message(message)
+        return time.perf_counter() - start
+
+    elapsed = bot.loop.run_until_complete(run())
+
+    print("{} messages ({} commands) in {:.3f}s".format(count, invoked, elapsed))
+    print("{:.0f} messages/second, {:.2f} us/message".format(count / elapsed, elapsed / count * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+"""
+Offline replay benchmark of the message -> command pipeline.
+
+Messages go through `Chiru.on_message` and the real cogs, with Redis and the Discord HTTP API replaced by in-process
+fakes, so nothing touches the network. Reports messages per second, per-command latency percentiles and the memory
+allocated per message, and saves the results as JSON so runs can be compared across commits.
+
+Run with `python benchmarks/replay.py [--messages N] [--input stream.jsonl] [--output results.json]
+[--compare old.json]`.
+
+A recorded stream is a file of JSON lines, each with a `content` key and optionally `server` and `author` indexes
+into the synthetic servers.
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from discord.ext.commands import GroupMixin
+
+from fakes import ROOT, add_server, install_fakes, make_bot, make_message, server_payload, user_payload
+
+from chiru.inventory import Inventory
+from chiru.search import NgramIndex
+
+EXTENSIONS = ["chiru.cogs.docs", "chiru.cogs.feeds", "chiru.cogs.notifications", "chiru.cogs.utilities"]
+
+CHATTER = [
+    "hello", "lol", "has anyone seen the new episode", "brb", "chiruno is best girl",
+    "can someone help me with asyncio", "gg", "what", "ok",
+]
+
+# Modules whose names make up the synthetic pydoc inventory.
+DOC_MODULES = ["asyncio", "collections", "functools", "itertools", "os", "json", "re", "time", "datetime",
+               "threading", "socket", "subprocess", "logging", "argparse", "random", "io", "inspect"]
+
+FEEDS = ["news", "updates", "events", "memes", "announcements"]
+ROLES = ["admin", "mod", "regular", "artist", "gamer", "bot dev"]
+
+
+def _inventory() -> Inventory:
+    """
+    Build a pydoc inventory out of the attributes of a few stdlib modules.
+    """
+    entries = {}
+    for name in DOC_MODULES:
+        module = __import__(name)
+        entries[name] = ("Python", "3", "library/{}.html#module-{}".format(name, name), "-")
+        for attr in dir(module):
+            if attr.startswith("_"):
+                continue
+            key = "{}.{}".format(name, attr)
+            entries[key] = ("Python", "3", "library/{}.html#{}".format(name, key), "-")
+            obj = getattr(module, attr)
+            if isinstance(obj, type):
+                for sub in dir(obj):
+                    if not sub.startswith("_"):
+                        subkey = "{}.{}".format(key, sub)
+                        entries[subkey] = ("Python", "3", "library/{}.html#{}".format(name, subkey), "-")
+
+    return Inventory.from_intersphinx({"py:attribute": entries}, "https://docs.python.org/3/")
+
+
+def _typo(rng: random.Random, word: str) -> str:
+    if len(word) < 4:
+        return word
+    i = rng.randrange(len(word))
+    return word[:i] + word[i + 1:]
+
+
+def synthetic_stream(rng: random.Random, count: int, command_ratio: float, keys: list) -> list:
+    """
+    Generate (content, server index, author index) tuples, mostly chatter with a mix of commands.
+    """
+    templates = [
+        (10, lambda: "chiru pydoc {}".format(_typo(rng, rng.choice(keys)))),
+        (3, lambda: "chiru pydoc multi 5 {}".format(rng.choice(keys).rsplit(".", 1)[-1])),
+        (2, lambda: "chiru pydoc module python {}".format(rng.choice(keys))),
+        (4, lambda: "chiru feeds"),
+        (4, lambda: "chiru sub {}".format(rng.choice(FEEDS))),
+        (4, lambda: "chiru unsub {}".format(rng.choice(FEEDS))),
+        (3, lambda: "chiru rolecount {}".format(rng.choice(ROLES))),
+        (1, lambda: "chiru rolemembers {}".format(rng.choice(ROLES))),
+        (3, lambda: "chiru notifications"),
+        (2, lambda: "chiru prefix"),
+        (1, lambda: "chiru uptime"),
+    ]
+    cumulative = []
+    total = 0
+    for weight, _ in templates:
+        total += weight
+        cumulative.append(total)
+
+    stream = []
+    for _ in range(count):
+        if rng.random() < command_ratio:
+            content = templates[bisect.bisect_right(cumulative, rng.random() * total)][1]()
+        else:
+            content = rng.choice(CHATTER)
+        stream.append((content, rng.randrange(1 << 16), rng.randrange(1 << 16)))
+
+    return stream
+
+
+def recorded_stream(path: str) -> list:
+    stream = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            stream.append((entry["content"], entry.get("server", len(stream)), entry.get("author", len(stream))))
+
+    return stream
+
+
+def build_world(bot, rng: random.Random, servers: int, members: int) -> list:
+    """
+    Create the synthetic servers, and the Redis data the cogs expect for them.
+
+    :return: A list of (server, member payloads) tuples.
+    """
+    redis = bot._redis.redis
+    world = []
+    for s in range(servers):
+        server_id = str(10 ** 17 + s)
+        roles = [(str(2 * 10 ** 17 + s * 100 + i), name) for i, name in enumerate(ROLES + FEEDS)]
+        users = [user_payload(str(3 * 10 ** 17 + s * 10 ** 5 + m), "user{}".format(m)) for m in range(members)]
+        member_data = [(user, rng.sample([role_id for role_id, _ in roles], 3)) for user in users]
+
+        server = add_server(bot, server_payload(server_id, "Server {}".format(s), member_data, roles))
+        world.append((server, users))
+
+        feed_roles = {name.encode(): role_id.encode() for role_id, name in roles if name in FEEDS}
+        redis.data["cfg:{}:feeds".format(server_id)] = feed_roles
+        redis.data["cfg:{}:notifications".format(server_id)] = b"all"
+
+    return world
+
+
+def label(bot, content: str, prefix: str = "chiru ") -> str:
+    """
+    Work out which command a message invokes, for grouping latencies.
+    """
+    if not content.startswith(prefix):
+        return "<chatter>"
+
+    words = content[len(prefix):].split()
+    command = bot.commands.get(words[0]) if words else None
+    if command is None:
+        return "<unknown>"
+
+    if isinstance(command, GroupMixin) and len(words) > 1 and words[1] in command.commands:
+        return "{} {}".format(command.name, words[1])
+    return command.name
+
+
+def _percentile(values: list, p: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def _messages(bot, world: list, stream: list) -> list:
+    """
+    Build the messages of a stream, as (command label, message) tuples.
+    """
+    messages = []
+    for i, (content, server_index, author_index) in enumerate(stream):
+        server, users = world[server_index % len(world)]
+        author = users[author_index % len(users)]
+        messages.append((label(bot, content), make_message(bot, server.default_channel, author, content, str(i))))
+
+    return messages
+
+
+async def _drain(bot):
+    # Errors and notifications are sent without waiting; let them finish.
+    while bot.send_queue.depth:
+        await asyncio.sleep(0)
+
+
+async def replay(bot, world: list, stream: list) -> tuple:
+    """
+    Feed a stream through on_message.
+
+    :return: The elapsed time, and a dict of command label -> latencies.
+    """
+    latencies = {}
+    messages = _messages(bot, world, stream)
+
+    start = time.perf_counter()
+    for name, message in messages:
+        before = time.perf_counter()
+        await bot.on_message(message)
+        latencies.setdefault(name, []).append(time.perf_counter() - before)
+
+    await _drain(bot)
+    elapsed = time.perf_counter() - start
+
+    return elapsed, latencies
+
+
+async def measure_memory(bot, world: list, stream: list, top: int = 10) -> dict:
+    """
+    Replay a stream under tracemalloc, twice.
+
+    The first pass clears the traces before each message, so the traced peak while the message is handled (and its
+    replies sent) is the most memory it had allocated at once, counting garbage that was freed again before it
+    finished. The second pass compares snapshots from before and after the replay, for what was left allocated.
+    """
+    peaks = {}
+    tracemalloc.start()
+    try:
+        for name, message in _messages(bot, world, stream):
+            tracemalloc.clear_traces()
+            await bot.on_message(message)
+            await _drain(bot)
+            peaks.setdefault(name, []).append(tracemalloc.get_traced_memory()[1])
+
+        tracemalloc.clear_traces()
+        messages = _messages(bot, world, stream)
+        before = tracemalloc.take_snapshot()
+        for _, message in messages:
+            await bot.on_message(message)
+        await _drain(bot)
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    diff = after.filter_traces(filters).compare_to(before.filter_traces(filters), "lineno")
+    size = sum(stat.size_diff for stat in diff)
+    blocks = sum(stat.count_diff for stat in diff)
+
+    every = sorted(peak for values in peaks.values() for peak in values)
+    return {
+        "messages": len(stream),
+        "peak_bytes_per_message": {
+            "mean": sum(every) / len(every),
+            "p50": _percentile(every, 50),
+            "p99": _percentile(every, 99),
+            "max": every[-1]
+        },
+        "peak_bytes_per_command": {name: sum(values) / len(values) for name, values in peaks.items()},
+        "retained_bytes_per_message": size / len(stream),
+        "retained_blocks_per_message": blocks / len(stream),
+        "top_retained": [
+            {"where": str(stat.traceback), "size_diff": stat.size_diff, "count_diff": stat.count_diff}
+            for stat in diff[:top]
+        ]
+    }
+
+
+def _commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old: dict, new: dict):
+    print("\nCompared to {} ({}):".format(old.get("commit"), old.get("time")))
+    print("  messages/s: {:.0f} -> {:.0f} ({:+.1%})".format(old["messages_per_second"], new["messages_per_second"],
+                                                             new["messages_per_second"] / old["messages_per_second"]
+                                                             - 1))
+    if "peak_bytes_per_message" in old.get("memory", {}) and "memory" in new:
+        print("  peak bytes/message: {:.0f} -> {:.0f} mean, {:.0f} -> {:.0f} p99".format(
+            old["memory"]["peak_bytes_per_message"]["mean"], new["memory"]["peak_bytes_per_message"]["mean"],
+            old["memory"]["peak_bytes_per_message"]["p99"], new["memory"]["peak_bytes_per_message"]["p99"]))
+    for name, stats in sorted(new["commands"].items()):
+        previous = old["commands"].get(name)
+        if previous is None:
+            continue
+        print("  {:<24} p50 {:8.1f}us -> {:8.1f}us   p99 {:8.1f}us -> {:8.1f}us".format(
+            name, previous["p50"] * 1e6, stats["p50"] * 1e6, previous["p99"] * 1e6, stats["p99"] * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", type=int, default=20000, help="number of synthetic messages")
+    parser.add_argument("--command-ratio", type=float, default=0.1, help="fraction of messages that are commands")
+    parser.add_argument("--input", help="replay a recorded stream instead of a synthetic one")
+    parser.add_argument("--servers", type=int, default=50)
+    parser.add_argument("--members", type=int, default=200, help="members per server")
+    parser.add_argument("--memory-messages", type=int, default=2000,
+                        help="number of messages to replay under tracemalloc (0 to skip)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="replay.json", help="where to save the results")
+    parser.add_argument("--compare", help="results of a previous run to compare against")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    cache_dir = tempfile.mkdtemp()
+    bot = make_bot({
+        "logging": {"messages": "none"},
+        "loop_monitor": {"enabled": False},
+        # Don't pace sends; the fake API has no rate limits.
+        "send_queue": {"rate": 10 ** 9, "per": 1.0},
+        "docs": {},
+        "docs_cache": os.path.join(cache_dir, "pydoc.cache"),
+    })
+    bot.owner_id = "0"
+    install_fakes(bot)
+    world = build_world(bot, rng, args.servers, args.members)
+
+    for extension in EXTENSIONS:
+        bot.load_extension(extension)
+
+    # Let the docs setup run (there are no sources to fetch), then give it a synthetic inventory.
+    bot.loop.run_until_complete(asyncio.sleep(0.1))
+    docs = bot.get_cog("Docs")
+    inventory = _inventory()
+    docs._swap({"python": {"inventory": inventory}}, {"python": NgramIndex(inventory.keys)})
+
+    if args.input:
+        stream = recorded_stream(args.input)
+    else:
+        stream = synthetic_stream(rng, args.messages, args.command_ratio, inventory.keys)
+
+    # Warm up the caches, so the run measures steady state.
+    bot.loop.run_until_complete(replay(bot, world, stream[:min(len(stream), 1000)]))
+
+    elapsed, latencies = bot.loop.run_until_complete(replay(bot, world, stream))
+
+    commands = {}
+    for name, values in latencies.items():
+        values.sort()
+        commands[name] = {
+            "count": len(values),
+            "mean": sum(values) / len(values),
+            "p50": _percentile(values, 50),
+            "p99": _percentile(values, 99),
+            "max": values[-1]
+        }
+
+    results = {
+        "commit": _commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "messages": len(stream),
+        "elapsed": elapsed,
+        "messages_per_second": len(stream) / elapsed,
+        "commands": commands,
+        "redis_calls": dict(bot._redis.redis.calls),
+        "http_requests": dict(bot.http.requests),
+    }
+
+    if args.memory_messages:
+        results["memory"] = bot.loop.run_until_complete(
+            measure_memory(bot, world, stream[:args.memory_messages])
+        )
+
+    print("{} messages in {:.3f}s, {:.0f} messages/second".format(len(stream), elapsed,
+                                                                  results["messages_per_second"]))
+    for name, stats in sorted(commands.items(), key=lambda item: -item[1]["count"]):
+        print("  {:<24} {:>7} calls   p50 {:8.1f}us   p99 {:8.1f}us".format(name, stats["count"],
+                                                                            stats["p50"] * 1e6, stats["p99"] * 1e6))
+    if "memory" in results:
+        memory = results["memory"]
+        peak = memory["peak_bytes_per_message"]
+        print("Allocated per message: {:.0f} bytes mean, {:.0f} p50, {:.0f} p99, {:.0f} max at peak; {:.0f} bytes "
+              "({:.2f} blocks) retained.".format(peak["mean"], peak["p50"], peak["p99"], peak["max"],
+                                                 memory["retained_bytes_per_message"],
+                                                 memory["retained_blocks_per_message"]))
+        for name, value in sorted(memory["peak_bytes_per_command"].items(), key=lambda item: -item[1]):
+            print("  {:<24} {:10.0f} bytes at peak".format(name, value))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4, sort_keys=True)
+    print("Saved results to {}.".format(args.output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
 """
 Bot file.
 """
+import functools
+import hmac
+import importlib
+import json
 import os
 import shutil
 import sys
@@ -15,9 +19,11 @@ import logging
 import time
 
 import random
+import uuid
 import yaml
 
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 from discord.ext import commands
 from discord.ext.commands import Bot, CommandNotFound
@@ -30,16 +36,40 @@ import itsdangerous
 
 from logbook.compat import redirect_logging
 from logbook import StreamHandler
-
+from logbook.queues import ThreadedWrapperHandler
+
+from chiru.cache import LRUCache, MISSING
+from chiru.heap import HeapTracker
+from chiru.httpclient import HTTPClient
+from chiru.loopmon import LoopMonitor
+from chiru.metrics import Registry
+from chiru.profiling import Profiler, ProfilerBusy
+from chiru.resilience import CircuitBreaker, PendingWrites, RedisUnavailable
+from chiru.sender import MessageQueue
 from override import Context
 
 # Define logging stuff.
 redirect_logging()
 
-StreamHandler(sys.stderr).push_application()
+_stderr_handler = StreamHandler(sys.stderr)
+_stderr_handler.push_application()
 
 r = re.compile(r"_requirements:: (.*)?")
 
+# Pub/sub channel used to evict config cache entries across processes.
+INVALIDATION_CHANNEL = "chiru:cache-invalidate"
+# Prepended to the content of every message the bot sends or edits.
+MESSAGE_PREFIX = "\u200b"
+# Longest custom command prefix allowed.
+MAX_PREFIX_LENGTH = 16
+# Exit code that tells the launcher not to restart this shard.
+SHUTDOWN_EXIT_CODE = 64
+# Key that each shard writes its status to.
+SHARD_STATUS_KEY = "chiru:shard:{}"
+# Errors that mean redis is down or unreachable, rather than that a command was wrong.
+_REDIS_FAILURES = (asyncio.TimeoutError, OSError, aioredis.ProtocolError, aioredis.ConnectionClosedError,
+                   aioredis.PoolClosedError)
+
 initial_extensions = [
     'chiru.cogs.owner',
 ]
@@ -47,6 +77,11 @@ logging.root.setLevel(logging.INFO)
 
 
 def _get_command_prefix(bot: 'Chiru', message: discord.Message):
+    if message is not None and message.server is not None:
+        prefixes = bot._server_prefixes.get(message.server.id)
+        if prefixes is not None:
+            return prefixes
+
     if bot.config.get("self_bot"):
         return "domo "
     elif bot.config.get("dev"):
@@ -55,6 +90,23 @@ def _get_command_prefix(bot: 'Chiru', message: discord.Message):
         return "chiru "
 
 
+def _timed_redis(func):
+    """
+    Record the latency of a Redis helper in the bot's metrics.
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(self, *args, **kwargs)
+        finally:
+            self._redis_latency.observe(time.perf_counter() - start, name)
+
+    return wrapper
+
+
 class Chiru(Bot):
     """
     Bot class.
@@ -92,13 +144,115 @@ class Chiru(Bot):
         else:
             self.logger.info("Using base selector event loop.")
 
+        log_cfg = self.config.get("logging", {})
+        # One of "all", "commands" or "none".
+        self._message_log_mode = log_cfg.get("messages", "all")
+        self._message_sample_rate = log_cfg.get("sample_rate", 1.0)
+        self._server_sample_rates = {str(k): v for k, v in log_cfg.get("server_sample_rates", {}).items()}
+
+        # Created before the client, since it dispatches events as soon as it exists.
+        self.metrics = Registry()
+        self._events_seen = self.metrics.counter("chiru_events_total", "Dispatched events, by type.", ("event",))
+        self._messages_seen = self.metrics.counter("chiru_messages_total", "Messages seen.")
+        self._commands_invoked = self.metrics.counter("chiru_commands_total", "Commands invoked.", ("command",))
+        self._command_latency = self.metrics.histogram("chiru_command_seconds", "Command latency.", ("command",))
+        self._redis_latency = self.metrics.histogram("chiru_redis_seconds", "Redis helper latency.", ("method",))
+        self._flushed_keys = self.metrics.counter("chiru_redis_flushed_keys_total",
+                                                  "Keys written from the write queue.")
+
         # Init now, so the loop is created here.
         super().__init__(*args, **kwargs)
 
         if self.config.get("self_bot"):
             self._skip_check = discord.User.__ne__
 
+        # Static command prefixes, or None if they can only be worked out per message.
+        self._prefixes = self._build_prefix_table()
+        # Server ID -> custom prefix followed by the static ones, longest first.
+        self._server_prefixes = {}
+
         self._redis = None
+        self._redis_lock = asyncio.Lock(loop=self.loop)
+
+        redis_cfg = self.config.get("redis", {})
+        # Seconds before a redis call (including connecting) is given up on.
+        self._redis_timeout = redis_cfg.get("timeout", 2.0)
+        breaker_cfg = redis_cfg.get("breaker", {})
+        self._redis_breaker = CircuitBreaker(threshold=breaker_cfg.get("threshold", 5),
+                                             reset_timeout=breaker_cfg.get("reset_timeout", 1.0),
+                                             max_reset_timeout=breaker_cfg.get("max_reset_timeout", 60.0))
+        self._redis_recovery = None
+        # Writes that couldn't be made while redis was unavailable.
+        self._pending_writes = PendingWrites()
+        self._max_pending_writes = redis_cfg.get("max_pending_writes", 10000)
+        self._write_batch_size = redis_cfg.get("write_batch_size", 500)
+        self._flush_lock = asyncio.Lock(loop=self.loop)
+        self._flush_task = None
+        self._flush_handle = None
+        self._shutdown_flush_timeout = redis_cfg.get("shutdown_flush_timeout", 10.0)
+
+        # Write-behind: buffer every config write in self._pending_writes, and flush them in batches.
+        write_behind_cfg = redis_cfg.get("write_behind", {})
+        self._write_behind = write_behind_cfg.get("enabled", False)
+        self._write_behind_interval = write_behind_cfg.get("interval", 0.05)
+        self._write_behind_max_keys = write_behind_cfg.get("max_keys", 500)
+
+        # Read-through cache in front of the config helpers.
+        cache_cfg = redis_cfg.get("cache", {})
+        self._config_cache = LRUCache(maxsize=cache_cfg.get("size", 4096), ttl=cache_cfg.get("ttl", 60))
+        # Used to ignore our own invalidation messages.
+        self._instance_id = uuid.uuid4().hex
+        self._invalidation_task = None
+        # Bumped whenever a cached key is written or invalidated, so a read that raced with a write doesn't cache
+        # the value it read from before the write.
+        self._write_generation = 0
+        # Key -> generation of its last write. Only reads in flight need it, so old keys can be evicted.
+        self._key_generations = LRUCache(maxsize=cache_cfg.get("size", 4096))
+
+        # Outbound messages go through a rate-limited per-channel queue.
+        queue_cfg = self.config.get("send_queue", {})
+        self.send_queue = MessageQueue(self._send_message_now, self.loop,
+                                       rate=queue_cfg.get("rate", 5), per=queue_cfg.get("per", 5.0),
+                                       merge=queue_cfg.get("merge", True))
+
+        # Shared HTTP client for everything that isn't the Discord API.
+        http_cfg = self.config.get("http", {})
+        self.http_client = HTTPClient(self.loop, connections=http_cfg.get("connections", 20),
+                                      timeout=http_cfg.get("timeout", 30),
+                                      max_size=http_cfg.get("max_size", 8 * 1024 * 1024),
+                                      cache_size=http_cfg.get("cache_size", 64))
+
+        # Event loop lag monitor.
+        monitor_cfg = self.config.get("loop_monitor", {})
+        if monitor_cfg.get("debug", False):
+            # Logs every callback that takes longer than slow_callback_duration, through the asyncio logger.
+            self.loop.set_debug(True)
+            self.loop.slow_callback_duration = monitor_cfg.get("slow_callback_duration", 0.1)
+        self.loop_monitor = LoopMonitor(self.loop, interval=monitor_cfg.get("interval", 0.25),
+                                        threshold=monitor_cfg.get("threshold", 0.1),
+                                        max_offenders=monitor_cfg.get("max_offenders", 256), metrics=self.metrics)
+        if monitor_cfg.get("enabled", True):
+            self.loop_monitor.start()
+
+        self.profiler = Profiler(self.loop)
+        self.heap = HeapTracker(self.loop)
+
+        self.metrics.gauge("chiru_send_queue_depth", "Messages waiting to be sent.",
+                           callback=lambda: self.send_queue.depth)
+        self.metrics.gauge("chiru_config_cache_entries", "Entries in the config cache.",
+                           callback=lambda: len(self._config_cache))
+        self.metrics.counter("chiru_config_cache_hits_total", "Config cache hits.",
+                             callback=lambda: self._config_cache.hits)
+        self.metrics.counter("chiru_config_cache_misses_total", "Config cache misses.",
+                             callback=lambda: self._config_cache.misses)
+        self.metrics.counter("chiru_config_cache_stale_hits_total", "Config reads served from expired cache entries.",
+                             callback=lambda: self._config_cache.stale_hits)
+        self.metrics.gauge("chiru_redis_breaker_open", "1 while the redis circuit breaker is open.",
+                           callback=lambda: int(self._redis_breaker.state != CircuitBreaker.CLOSED))
+        self.metrics.gauge("chiru_redis_pending_writes", "Keys with writes waiting for redis.",
+                           callback=lambda: len(self._pending_writes))
+        self.metrics.gauge("chiru_servers", "Servers the bot is in.",
+                           callback=lambda: len(self.servers))
 
         # Create a new Kyoukai web server.
         self._webserver = Kyoukai("chiru")
@@ -109,15 +263,37 @@ class Chiru(Bot):
         self._webserver.before_request(self.before_request)
         root = self._webserver.root.wrap_route("/", self.root)
         self._webserver.root.add_route(root)
+        metrics = self._webserver.root.wrap_route("/metrics", self.metrics_route)
+        self._webserver.root.add_route(metrics)
+        loop_stats = self._webserver.root.wrap_route("/loop", self.loop_route)
+        self._webserver.root.add_route(loop_stats)
+        shards = self._webserver.root.wrap_route("/shards", self.shards_route)
+        self._webserver.root.add_route(shards)
+        profile = self._webserver.root.wrap_route("/profile", self.profile_route)
+        self._webserver.root.add_route(profile)
+        heap = self._webserver.root.wrap_route("/heap", self.heap_route)
+        self._webserver.root.add_route(heap)
 
         self.start_time = time.time()
+        # Set by shutdown(), so main() exits without being restarted.
+        self._shutdown_requested = False
 
         self.app_id = ""
         self.owner_id = ""
 
+        # Extension name -> seconds taken to import it and to run its setup.
+        self.extension_timings = {}
+        # Import the extensions while we connect, so on_ready only has to run their setup.
+        self._preload_task = self.loop.create_task(self.preload_extensions(self.extension_names))
+
         # Create the rotation background task.
         self.loop.create_task(self._rotate_game_text())
 
+        if self.shard_id is not None:
+            shard_cfg = self.config.get("shards", {})
+            self._shard_status_interval = shard_cfg.get("status_interval", 15)
+            self.loop.create_task(self._report_shard_status())
+
     async def _rotate_game_text(self):
         """
         Coroutine to rotate the game text.
@@ -128,13 +304,267 @@ class Chiru(Bot):
             await self.change_presence(game=discord.Game(name=random.choice(texts)))
             await asyncio.sleep(15)
 
+    def shard_status(self) -> dict:
+        return {
+            "shard_id": self.shard_id,
+            "shard_count": self.shard_count,
+            "pid": os.getpid(),
+            "ready": self.is_logged_in and self.user is not None,
+            "servers": len(self.servers),
+            "uptime": time.time() - self.start_time,
+            "loop_lag_p99": self.loop_monitor.percentiles(99)[99],
+            "send_queue_depth": self.send_queue.depth,
+            "updated": time.time()
+        }
+
+    async def _report_shard_status(self):
+        """
+        Periodically write the status of this shard to redis.
+
+        The key expires after a few missed updates, so shards that have died drop out of /shards.
+        """
+        key = SHARD_STATUS_KEY.format(self.shard_id)
+        while not self.is_closed:
+            async def _set(conn: aioredis.Redis):
+                await conn.set(key, json.dumps(self.shard_status()), expire=self._shard_status_interval * 4)
+
+            try:
+                await self._execute(_set)
+            except Exception as e:
+                self.logger.warning("Could not write shard status: {}".format(e))
+
+            await asyncio.sleep(self._shard_status_interval)
+
+    @property
+    def extension_names(self) -> list:
+        return initial_extensions + self.config.get("autoload", [])
+
+    def _import_extension(self, name: str) -> float:
+        start = time.perf_counter()
+        importlib.import_module(name)
+        return time.perf_counter() - start
+
+    async def preload_extensions(self, names: list):
+        """
+        Import extensions in a thread pool, without running their setup.
+
+        Failures are only logged here; load_extension imports the module again and raises the error properly.
+        """
+        names = [name for name in names if name not in sys.modules]
+        if not names:
+            return
+
+        executor = ThreadPoolExecutor(max_workers=self.config.get("extension_workers", 4))
+        try:
+            futures = [self.loop.run_in_executor(executor, self._import_extension, name) for name in names]
+            results = await asyncio.gather(*futures, loop=self.loop, return_exceptions=True)
+        finally:
+            executor.shutdown(wait=False)
+
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                self.logger.warning("Could not pre-import extension `{}`: {}".format(name, result))
+            else:
+                self.extension_timings.setdefault(name, {})["import"] = result
+
+    def load_extension(self, name: str):
+        """
+        Load an extension, recording how long its import and setup take.
+        """
+        if name in self.extensions:
+            return
+
+        timings = self.extension_timings.setdefault(name, {})
+        if name not in sys.modules:
+            timings["import"] = self._import_extension(name)
+
+        start = time.perf_counter()
+        super().load_extension(name)
+        timings["setup"] = time.perf_counter() - start
+
+    def _build_prefix_table(self):
+        """
+        Build the tuple of command prefixes used by the fast path of `process_commands`.
+        """
+        prefix = self.command_prefix
+        if callable(prefix):
+            if prefix is not _get_command_prefix:
+                # Arbitrary callables may depend on the message.
+                return None
+            prefix = prefix(self, None)
+
+        if isinstance(prefix, str):
+            return (prefix,)
+
+        return tuple(prefix)
+
+    def _set_prefix_entry(self, server_id: str, prefix: str = None):
+        # Blank prefixes stored before they were rejected would match every message.
+        if prefix is None or not prefix.strip() or self._prefixes is None:
+            self._server_prefixes.pop(server_id, None)
+            return
+
+        # Longest first, so a short custom prefix doesn't shadow a longer one.
+        self._server_prefixes[server_id] = tuple(sorted(set((prefix,) + self._prefixes), key=len, reverse=True))
+
+    async def load_prefixes(self):
+        """
+        Load the custom prefixes of every server into the prefix table.
+        """
+        # Falls back to cached prefixes if redis is down; they are loaded again once it recovers.
+        prefixes = await self.get_config_for_servers(self.servers, "prefix")
+        self._server_prefixes.clear()
+        for server_id, prefix in prefixes.items():
+            self._set_prefix_entry(server_id, prefix)
+
+        self.logger.info("Loaded {} custom prefixes.".format(len(prefixes)))
+
+    def get_server_prefix(self, server: discord.Server):
+        """
+        Get the custom prefix of a server, or None if it uses the default.
+        """
+        prefixes = self._server_prefixes.get(server.id)
+        if prefixes is None:
+            return None
+
+        return next((p for p in prefixes if p not in self._prefixes), None)
+
+    @staticmethod
+    def check_prefix(prefix: str):
+        """
+        Check that a custom prefix is usable.
+
+        :raises ValueError: If it is blank, too long, or could be mistaken for a mention.
+        """
+        if not prefix.strip():
+            # Every message starts with it, so all chat would be parsed as commands.
+            raise ValueError("The prefix can't be empty or only whitespace.")
+
+        if len(prefix) > MAX_PREFIX_LENGTH:
+            raise ValueError("The prefix can't be longer than {} characters.".format(MAX_PREFIX_LENGTH))
+
+        if "<@" in prefix or "<#" in prefix or prefix.startswith(("@everyone", "@here")):
+            raise ValueError("The prefix can't contain a mention.")
+
+    async def set_server_prefix(self, server: discord.Server, prefix: str = None):
+        """
+        Set the custom prefix of a server, or reset it to the default with None.
+
+        :raises ValueError: If the prefix isn't usable.
+        """
+        if prefix is not None:
+            self.check_prefix(prefix)
+
+        if prefix is None:
+            await self.delete_config(server, "prefix")
+        else:
+            await self.set_config(server, "prefix", prefix)
+
+        self._set_prefix_entry(server.id, prefix)
+
     @property
     def is_self_bot(self):
         return self.config.get("self_bot", False)
 
+    @property
+    def config_cache(self) -> LRUCache:
+        return self._config_cache
+
+    def redis_status(self) -> dict:
+        return {
+            "breaker": self._redis_breaker.state,
+            "failures": self._redis_breaker.failures,
+            "times_opened": self._redis_breaker.opened,
+            "retry_in": self._redis_breaker.retry_in,
+            "write_behind": self._write_behind,
+            "pending_keys": len(self._pending_writes),
+            "pending_writes": self._pending_writes.size,
+            "queued": self._pending_writes.queued,
+            "merged": self._pending_writes.merged,
+            "stale_hits": self._config_cache.stale_hits
+        }
+
     async def root(self, r: HTTPRequestContext):
         return "Chiru OK!", 200, {"X-Bot": "Chiru"}
 
+    async def metrics_route(self, r: HTTPRequestContext):
+        return self.metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+    async def loop_route(self, r: HTTPRequestContext):
+        if not self._authorized(r):
+            return "Forbidden", 403, {}
+
+        return json.dumps(self.loop_monitor.stats()), 200, {"Content-Type": "application/json"}
+
+    async def shards_route(self, r: HTTPRequestContext):
+        if self.shard_id is None:
+            # Not sharded, so there are no other shards to ask about.
+            return json.dumps([self.shard_status()]), 200, {"Content-Type": "application/json"}
+
+        shard_count = self.shard_count
+
+        async def _mget(conn: aioredis.Redis):
+            return await conn.mget(*[SHARD_STATUS_KEY.format(i) for i in range(shard_count)])
+
+        try:
+            values = await self._execute(_mget)
+        except RedisUnavailable as e:
+            return str(e), 503, {}
+
+        shards = []
+        for shard_id, value in enumerate(values):
+            if value is None:
+                shards.append({"shard_id": shard_id, "ready": False, "down": True})
+            else:
+                shards.append(json.loads(value.decode() if isinstance(value, bytes) else value))
+
+        return json.dumps(shards), 200, {"Content-Type": "application/json"}
+
+    def _authorized(self, r: HTTPRequestContext) -> bool:
+        """
+        Check the token of a request to a protected route.
+
+        The token can be given as `Authorization: Bearer <token>`, or as the `token` query argument.
+        Protected routes are disabled if no token is configured.
+        """
+        expected = self.config.get("webserver", {}).get("token")
+        if not expected:
+            return False
+
+        given = r.request.headers.get("Authorization", "")
+        if given.startswith("Bearer "):
+            given = given[len("Bearer "):]
+        else:
+            given = r.request.args.get("token", "")
+
+        return hmac.compare_digest(given.encode(), str(expected).encode())
+
+    async def profile_route(self, r: HTTPRequestContext):
+        if not self._authorized(r):
+            return "Forbidden", 403, {}
+
+        try:
+            seconds = float(r.request.args.get("seconds", 10))
+        except ValueError:
+            return "Bad seconds", 400, {}
+
+        seconds = max(0.1, min(seconds, self.config.get("webserver", {}).get("max_profile_seconds", 300)))
+        try:
+            result = await self.profiler.profile(seconds, r.request.args.get("mode", "cprofile"))
+        except ProfilerBusy as e:
+            return str(e), 409, {}
+        except ValueError as e:
+            return str(e), 400, {}
+
+        return result.data, 200, {"Content-Type": "application/octet-stream",
+                                  "Content-Disposition": 'attachment; filename="{}"'.format(result.filename)}
+
+    async def heap_route(self, r: HTTPRequestContext):
+        if not self._authorized(r):
+            return "Forbidden", 403, {}
+
+        return json.dumps(await self.heap.summary()), 200, {"Content-Type": "application/json"}
+
     async def before_request(self, r: HTTPRequestContext):
         r.request.extra["bot"] = self
         return r
@@ -147,110 +577,695 @@ class Chiru(Bot):
 
     # region Redis
 
+    # While redis is down or slow, reads are served from the cache (expired entries included) and writes are queued in
+    # self._pending_writes, to be written once it recovers. Reads always see the queued writes on top.
+
+    def _redis_options(self) -> tuple:
+        redis_cfg = self.config.get("redis", {})
+        return redis_cfg["host"], redis_cfg["port"], redis_cfg.get("db", 0), redis_cfg.get("password")
+
     async def _connect_redis(self):
         """
         Connect to redis.
+
+        If it can't be reached, the circuit breaker is opened and the connection is retried in the background.
         """
-        host = self.config.get("redis")["host"]
-        port = self.config.get("redis")["port"]
-        password = self.config.get("redis", {}).get("password")
-        db = self.config.get("redis", {}).get("db", 0)
+        host, port, db, password = self._redis_options()
         self.logger.info("Connecting to redis://{}:{}/{}...".format(host, port, db))
         try:
-            redis_pool = await aioredis.create_pool(
-                (host, port),
-                db=db, password=password
-            )
-        except ConnectionRefusedError:
-            self.logger.error("Could not connect to redis server.")
-            self.logger.error("Exiting.")
-            await self.logout()
+            redis_pool = await asyncio.wait_for(aioredis.create_pool((host, port), db=db, password=password),
+                                                self._redis_timeout, loop=self.loop)
+        except (OSError, asyncio.TimeoutError, aioredis.RedisError) as e:
+            self.logger.error("Could not connect to redis server: {!r}".format(e))
+            self._redis_failed(trip=True)
             return
         else:
             self.logger.info("Established Redis connection.")
         self._redis = redis_pool
         self.logger.info("Connected to redis.")
 
+        self._start_invalidation_listener()
+
         return self._redis
 
     async def get_redis(self) -> aioredis.RedisPool:
+        """
+        Get the redis pool, connecting first if needed.
+
+        :return: The pool, or None if redis could not be reached.
+        """
         if self._redis is None:
-            await self._connect_redis()
+            async with self._redis_lock:
+                if self._redis is None:
+                    await self._connect_redis()
 
         return self._redis
 
+    async def _run_redis(self, func):
+        pool = await self.get_redis()
+        if pool is None:
+            raise ConnectionError("Not connected to redis.")
+
+        async with pool.get() as conn:
+            assert isinstance(conn, aioredis.Redis)
+            return await func(conn)
+
+    async def _execute(self, func):
+        """
+        Run `func(conn)` on a pooled connection, through the circuit breaker and with a timeout.
+
+        :raises RedisUnavailable: If the breaker is open, or redis failed or timed out.
+        """
+        if not self._redis_breaker.allow():
+            raise RedisUnavailable("Redis is unavailable; retrying in {:.1f} seconds.".format(
+                self._redis_breaker.retry_in))
+
+        try:
+            result = await asyncio.wait_for(self._run_redis(func), self._redis_timeout, loop=self.loop)
+        except aioredis.ReplyError:
+            # Redis answered, so it's up.
+            self._redis_succeeded()
+            raise
+        except _REDIS_FAILURES as e:
+            self._redis_failed()
+            raise RedisUnavailable("Redis call failed: {!r}".format(e)) from e
+        except BaseException:
+            # Cancelled, or a bug in func; don't leave the breaker waiting on this call forever.
+            self._redis_breaker.release()
+            raise
+
+        self._redis_succeeded()
+        return result
+
+    def _redis_succeeded(self):
+        if self._redis_breaker.record_success():
+            self.logger.info("Redis has recovered.")
+            self.loop.create_task(self._redis_recovered())
+
+    def _redis_failed(self, trip: bool = False):
+        if trip:
+            self._redis_breaker.trip()
+            opened = True
+        else:
+            opened = self._redis_breaker.record_failure()
+
+        if opened:
+            self.logger.error("Redis is unavailable; serving cached config and queueing writes. "
+                              "Retrying in {:.1f} seconds.".format(self._redis_breaker.retry_in))
+
+        if self._redis_breaker.state != CircuitBreaker.CLOSED and \
+                (self._redis_recovery is None or self._redis_recovery.done()):
+            self._redis_recovery = self.loop.create_task(self._recover_redis())
+
+    @staticmethod
+    async def _ping(conn: aioredis.Redis):
+        return await conn.ping()
+
+    async def _recover_redis(self):
+        """
+        Probe redis whenever the breaker allows it, until it closes again.
+        """
+        while self._redis_breaker.state != CircuitBreaker.CLOSED and not self.is_closed:
+            await asyncio.sleep(max(self._redis_breaker.retry_in, 0.1), loop=self.loop)
+            try:
+                await self._execute(self._ping)
+            except RedisUnavailable:
+                pass
+
+    async def _redis_recovered(self):
+        """
+        Catch up after an outage.
+        """
+        # Invalidations were missed while we were disconnected, so fetch everything again; the old values are kept
+        # for stale reads.
+        self._config_cache.expire_all()
+        self._start_invalidation_listener()
+
+        try:
+            written = await self.flush_writes()
+            if written:
+                self.logger.info("Wrote {} keys that were queued during the outage.".format(written))
+            await self.load_prefixes()
+        except RedisUnavailable as e:
+            self.logger.warning("Redis failed again while catching up: {}".format(e))
+
+    def _start_invalidation_listener(self):
+        if self._invalidation_task is None or self._invalidation_task.done():
+            self._invalidation_task = self.loop.create_task(self._listen_invalidations(*self._redis_options()))
+
+    async def _listen_invalidations(self, host, port, db, password):
+        """
+        Evict cached keys that other processes have written to.
+
+        If the subscription drops, it is made again with backoff. Invalidations sent in the meantime are lost, so the
+        whole cache is expired every time it subscribes.
+        """
+        delay = 1.0
+        while not self.is_closed:
+            try:
+                conn = await aioredis.create_redis((host, port), db=db, password=password)
+            except (OSError, aioredis.RedisError) as e:
+                self.logger.error("Could not subscribe to cache invalidations ({!r}); retrying in {:.0f} "
+                                  "seconds.".format(e, delay))
+            else:
+                try:
+                    channel, = await conn.subscribe(INVALIDATION_CHANNEL)
+                    # Anything cached before now may have missed an invalidation.
+                    self._config_cache.expire_all()
+                    delay = 1.0
+
+                    while await channel.wait_message():
+                        msg = await channel.get(encoding="utf-8")
+                        sender, *keys = msg.split("\n")
+                        if sender == self._instance_id:
+                            continue
+
+                        self._touch_keys(*keys)
+                        for key in keys:
+                            self._config_cache.pop(key)
+                except (OSError, aioredis.RedisError) as e:
+                    self.logger.warning("Lost the cache invalidation subscription: {!r}".format(e))
+                finally:
+                    conn.close()
+
+                if self.is_closed:
+                    break
+                self.logger.warning("Cache invalidation subscription closed; resubscribing in {:.0f} "
+                                    "seconds.".format(delay))
+
+            await asyncio.sleep(delay, loop=self.loop)
+            delay = min(delay * 2, 60.0)
+
+    def _touch_keys(self, *keys: str):
+        """
+        Record that keys have been written to, for `_written_since`.
+        """
+        self._write_generation += 1
+        for key in keys:
+            self._key_generations.set(key, self._write_generation)
+
+    def _written_since(self, key: str, generation: int) -> bool:
+        """
+        Check if a key has been written to since `self._write_generation` was `generation`.
+
+        Reads use this to avoid caching a value they fetched before a concurrent write landed.
+        """
+        return self._key_generations.get(key, 0) > generation
+
+    async def _publish_invalidation(self, conn: aioredis.Redis, *keys: str):
+        """
+        Tell other processes to evict the specified keys from their cache.
+        """
+        await conn.publish(INVALIDATION_CHANNEL, "\n".join((self._instance_id,) + keys))
+
+    async def _write(self, keys: tuple, direct, queue):
+        """
+        Write to redis, or queue the write if write-behind is enabled or redis is unavailable.
+
+        Writes to keys that already have writes queued are queued behind them, so they land in order.
+
+        :param direct: Coroutine function taking a connection, that makes the write.
+        :param queue: Callable that queues the write and updates the cache.
+        :return: The result of `direct`, or None if the write was queued.
+        """
+        pending = [key in self._pending_writes for key in keys]
+        if not self._write_behind and not any(pending):
+            try:
+                return await self._execute(direct)
+            except RedisUnavailable:
+                pass
+            finally:
+                self._touch_keys(*keys)
+
+        if not all(pending) and len(self._pending_writes) + len(keys) > self._max_pending_writes:
+            raise RedisUnavailable("Too many writes are queued.")
+
+        queue()
+        self._touch_keys(*keys)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._redis_breaker.state != CircuitBreaker.CLOSED:
+            # The recovery task flushes once redis is back.
+            return
+
+        if self._write_behind and len(self._pending_writes) < self._write_behind_max_keys:
+            # Give more writes a chance to be batched up first.
+            if self._flush_handle is None:
+                self._flush_handle = self.loop.call_later(self._write_behind_interval, self._start_flush)
+            return
+
+        self._start_flush()
+
+    def _start_flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        # A running flush keeps going until the queue is empty, so it picks up anything queued since it started.
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = self.loop.create_task(self._flush_quietly())
+
+    async def _flush_quietly(self):
+        try:
+            await self.flush_writes()
+        except RedisUnavailable as e:
+            self.logger.warning("Could not write queued keys: {}".format(e))
+
+    def _overlay_cached(self, key: str, overlay, convert=None):
+        """
+        Apply the queued writes of a key to its cached value, if it is fresh, so it is still right once they land.
+        """
+        cached = self._config_cache.get(key)
+        if cached is not MISSING:
+            value = overlay(key, cached)
+            self._config_cache.set(key, value if convert is None else convert(value))
+
+    async def _write_batch(self, batch: dict, conn: aioredis.Redis):
+        pipe = conn.pipeline()
+        invalidated = []
+        for key, entry in batch.items():
+            for name, args, kwargs in entry.commands():
+                getattr(pipe, name)(key, *args, **kwargs)
+
+            invalidated.append(key)
+            invalidated += ["{}#{}".format(key, field) for field in entry.fields]
+            invalidated += ["{}#{}".format(key, field) for field in entry.deleted_fields]
+
+        pipe.publish(INVALIDATION_CHANNEL, "\n".join([self._instance_id] + invalidated))
+        results = await pipe.execute(return_exceptions=True)
+
+        for result in results:
+            if isinstance(result, aioredis.ReplyError):
+                # Retrying won't help (e.g. WRONGTYPE), so drop the write.
+                self.logger.error("Queued redis write failed: {}".format(result))
+            elif isinstance(result, Exception):
+                # The connection went away part way; every command is idempotent, so the whole batch is retried.
+                raise result
+
+    async def flush_writes(self) -> int:
+        """
+        Write the queued writes to redis, in pipelined batches.
+
+        :return: The number of keys written.
+        :raises RedisUnavailable: If redis fails part way. Keys that weren't written stay queued.
+        """
+        written = 0
+        async with self._flush_lock:
+            while self._pending_writes:
+                batch = self._pending_writes.take(self._write_batch_size)
+                try:
+                    await self._execute(functools.partial(self._write_batch, batch))
+                except BaseException:
+                    self._pending_writes.restore(batch)
+                    raise
+
+                self._pending_writes.finish()
+                # Reads that started before this batch landed no longer see it in the overlay.
+                self._touch_keys(*batch)
+                self._flushed_keys.inc(amount=len(batch))
+                written += len(batch)
+
+        return written
+
+    @_timed_redis
     async def get_set(self, server: discord.Server, key: str):
         """
         Gets a set from redis.
         """
-        async with (await self.get_redis()).get() as conn:
-            assert isinstance(conn, aioredis.Redis)
-            built = "cfg:{}:{}".format(server.id, key)
-            x = await conn.smembers(built)
-
-            m = []
-            # Decode values, if we can.
-            for _ in x:
-                if isinstance(_, bytes):
-                    m.append(_.decode())
-                else:
-                    m.append(_)
+        built = "cfg:{}:{}".format(server.id, key)
+        cached = self._config_cache.get(built)
+        if cached is not MISSING:
+            return self._pending_writes.members(built, list(cached))
+
+        async def _smembers(conn: aioredis.Redis):
+            return await conn.smembers(built)
 
-            return m
+        generation = self._write_generation
+        try:
+            x = await self._execute(_smembers)
+        except RedisUnavailable:
+            return self._pending_writes.members(built, list(self._config_cache.get_stale(built, ())))
+
+        m = []
+        # Decode values, if we can.
+        for _ in x:
+            if isinstance(_, bytes):
+                m.append(_.decode())
+            else:
+                m.append(_)
+
+        m = self._pending_writes.members(built, m)
+        if not self._written_since(built, generation):
+            self._config_cache.set(built, tuple(m))
+        return m
 
+    @_timed_redis
     async def add_to_set(self, server: discord.Server, key: str, item: str):
         """
         Add an item to a set.
+
+        :return: The number of items added, or None if the write was queued.
         """
-        async with (await self.get_redis()).get() as conn:
-            assert isinstance(conn, aioredis.Redis)
-            built = "cfg:{}:{}".format(server.id, key)
+        built = "cfg:{}:{}".format(server.id, key)
+
+        async def _sadd(conn: aioredis.Redis):
             x = await conn.sadd(built, item.encode())
 
+            self._config_cache.pop(built)
+            await self._publish_invalidation(conn, built)
             return x
 
+        def _queue():
+            self._pending_writes.sadd(built, item)
+            self._overlay_cached(built, lambda k, v: self._pending_writes.members(k, list(v)), tuple)
+
+        return await self._write((built,), _sadd, _queue)
+
+    @_timed_redis
     async def remove_from_set(self, server: discord.Server, key: str, item: str):
         """
         Removes an item from a set.
+
+        :return: The number of items removed, or None if the write was queued.
         """
-        async with (await self.get_redis()).get() as conn:
-            assert isinstance(conn, aioredis.Redis)
-            built = "cfg:{}:{}".format(server.id, key)
+        built = "cfg:{}:{}".format(server.id, key)
+
+        async def _srem(conn: aioredis.Redis):
             x = await conn.srem(built, item.encode())
 
+            self._config_cache.pop(built)
+            await self._publish_invalidation(conn, built)
+            return x
+
+        def _queue():
+            self._pending_writes.srem(built, item)
+            self._overlay_cached(built, lambda k, v: self._pending_writes.members(k, list(v)), tuple)
+
+        return await self._write((built,), _srem, _queue)
+
+    @_timed_redis
+    async def get_hash(self, server: discord.Server, key: str) -> dict:
+        """
+        Gets a hash from redis.
+        """
+        built = "cfg:{}:{}".format(server.id, key)
+        cached = self._config_cache.get(built)
+        if cached is not MISSING:
+            return dict(self._pending_writes.hash(built, cached))
+
+        async def _hgetall(conn: aioredis.Redis):
+            return await conn.hgetall(built)
+
+        generation = self._write_generation
+        try:
+            x = await self._execute(_hgetall)
+        except RedisUnavailable:
+            return dict(self._pending_writes.hash(built, self._config_cache.get_stale(built, {})))
+
+        m = {}
+        # Decode fields and values, if we can.
+        for field, value in x.items():
+            if isinstance(field, bytes):
+                field = field.decode()
+            if isinstance(value, bytes):
+                value = value.decode()
+            m[field] = value
+
+        m = self._pending_writes.hash(built, m)
+        if not self._written_since(built, generation):
+            self._config_cache.set(built, m)
+        return dict(m)
+
+    @_timed_redis
+    async def get_hash_field(self, server: discord.Server, key: str, field: str):
+        """
+        Gets a single field of a hash from redis.
+        """
+        built = "cfg:{}:{}".format(server.id, key)
+        cached = self._config_cache.get(built)
+        if cached is not MISSING:
+            return self._pending_writes.field(built, field, cached.get(field))
+
+        field_key = "{}#{}".format(built, field)
+        cached = self._config_cache.get(field_key)
+        if cached is not MISSING:
+            return self._pending_writes.field(built, field, cached)
+
+        async def _hget(conn: aioredis.Redis):
+            return await conn.hget(built, field)
+
+        generation = self._write_generation
+        try:
+            x = await self._execute(_hget)
+        except RedisUnavailable:
+            x = self._config_cache.get_stale(field_key, None)
+            if x is None:
+                x = self._config_cache.get_stale(built, {}).get(field)
+            return self._pending_writes.field(built, field, x)
+
+        if isinstance(x, bytes):
+            x = x.decode()
+
+        x = self._pending_writes.field(built, field, x)
+        # Hash writes are recorded against the whole hash.
+        if not self._written_since(built, generation) and not self._written_since(field_key, generation):
+            self._config_cache.set(field_key, x)
+        return x
+
+    @_timed_redis
+    async def set_hash_field(self, server: discord.Server, key: str, field: str, value):
+        """
+        Sets a single field of a hash.
+
+        :return: 1 if the field is new, 0 if it was updated, or None if the write was queued.
+        """
+        built = "cfg:{}:{}".format(server.id, key)
+        field_key = "{}#{}".format(built, field)
+
+        async def _hset(conn: aioredis.Redis):
+            x = await conn.hset(built, field, value)
+
+            self._config_cache.pop(built)
+            self._config_cache.set(field_key, value.decode() if isinstance(value, bytes) else str(value))
+            await self._publish_invalidation(conn, built, field_key)
+            return x
+
+        def _queue():
+            self._pending_writes.hset(built, field, value)
+            self._overlay_cached(built, self._pending_writes.hash)
+            self._config_cache.set(field_key, value.decode() if isinstance(value, bytes) else str(value))
+
+        return await self._write((built,), _hset, _queue)
+
+    @_timed_redis
+    async def delete_hash_field(self, server: discord.Server, key: str, field: str):
+        """
+        Removes a single field from a hash.
+
+        :return: The number of fields removed, or None if the write was queued.
+        """
+        built = "cfg:{}:{}".format(server.id, key)
+        field_key = "{}#{}".format(built, field)
+
+        async def _hdel(conn: aioredis.Redis):
+            x = await conn.hdel(built, field)
+
+            self._config_cache.pop(built)
+            self._config_cache.set(field_key, None)
+            await self._publish_invalidation(conn, built, field_key)
             return x
 
+        def _queue():
+            self._pending_writes.hdel(built, field)
+            self._overlay_cached(built, self._pending_writes.hash)
+            self._config_cache.set(field_key, None)
+
+        return await self._write((built,), _hdel, _queue)
+
+    @_timed_redis
     async def get_config(self, server: discord.Server, key: str):
         """
         Get a server config key.
         """
-        async with (await self.get_redis()).get() as conn:
-            assert isinstance(conn, aioredis.Redis)
-            built = "cfg:{}:{}".format(server.id, key)
-            x = await conn.get(built)
-            if isinstance(x, bytes):
-                return x.decode()
-            return x
+        return await self._get_key("cfg:{}:{}".format(server.id, key))
 
+    @_timed_redis
     async def get_key(self, key: str):
-        async with (await self.get_redis()).get() as conn:
-            assert isinstance(conn, aioredis.Redis)
-            x = await conn.get(key)
-            if isinstance(x, bytes):
-                return x.decode()
-            return x
+        return await self._get_key(key)
+
+    async def _get_key(self, key: str):
+        cached = self._config_cache.get(key)
+        if cached is not MISSING:
+            return self._pending_writes.string(key, cached)
+
+        async def _get(conn: aioredis.Redis):
+            return await conn.get(key)
+
+        generation = self._write_generation
+        try:
+            x = await self._execute(_get)
+        except RedisUnavailable:
+            return self._pending_writes.string(key, self._config_cache.get_stale(key, None))
+
+        if isinstance(x, bytes):
+            x = x.decode()
+
+        x = self._pending_writes.string(key, x)
+        if not self._written_since(key, generation):
+            self._config_cache.set(key, x)
+        return x
 
+    @_timed_redis
     async def set_config(self, server: discord.Server, key: str, value, **kwargs):
-        async with (await self.get_redis()).get() as conn:
-            assert isinstance(conn, aioredis.Redis)
-            built = "cfg:{}:{}".format(server.id, key)
-            return await conn.set(built, value, **kwargs)
+        built = "cfg:{}:{}".format(server.id, key)
+
+        def _update_cache():
+            if kwargs:
+                # Expiry options; let the next read fetch it again.
+                self._config_cache.pop(built)
+            else:
+                self._config_cache.set(built, value.decode() if isinstance(value, bytes) else str(value))
+
+        async def _set(conn: aioredis.Redis):
+            result = await conn.set(built, value, **kwargs)
+
+            _update_cache()
+            await self._publish_invalidation(conn, built)
+            return result
 
+        def _queue():
+            self._pending_writes.set(built, value, **kwargs)
+            _update_cache()
+
+        return await self._write((built,), _set, _queue)
+
+    @_timed_redis
+    async def get_config_for_servers(self, servers, key: str, batch_size: int = 1000) -> dict:
+        """
+        Get the same config key for many servers, in batched MGETs.
+
+        :return: A dict of server ID -> value, for the servers that have the key set.
+        """
+        result = {}
+        server_ids = [server.id for server in servers]
+
+        for i in range(0, len(server_ids), batch_size):
+            batch = server_ids[i:i + batch_size]
+            built = ["cfg:{}:{}".format(server_id, key) for server_id in batch]
+
+            async def _mget(conn: aioredis.Redis):
+                return await conn.mget(*built)
+
+            generation = self._write_generation
+            try:
+                values = await self._execute(_mget)
+            except RedisUnavailable:
+                values = [self._config_cache.get_stale(full_key, None) for full_key in built]
+                fetched = False
+            else:
+                fetched = True
+
+            for server_id, full_key, x in zip(batch, built, values):
+                if isinstance(x, bytes):
+                    x = x.decode()
+                x = self._pending_writes.string(full_key, x)
+                if fetched and not self._written_since(full_key, generation):
+                    self._config_cache.set(full_key, x)
+                if x is not None:
+                    result[server_id] = x
+
+        return result
+
+    @_timed_redis
+    async def get_many_config(self, server: discord.Server, keys: list) -> dict:
+        """
+        Get several server config keys in a single round trip.
+        """
+        result = {}
+        missing = []
+        for key in keys:
+            full_key = "cfg:{}:{}".format(server.id, key)
+            cached = self._config_cache.get(full_key)
+            if cached is MISSING:
+                missing.append(key)
+            else:
+                result[key] = self._pending_writes.string(full_key, cached)
+
+        if not missing:
+            return result
+
+        built = ["cfg:{}:{}".format(server.id, key) for key in missing]
+
+        async def _mget(conn: aioredis.Redis):
+            return await conn.mget(*built)
+
+        generation = self._write_generation
+        try:
+            values = await self._execute(_mget)
+        except RedisUnavailable:
+            for key, full_key in zip(missing, built):
+                result[key] = self._pending_writes.string(full_key, self._config_cache.get_stale(full_key, None))
+            return result
+
+        for key, full_key, x in zip(missing, built, values):
+            if isinstance(x, bytes):
+                x = x.decode()
+            x = self._pending_writes.string(full_key, x)
+            if not self._written_since(full_key, generation):
+                self._config_cache.set(full_key, x)
+            result[key] = x
+
+        return result
+
+    @_timed_redis
+    async def set_many_config(self, server: discord.Server, mapping: dict):
+        """
+        Set several server config keys in a single round trip.
+        """
+        if not mapping:
+            return
+
+        built = ["cfg:{}:{}".format(server.id, key) for key in mapping]
+
+        def _update_cache():
+            for full_key, value in zip(built, mapping.values()):
+                self._config_cache.set(full_key, value.decode() if isinstance(value, bytes) else str(value))
+
+        async def _mset(conn: aioredis.Redis):
+            pairs = []
+            for full_key, value in zip(built, mapping.values()):
+                pairs += [full_key, value]
+
+            result = await conn.mset(*pairs)
+
+            _update_cache()
+            await self._publish_invalidation(conn, *built)
+            return result
+
+        def _queue():
+            for full_key, value in zip(built, mapping.values()):
+                self._pending_writes.set(full_key, value)
+            _update_cache()
+
+        return await self._write(tuple(built), _mset, _queue)
+
+    @_timed_redis
     async def delete_config(self, server: discord.Server, key: str):
-        async with (await self.get_redis()).get() as conn:
-            assert isinstance(conn, aioredis.Redis)
-            built = "cfg:{}:{}".format(server.id, key)
-            return await conn.delete(built)
+        built = "cfg:{}:{}".format(server.id, key)
+
+        async def _delete(conn: aioredis.Redis):
+            result = await conn.delete(built)
+
+            self._config_cache.set(built, None)
+            await self._publish_invalidation(conn, built)
+            return result
+
+        def _queue():
+            self._pending_writes.delete(built)
+            self._config_cache.set(built, None)
+
+        return await self._write((built,), _delete, _queue)
 
     # endregion
 
@@ -264,22 +1279,30 @@ class Chiru(Bot):
             self.logger.info("Invite link: {}".format(discord.utils.oauth_url(self.app_id)))
         except discord.Forbidden:
             self.owner_id = self.user.id
-        redis = await self.get_redis()
-        if not redis:
-            return
+        # If this fails, the breaker is opened and the connection is retried in the background.
+        await self.get_redis()
+
+        await self.load_prefixes()
+
+        await self._preload_task
 
-        extensions = initial_extensions + self.config.get("autoload", [])
+        for cog in self.extension_names:
+            if cog in self.extensions:
+                # Already loaded; on_ready fires again after every reconnect.
+                continue
 
-        for cog in extensions:
             try:
                 self.load_extension(cog)
             except Exception as e:
                 self.logger.critical("Could not load extension `{}`".format(cog, e))
                 self.logger.exception()
             else:
-                self.logger.info("Loaded extension {}.".format(cog))
+                timings = self.extension_timings[cog]
+                self.logger.info("Loaded extension {} (import {:.3f}s, setup {:.3f}s).".format(
+                    cog, timings.get("import", 0.0), timings["setup"]))
 
-        if not self._webserver_started:
+        # Only one shard can listen on the webserver port; the others report through redis.
+        if not self._webserver_started and not self.shard_id:
             try:
                 self.logger.info("Starting built-in webserver.")
                 component = KyoukaiComponent(self._webserver,
@@ -303,23 +1326,48 @@ class Chiru(Bot):
     def __del__(self):
         self.loop.set_exception_handler(lambda *args, **kwargs: None)
 
+    def _log_message(self, message: discord.Message):
+        """
+        Log a message, if it is picked by the sample rate of its server.
+
+        The arguments are formatted lazily, only once a handler accepts the record.
+        """
+        if message.server is None:
+            return
+
+        rate = self._server_sample_rates.get(message.server.id, self._message_sample_rate)
+        if rate < 1 and random.random() >= rate:
+            return
+
+        self.logger.info("Recieved message: {0.content} from {0.author.display_name}{1}\n"
+                         " On channel: #{0.channel.name}\n"
+                         " On server: {0.server.name} ({0.server.id})",
+                         message, " [BOT]" if message.author.bot else "")
+
+    async def on_server_join(self, server: discord.Server):
+        self._set_prefix_entry(server.id, await self.get_config(server, "prefix"))
+
+    async def on_server_remove(self, server: discord.Server):
+        self._set_prefix_entry(server.id, None)
+
+    def dispatch(self, event, *args, **kwargs):
+        self._events_seen.inc(event)
+        super().dispatch(event, *args, **kwargs)
+
     async def on_message(self, message):
-        # Print logging output.
+        self._messages_seen.inc()
 
-        if not isinstance(message.channel, discord.PrivateChannel):
-            self.logger.info("Recieved message: {message.content} from {message.author.display_name}{bot}"
-                             .format(message=message, bot=" [BOT]" if message.author.bot else ""))
-            self.logger.info(" On channel: #{message.channel.name}".format(message=message))
+        # Print logging output.
+        if self._message_log_mode == "all":
+            self._log_message(message)
 
         # Check for a valid server.
-        if message.server is not None:
-            self.logger.info(" On server: {} ({})".format(message.server.name, message.server.id))
-        else:
+        if message.server is None:
             if self.config.get("self_bot"):
                 return
             if not message.author.bot:
                 # No DMs
-                await self.send_message(message.channel, "I don't accept private messages.")
+                await self.send_message(message.channel, "I don't accept private messages.", wait=False)
                 return
 
         # Process commands
@@ -328,28 +1376,69 @@ class Chiru(Bot):
         except Exception as e:
             # Check the type of the error.
             if isinstance(e, (commands.errors.BadArgument, commands.errors.MissingRequiredArgument)):
-                await self.send_message(message.channel, ":x: Bad argument: {}".format(' '.join(e.args)))
+                await self.send_message(message.channel, ":x: Bad argument: {}".format(' '.join(e.args)),
+                                        wait=False)
                 return
             elif isinstance(e, commands.errors.CheckFailure):
                 await self.send_message(message.channel, ":x: Check failed. You probably don't have permission to do "
-                                                         "this.")
+                                                         "this.", wait=False)
                 return
             else:
                 if isinstance(e, commands.errors.CommandInvokeError):
                     lines = traceback.format_exception(type(e), e.__cause__, e.__cause__.__traceback__)
                 else:
                     lines = traceback.format_exception(type(e), e, e.__traceback__)
-                await self.send_message(message.channel, ":no_entry: An error has occurred. This has been logged.")
+                await self.send_message(message.channel, ":no_entry: An error has occurred. This has been logged.",
+                                        wait=False)
                 self.logger.error(''.join(lines))
 
-    async def send_message(self, destination, content, *, tts=False):
-        content = "\u200b{}".format(content)
+    async def _send_message_now(self, destination, content, tts):
+        content = "{}{}".format(MESSAGE_PREFIX, content)
         return await super().send_message(destination, content, tts=tts)
 
+    async def edit_message(self, message, new_content):
+        new_content = "{}{}".format(MESSAGE_PREFIX, new_content)
+        return await super().edit_message(message, new_content)
+
+    def _log_send_failure(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            self.logger.error("Could not send queued message: {}".format(future.exception()))
+
+    async def send_message(self, destination, content, *, tts=False, wait=True):
+        """
+        Queue a message to be sent.
+
+        :param wait: If True, wait for the message to be sent and return it (the last part, if it was too long and had
+            to be split; see `send_message_parts`). Otherwise, return as soon as it has been queued; the message may
+            then be merged with other queued ones.
+        """
+        future = self.send_queue.put(destination, str(content), tts=tts, merge=not wait)
+        if wait:
+            return await future
+
+        future.add_done_callback(self._log_send_failure)
+        return future
+
+    async def send_message_parts(self, destination, content, *, tts=False) -> list:
+        """
+        Send a message, and return every message it was split into.
+        """
+        return await self.send_queue.put(destination, str(content), tts=tts, parts=True)
+
     async def process_commands(self, message):
         """
         Override of process_commands to use our own context.
         """
+        # Fast path: almost every message isn't a command, so reject those before allocating anything.
+        prefixes = self._prefixes
+        if prefixes is not None:
+            if message.server is not None:
+                prefixes = self._server_prefixes.get(message.server.id, prefixes)
+
+            if not message.content.startswith(prefixes):
+                return
+
+        # Bot.say and Bot.reply look these up through the stack.
         _internal_channel = message.channel
         _internal_author = message.author
 
@@ -357,7 +1446,10 @@ class Chiru(Bot):
         if self._skip_check(message.author, self.user):
             return
 
-        prefix = await self._get_prefix(message)
+        if prefixes is not None:
+            prefix = prefixes
+        else:
+            prefix = await self._get_prefix(message)
         invoked_prefix = prefix
 
         if not isinstance(prefix, (tuple, list)):
@@ -380,16 +1472,91 @@ class Chiru(Bot):
         del tmp
 
         if invoker in self.commands:
+            if self._message_log_mode == "commands":
+                self._log_message(message)
+
             command = self.commands[invoker]
             self.dispatch('command', command, ctx)
-            await command.invoke(ctx)
+            start = time.perf_counter()
+            try:
+                await command.invoke(ctx)
+            finally:
+                # Subcommands replace ctx.command as they are invoked.
+                name = ctx.command.qualified_name if ctx.command is not None else command.name
+                self._commands_invoked.inc(name)
+                self._command_latency.observe(time.perf_counter() - start, name)
             self.dispatch('command_completion', command, ctx)
         elif invoker:
             exc = CommandNotFound('Command "{}" is not found'.format(invoker))
             self.dispatch('command_error', exc, ctx)
 
+    async def _flush_for_shutdown(self):
+        """
+        Keep trying to write the queued writes, until they are written or the shutdown timeout passes.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        deadline = time.monotonic() + self._shutdown_flush_timeout
+        while self._pending_writes:
+            try:
+                written = await self.flush_writes()
+            except RedisUnavailable as e:
+                delay = max(self._redis_breaker.retry_in, 0.1)
+                if time.monotonic() + delay > deadline:
+                    self.logger.error("Dropping writes to {} keys that could not be written to redis: {}".format(
+                        len(self._pending_writes), e))
+                    return
+                await asyncio.sleep(delay, loop=self.loop)
+            else:
+                self.logger.info("Wrote {} queued keys before shutting down.".format(written))
+
+    async def close(self):
+        self.loop_monitor.stop()
+        await self._flush_for_shutdown()
+        await super().close()
+        if self._invalidation_task is not None:
+            self._invalidation_task.cancel()
+        await self.http_client.close()
+
+    async def shutdown(self):
+        """
+        Log out and stop for good; under the launcher, this shard isn't restarted.
+        """
+        self._shutdown_requested = True
+        await self.logout()
+
     def main(self):
-        self.run(self.config["oauth2_token"], bot=not self.config.get("self_bot", False))
+        """
+        Run the bot until it logs out.
+
+        Exits with SHUTDOWN_EXIT_CODE if it was shut down on purpose or can't log in, since restarting won't help.
+        """
+        try:
+            self._run()
+        except discord.LoginFailure as e:
+            self.logger.critical("Could not log in: {}".format(e))
+            sys.exit(SHUTDOWN_EXIT_CODE)
+
+        if self._shutdown_requested:
+            sys.exit(SHUTDOWN_EXIT_CODE)
+
+    def _run(self):
+        run = functools.partial(self.run, self.config["oauth2_token"], bot=not self.config.get("self_bot", False))
+        if not self.config.get("logging", {}).get("threaded", False):
+            run()
+            return
+
+        # Format and write records on a background thread, instead of on the event loop, for as long as the bot runs.
+        handler = ThreadedWrapperHandler(_stderr_handler)
+        try:
+            with handler.applicationbound():
+                run()
+        finally:
+            # Only once it is off the stack, so nothing is logged to it after its thread stops; this waits for the
+            # records still queued to be written.
+            handler.close()
 
 
 if __name__ == "__main__":
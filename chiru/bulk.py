@@ -0,0 +1,106 @@
+"""
+Bounded-concurrency executor for bulk API operations.
+"""
+import asyncio
+
+import discord
+
+
+class BulkOperation:
+    """
+    Runs a stream of API calls with a fixed number of workers.
+
+    Actions are pulled lazily from an iterable of zero-argument coroutine functions, so memory use doesn't grow with the
+    number of actions. Progress is reported by editing a single status message.
+
+    Rate limiting is left to discord.py: its HTTPClient waits out 429s itself, and runs requests to the same bucket one
+    at a time, so the workers only overlap on actions that hit different buckets. When it gives up on a request that
+    stayed rate limited, it returns None instead of raising, so actions should be `bot.http` calls (the Client wrappers
+    return None either way); a None result counts as a failure.
+    """
+
+    def __init__(self, bot, description: str, actions, *, total: int = None, concurrency: int = 5,
+                 interval: float = 3.0):
+        self.bot = bot
+        self.description = description
+        self.total = total
+        self.concurrency = concurrency
+        self.interval = interval
+
+        self._actions = iter(actions)
+
+        self.done = 0
+        self.failed = 0
+        self.cancelled = False
+        self.finished = False
+
+        self.status = None
+
+    def cancel(self):
+        """
+        Stop starting new actions. Actions already in flight are allowed to finish.
+        """
+        self.cancelled = True
+
+    def _format(self) -> str:
+        if self.total is not None:
+            progress = "`{}`/`{}`".format(self.done + self.failed, self.total)
+        else:
+            progress = "`{}`".format(self.done + self.failed)
+
+        if self.cancelled:
+            state = "cancelled"
+        elif self.finished:
+            state = "finished"
+        else:
+            state = "running"
+
+        return "**{}** ({}): {} processed, `{}` failed.".format(self.description, state, progress, self.failed)
+
+    async def _update_status(self):
+        try:
+            await self.bot.edit_message(self.status, self._format())
+        except discord.HTTPException as e:
+            self.bot.logger.warning("Could not update bulk operation status: {}".format(e))
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self._update_status()
+
+    async def _attempt(self, action):
+        try:
+            result = await action()
+        except Exception as e:
+            self.bot.logger.error("{} failed: {}".format(self.description, e))
+            self.failed += 1
+            return
+
+        if result is None:
+            self.bot.logger.error("{} failed: discord.py gave up retrying a rate limit.".format(self.description))
+            self.failed += 1
+            return
+
+        self.done += 1
+
+    async def _worker(self):
+        # Every worker pulls from the same iterator.
+        for action in self._actions:
+            if self.cancelled:
+                return
+            await self._attempt(action)
+
+    async def run(self, destination):
+        """
+        Run every action, reporting progress in `destination`.
+        """
+        self.status = await self.bot.send_message(destination, self._format())
+
+        reporter = self.bot.loop.create_task(self._report())
+        try:
+            await asyncio.gather(*[self._worker() for _ in range(self.concurrency)])
+        finally:
+            reporter.cancel()
+            self.finished = True
+
+        await self._update_status()
@@ -0,0 +1,103 @@
+"""
+In-process caches.
+"""
+import collections
+import time
+
+# Sentinel returned by `LRUCache.get` when a key isn't cached, since `None` is a valid cached value.
+MISSING = object()
+
+
+class LRUCache:
+    """
+    A bounded least-recently-used cache, with an optional time-to-live on each entry.
+
+    Expired entries are kept until they are evicted or replaced, so `get_stale` can still return them as a fallback.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._data = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=MISSING):
+        """
+        Get an item from the cache, or `default` if it is missing or expired.
+        """
+        try:
+            expires, value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        if expires is not None and expires < time.monotonic():
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def get_stale(self, key, default=MISSING):
+        """
+        Get an item from the cache even if it has expired, or `default` if it is missing.
+        """
+        try:
+            _, value = self._data[key]
+        except KeyError:
+            return default
+
+        self.stale_hits += 1
+        return value
+
+    def expire_all(self):
+        """
+        Mark every item as expired, keeping them around for `get_stale`.
+        """
+        for key, (_, value) in self._data.items():
+            self._data[key] = (0, value)
+
+    def set(self, key, value):
+        """
+        Put an item into the cache, evicting the least recently used item if it is full.
+        """
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """
+        Remove an item from the cache.
+        """
+        try:
+            return self._data.pop(key)[1]
+        except KeyError:
+            return default
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        """
+        Get the hit/miss statistics of this cache.
+        """
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_hits": self.stale_hits,
+            "ratio": self.hits / total if total else 0.0
+        }
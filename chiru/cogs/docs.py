@@ -1,19 +1,29 @@
 """
 Intersphinx docs.
 
+sphinx and fuzzywuzzy are imported on first use rather than here, as they make up most of the startup time.
+
 _requirements:: ['sphinx', 'fuzzywuzzy']
 """
+import asyncio
 import functools
+import io
 import json
+import os
+import time
 
+import msgpack
 from discord.ext import commands
-from fuzzywuzzy.fuzz import QRatio
 from logbook import Logger
-from sphinx.ext import intersphinx
-from fuzzywuzzy import process
 
 from bot import Chiru
 from chiru import checks
+from chiru.cache import LRUCache, MISSING
+from chiru.inventory import Inventory
+from chiru.search import NgramIndex, normalize, search_many
+
+# Bump this when the format of the on-disk cache changes.
+CACHE_VERSION = 2
 
 
 class MockSphinxApp:
@@ -38,39 +48,254 @@ class Docs:
         # Create the MockSphinxApp.
         self._app = MockSphinxApp(self.bot.logger)
 
+        # Source name -> Inventory.
         self.invdata = {}
+        # Source name -> NgramIndex over the keys of that source.
+        self.indexes = {}
 
         self._item_lengths = {}
+        # Source name -> fetch time, size and item count of the last fetch.
+        self._source_stats = {}
 
-    async def setup(self):
+        # (subcommand, normalized query, limit, module) -> results.
+        self._query_cache = LRUCache(maxsize=self.bot.config.get("docs_query_cache", 1024))
+        # Bumped whenever the data changes, so searches that straddle a change aren't cached.
+        self._generation = 0
+
+    def _load_cache(self) -> dict:
         """
-        Download objects.inv.
+        Load the on-disk inventory cache.
         """
-        invdata = {}
-        for name, obb in self.bot.config.get("docs", {}).items():
-            self.bot.logger.info("Fetching Pydocs for {}...".format(name))
+        path = self.bot.config.get("docs_cache", "pydoc.cache")
+        try:
+            with open(path, 'rb') as f:
+                cache = msgpack.unpackb(f.read(), encoding="utf-8")
+        except FileNotFoundError:
+            return {}
+        except Exception:
+            self.bot.logger.exception("Could not load the pydoc cache; ignoring it.")
+            return {}
+
+        if cache.get("version") != CACHE_VERSION:
+            return {}
+
+        sources = cache["sources"]
+        for source in sources.values():
+            source["inventory"] = Inventory.from_state(source["inventory"])
+
+        return sources
+
+    def _save_cache(self, sources: dict):
+        """
+        Atomically replace the on-disk inventory cache.
+        """
+        path = self.bot.config.get("docs_cache", "pydoc.cache")
+        tmp = "{}.tmp".format(path)
+        sources = {name: dict(source, inventory=source["inventory"].to_state()) for name, source in sources.items()}
+        with open(tmp, 'wb') as f:
+            f.write(msgpack.packb({"version": CACHE_VERSION, "sources": sources}, use_bin_type=True))
+
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _parse_inventory(data: bytes) -> dict:
+        """
+        Parse the body of an objects.inv file.
+        """
+        from sphinx.ext import intersphinx
+
+        stream = io.BytesIO(data)
+        try:
+            from sphinx.util.inventory import InventoryFile
+        except ImportError:
+            # Sphinx < 1.6 only has the readers in intersphinx itself.
+            line = stream.readline().rstrip().decode("utf-8")
+            if line == "# Sphinx inventory version 1":
+                return intersphinx.read_inventory_v1(stream, '', os.path.join)
+            elif line == "# Sphinx inventory version 2":
+                return intersphinx.read_inventory_v2(stream, '', os.path.join)
+            raise ValueError("Unknown or unsupported inventory version {}".format(line))
+        else:
+            return InventoryFile.load(stream, '', os.path.join)
+
+    async def _fetch_source(self, name: str, obb: str, cached: dict):
+        """
+        Fetch a single source, revalidating the cached copy if there is one.
+
+        :return: The new cache entry for this source, or None if it could not be fetched.
+        """
+        if "://" not in obb:
+            from sphinx.ext import intersphinx
+
+            # Local inventory, let intersphinx deal with it.
             _data = await self.bot.loop.run_in_executor(
                 None, functools.partial(intersphinx.fetch_inventory, self._app, '', obb)
             )
-
             if _data is None:
-                self.bot.logger.error("Failed to download Pydoc source {}".format(obb))
-                continue
+                return None
+            return {"url": obb, "etag": None, "last_modified": None, "size": os.path.getsize(obb),
+                    "inventory": Inventory.from_intersphinx(_data)}
+
+        headers = {}
+        if cached is not None and cached["url"] == obb:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        max_size = self.bot.config.get("docs_fetch", {}).get("max_size", 32 * 1024 * 1024)
+        response = await self.bot.http_client.request("GET", obb, headers=headers, max_size=max_size)
+        if response.status == 304:
+            self.bot.logger.info("Pydoc source {} is up to date.".format(name))
+            return cached
+
+        if response.status != 200:
+            self.bot.logger.error("Failed to download Pydoc source {} (HTTP {})".format(obb, response.status))
+            return cached
+
+        body = response.body
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+
+        _data = await self.bot.loop.run_in_executor(None, self._parse_inventory, body)
+        # Links are relative to the directory holding objects.inv.
+        base = obb.rsplit("/", 1)[0] + "/"
+        inventory = await self.bot.loop.run_in_executor(None, Inventory.from_intersphinx, _data, base)
+        return {"url": obb, "etag": etag, "last_modified": last_modified, "size": len(body), "inventory": inventory}
+
+    async def _load_source(self, semaphore: asyncio.Semaphore, name: str, obb: str, cached: dict):
+        """
+        Fetch a single source and make it available as soon as it is ready.
+
+        :return: The cache entry for this source, or None if it could not be fetched.
+        """
+        timeout = self.bot.config.get("docs_fetch", {}).get("timeout", 30)
+
+        async with semaphore:
+            self.bot.logger.info("Fetching Pydocs for {}...".format(name))
+            start = time.monotonic()
+            try:
+                source = await asyncio.wait_for(self._fetch_source(name, obb, cached), timeout,
+                                                loop=self.bot.loop)
+            except asyncio.TimeoutError:
+                self.bot.logger.error("Timed out downloading Pydoc source {}".format(obb))
+                source = cached
+            except Exception:
+                self.bot.logger.exception("Failed to download Pydoc source {}".format(obb))
+                source = cached
+            elapsed = time.monotonic() - start
+
+        if source is None:
+            self.bot.logger.error("Failed to download Pydoc source {}".format(obb))
+            return None
+
+        if source is not cached:
+            index = await self.bot.loop.run_in_executor(None, NgramIndex, source["inventory"].keys)
+            self._publish(name, source, index)
+
+        self._source_stats[name] = {
+            "time": elapsed,
+            "size": source.get("size", 0),
+            "items": len(source["inventory"]),
+            "cached": source is cached
+        }
+        return source
+
+    def _publish(self, name: str, source: dict, index: NgramIndex):
+        """
+        Replace the data of a single source.
+
+        The dicts are copied rather than mutated, as searches iterate over them in executor threads.
+        """
+        invdata = dict(self.invdata)
+        invdata[name] = source["inventory"]
+        indexes = dict(self.indexes)
+        indexes[name] = index
+        item_lengths = dict(self._item_lengths)
+        item_lengths[name] = len(source["inventory"])
+
+        self.invdata, self.indexes, self._item_lengths = invdata, indexes, item_lengths
+        self._invalidate_queries()
 
-            # Set the invdata of the current pydoc library
-            invdata[name] = {}
+    def _swap(self, sources: dict, indexes: dict):
+        """
+        Replace the current pydoc data in one go.
+        """
+        self.invdata = self._inventories_of(sources)
+        self.indexes = indexes
+        self._item_lengths = {name: len(source["inventory"]) for name, source in sources.items()}
+        self._invalidate_queries()
+
+    def _invalidate_queries(self):
+        self._generation += 1
+        self._query_cache.clear()
+
+    async def _search(self, subcommand: str, node: str, limit: int, module: str = None):
+        """
+        Run a search, or get its results from the query cache.
 
-            self._item_lengths[name] = 0
+        :return: A list of (key, score, source name) tuples, best first.
+        """
+        cache_key = (subcommand, normalize(node), limit, module)
+        results = self._query_cache.get(cache_key)
+        if results is not MISSING:
+            return results
+
+        generation = self._generation
+        if module is None:
+            f = functools.partial(search_many, self.indexes, node, limit)
+        else:
+            from fuzzywuzzy.fuzz import WRatio
+            f = functools.partial(search_many, {module: self.indexes[module]}, node, limit, scorer=WRatio)
+        results = await self.bot.loop.run_in_executor(None, f)
+
+        if generation == self._generation:
+            self._query_cache.set(cache_key, results)
+        return results
+
+    async def setup(self):
+        """
+        Load objects.inv from the on-disk cache, then revalidate every source concurrently.
+        """
+        config = self.bot.config.get("docs", {})
+
+        cache = await self.bot.loop.run_in_executor(None, self._load_cache)
+        sources = {name: source for name, source in cache.items()
+                   if name in config and source["url"] == config[name]}
+        if sources:
+            indexes = await self.bot.loop.run_in_executor(None, self._build_indexes, self._inventories_of(sources))
+            self._swap(sources, indexes)
+            self.bot.logger.info("Loaded {} Pydoc sources from the cache.".format(len(sources)))
+
+        semaphore = asyncio.Semaphore(self.bot.config.get("docs_fetch", {}).get("concurrency", 4),
+                                      loop=self.bot.loop)
+        names = list(config)
+        results = await asyncio.gather(
+            *[self._load_source(semaphore, name, config[name], sources.get(name)) for name in names],
+            loop=self.bot.loop
+        )
+
+        new_sources = {name: source for name, source in zip(names, results) if source is not None}
+
+        if all(new_sources.get(name) is sources.get(name) for name in set(new_sources) | set(sources)):
+            # Nothing changed.
+            return
 
-            for kx, value in _data.items():
-                if kx.startswith("std"):
-                    # Ignore these, they're sphinx directives.
-                    continue
-                for key, subvals in value.items():
-                    self._item_lengths[name] += 1
-                    invdata[name][key] = subvals
+        # Drop any sources that failed without a cached copy.
+        self._swap(new_sources, {name: self.indexes[name] for name in new_sources})
 
-        self.invdata = invdata
+        try:
+            await self.bot.loop.run_in_executor(None, self._save_cache, new_sources)
+        except OSError:
+            self.bot.logger.exception("Could not save the pydoc cache.")
+
+    @staticmethod
+    def _inventories_of(sources: dict) -> dict:
+        return {name: source["inventory"] for name, source in sources.items()}
+
+    @staticmethod
+    def _build_indexes(invdata: dict) -> dict:
+        return {name: NgramIndex(inventory.keys) for name, inventory in invdata.items()}
 
     @commands.group(pass_context=True, invoke_without_command=True)
     async def pydoc(self, ctx, *, node: str):
@@ -79,28 +304,15 @@ class Docs:
 
         This does a *fuzzy* search of the item requested.
         """
-        def _get_items():
-            for v in self.invdata.values():
-                for subv in v:
-                    yield subv
-
-        f = functools.partial(process.extractOne, node, _get_items(), scorer=QRatio)
-        item = await self.bot.loop.run_in_executor(None, f)
+        item = await self._search("pydoc", node, 1)
         if not item:
             await self.bot.say(":x: No results found.")
             return
 
-        key, score = item
+        key, score, name = item[0]
 
         # Get the key that was returned by the fuzzy search.
-        data = ["??", "??", "??"]
-        for name, v in self.invdata.items():
-            try:
-                data = v[key]
-            except KeyError:
-                continue
-            else:
-                break
+        data = self.invdata.get(name, {}).get(key, ("??", "??", "??"))
 
         doc, ver, url = data[0:3]
         await self.bot.say("`{}` in {} {} - <{}> (returned with score {})".format(key, doc, ver, url, score))
@@ -112,14 +324,8 @@ class Docs:
 
         Limit defines the number of items you wish to return (up to 10).
         """
-        def _get_items():
-            for v in self.invdata.values():
-                for subv in v:
-                    yield subv
-
         limit = min(10, limit)
-        f = functools.partial(process.extractBests, node, _get_items(), limit=limit, scorer=QRatio)
-        item = await self.bot.loop.run_in_executor(None, f)
+        item = await self._search("multi", node, limit)
         if not item:
             await self.bot.say(":x: No results found.")
             return
@@ -127,17 +333,10 @@ class Docs:
         base = "**Pydoc results:**\n"
 
         for result in item:
-            key, score = result
+            key, score, name = result
 
             # Get the key that was returned by the fuzzy search.
-            data = ["??", "??", "??"]
-            for name, v in self.invdata.items():
-                try:
-                    data = v[key]
-                except KeyError:
-                    continue
-                else:
-                    break
+            data = self.invdata.get(name, {}).get(key, ("??", "??", "??"))
 
             doc, ver, url = data[0:3]
             base += "`{}` in {} {} - <{}> (returned with score {})\n".format(key, doc, ver, url, score)
@@ -149,15 +348,19 @@ class Docs:
         """
         Fetches a pydoc from a specified module and node.
         """
-        items = self.invdata.get(module.lower(), {})
-        f = functools.partial(process.extractOne, node, items)
-        item = await self.bot.loop.run_in_executor(None, f)
+        module = module.lower()
+        if module not in self.indexes:
+            await self.bot.say(":x: No results found.")
+            return
+
+        item = await self._search("module", node, 1, module)
 
         if not item:
             await self.bot.say(":x: No results found.")
             return
 
-        data, score, key = item
+        key, score, _ = item[0]
+        data = self.invdata.get(module, {}).get(key, ("??", "??", "??"))
 
         doc, ver, url = data[0:3]
 
@@ -170,7 +373,8 @@ class Docs:
         Dumps pydoc data to disk.
         """
         with open("pydoc.json", 'w') as f:
-            json.dump(self.invdata, f, indent=4, sort_keys=True)
+            json.dump({name: inventory.to_dict() for name, inventory in self.invdata.items()}, f,
+                      indent=4, sort_keys=True)
 
         await self.bot.say("Dumped.")
 
@@ -182,14 +386,23 @@ class Docs:
         base = "**Current sources:**\n"
         for source in self.bot.config.get("docs", []):
             try:
-                base += " - <{}> (`{}` items)\n".format(source, self._item_lengths[source])
+                base += " - <{}> (`{}` items)".format(source, self._item_lengths[source])
             except KeyError:
                 continue
 
+            stats = self._source_stats.get(source)
+            if stats is not None:
+                base += " - `{:.2f}s`, `{:.1f} KiB`{}".format(stats["time"], stats["size"] / 1024,
+                                                             " (cached)" if stats["cached"] else "")
+            base += "\n"
+
         base += "\nTracking `{}` out of `{}` valid sources.".format(len(self.bot.config.get("docs", [])),
                                                                     len(self._item_lengths))
 
-        base += "\nCurrently tracking `{}` items.".format(len(self.invdata))
+        base += "\nCurrently tracking `{}` items.".format(sum(self._item_lengths.values()))
+
+        stats = self._query_cache.stats()
+        base += "\nQuery cache: `{hits}` hits, `{misses}` misses, `{size}` cached queries.".format(**stats)
 
         await self.bot.say(base)
 
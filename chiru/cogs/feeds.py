@@ -1,13 +1,38 @@
 """
 Role-based feeds.
 """
+import asyncio
+import functools
+
 import aioredis
 import discord
 from discord.ext import commands
 
 from bot import Chiru
+from chiru.checks import is_owner
+from chiru.resilience import RedisUnavailable
 from override import Context
 
+# The per-server hash of feed name -> role ID.
+FEEDS_KEY = "feeds"
+# Times a migration batch is retried when its keys change underneath it.
+MIGRATE_ATTEMPTS = 5
+
+
+def _watch_failed(error: aioredis.MultiExecError) -> bool:
+    """
+    Check if a transaction was aborted because a watched key changed.
+
+    aioredis raises ``MultiExecError("MultiExecError errors:", [errors])``, with a WatchVariableError for each command
+    when EXEC is aborted.
+    """
+    errors = [error]
+    for arg in error.args:
+        if isinstance(arg, (list, tuple)):
+            errors.extend(arg)
+
+    return any(isinstance(e, aioredis.WatchVariableError) for e in errors)
+
 
 class Feeds:
     def __init__(self, bot: Chiru):
@@ -24,15 +49,8 @@ class Feeds:
         You can publish to a feed by using the `publish` command.
         """
 
-        keys = []
-
-        # Gather a list of all the feeds for this channel.
-        async with (await self.bot.get_redis()).get() as conn:
-            assert isinstance(conn, aioredis.Redis)
-
-            # Scan keys.
-            async for key in conn.iscan(match="cfg:{}:feeds:*".format(ctx.server.id)):
-                keys.append(key.decode().split(":")[-1])
+        # Gather a list of all the feeds for this server.
+        keys = sorted(await self.bot.get_hash(ctx.server, FEEDS_KEY))
 
         # Format this nicely.
         formatted = "Feeds for this server:\n {}"
@@ -52,7 +70,7 @@ class Feeds:
         """
         Creates a new feed.
         """
-        role = await self.bot.get_config(ctx.server, "feeds:{}".format(name))
+        role = await self.bot.get_hash_field(ctx.server, FEEDS_KEY, name)
         if role is not None:
             await self.bot.say("This role already exists.")
             return
@@ -61,7 +79,7 @@ class Feeds:
         role = await self.bot.create_role(ctx.server, name=name, permissions=discord.Permissions(0))
 
         # Set the role ID in the database.
-        await self.bot.set_config(ctx.server, "feeds:{}".format(name), role.id)
+        await self.bot.set_hash_field(ctx.server, FEEDS_KEY, name, role.id)
         await self.bot.say("Created new feed role `{}`.".format(name))
 
     @feeds.command(pass_context=True)
@@ -70,7 +88,7 @@ class Feeds:
         """
         Removes a feed.
         """
-        role = await self.bot.get_config(ctx.server, "feeds:{}".format(name))
+        role = await self.bot.get_hash_field(ctx.server, FEEDS_KEY, name)
         if role is None:
             await self.bot.say("This feed does not exist.")
             return
@@ -79,15 +97,104 @@ class Feeds:
         if role:
             await self.bot.delete_role(ctx.server, role)
 
-        await self.bot.delete_config(ctx.server, "feeds:{}".format(name))
+        await self.bot.delete_hash_field(ctx.server, FEEDS_KEY, name)
         await self.bot.say("Deleted feed role.")
 
+    @feeds.command(pass_context=True)
+    @commands.check(is_owner)
+    async def migrate(self, ctx: Context, batch_size: int = 500):
+        """
+        Moves feeds stored as `cfg:*:feeds:*` keys into the per-server feed hashes.
+
+        This is a one-shot migration; it is safe to run again.
+        """
+        migrated = 0
+        # Server ID -> migrated feed names, for evicting the config cache afterwards.
+        servers = {}
+
+        async def _scan(conn: aioredis.Redis, cursor: int):
+            return await conn.scan(cursor, match="cfg:*:feeds:*", count=batch_size)
+
+        async def _move(conn: aioredis.Redis, batch: list):
+            for attempt in range(MIGRATE_ATTEMPTS):
+                # If an old key is written to between the MGET and the EXEC, the transaction is aborted rather than
+                # deleting the new value, and the batch is read again.
+                await conn.watch(*batch)
+                values = await conn.mget(*batch)
+                moved = {}
+                tr = conn.multi_exec()
+                futures = []
+                for key, value in zip(batch, values):
+                    if value is None:
+                        continue
+                    # cfg:<server id>:feeds:<name>; the name may itself contain colons.
+                    _, server_id, _, name = key.decode().split(":", 3)
+                    futures.append(tr.hset("cfg:{}:{}".format(server_id, FEEDS_KEY), name, value))
+                    moved.setdefault(server_id, []).append(name)
+                futures.append(tr.delete(*batch))
+                try:
+                    await tr.execute()
+                except aioredis.MultiExecError as e:
+                    # Each command's future holds the error too; retrieve them so asyncio doesn't log them all.
+                    await asyncio.gather(*futures, return_exceptions=True, loop=self.bot.loop)
+                    if not _watch_failed(e) or attempt == MIGRATE_ATTEMPTS - 1:
+                        raise
+                else:
+                    break
+
+            invalidated = []
+            for server_id, names in moved.items():
+                built = "cfg:{}:{}".format(server_id, FEEDS_KEY)
+                invalidated.append(built)
+                invalidated += ["{}#{}".format(built, name) for name in names]
+                servers.setdefault(server_id, []).extend(names)
+            if invalidated:
+                await self.bot._publish_invalidation(conn, *invalidated)
+
+            return len(batch)
+
+        error = None
+        try:
+            # Writes queued for the feed hashes have to land before the old keys are merged into them.
+            await self.bot.flush_writes()
+
+            # One redis call per step, so each gets the usual timeout.
+            cursor = 0
+            while True:
+                cursor, keys = await self.bot._execute(functools.partial(_scan, cursor=cursor))
+                if keys:
+                    try:
+                        migrated += await self.bot._execute(functools.partial(_move, batch=keys))
+                    except aioredis.MultiExecError as e:
+                        if not _watch_failed(e):
+                            raise
+                        error = "The batch of `{}` keys starting at `{}` kept changing after `{}` attempts.".format(
+                            len(keys), keys[0].decode(), MIGRATE_ATTEMPTS)
+                        break
+                if not cursor:
+                    break
+        except RedisUnavailable as e:
+            error = "{}".format(e)
+
+        for server_id, names in servers.items():
+            built = "cfg:{}:{}".format(server_id, FEEDS_KEY)
+            self.bot.config_cache.pop(built)
+            for name in names:
+                self.bot.config_cache.pop("{}#{}".format(built, name))
+
+        if error is not None:
+            await self.bot.say(":x: {} Migrated `{}` feeds before that; run this again to finish.".format(
+                error, migrated))
+            return
+
+        await self.bot.say("Migrated `{}` feeds across `{}` servers.".format(migrated, len(servers)))
+
     @commands.command(pass_context=True)
     async def sub(self, ctx: Context, *, name: str):
         """
         Subscribes to a feed.
         """
-        role = await self.bot.get_config(ctx.server, "feeds:{}".format(name))
+        role = await self.bot.get_hash_field(ctx.server, FEEDS_KEY, name)
         if role is None:
             await self.bot.say("This feed does not exist.")
             return
@@ -105,7 +212,7 @@ class Feeds:
         """
         Unsubscribes from a feed.
         """
-        role = await self.bot.get_config(ctx.server, "feeds:{}".format(name))
+        role = await self.bot.get_hash_field(ctx.server, FEEDS_KEY, name)
         if role is None:
             await self.bot.say("This feed does not exist.")
             return
@@ -127,7 +234,7 @@ class Feeds:
         Everyone who is subscribed to the feed will be notified
         with the content.
         """
-        role = await self.bot.get_config(ctx.server, "feeds:{}".format(name))
+        role = await self.bot.get_hash_field(ctx.server, FEEDS_KEY, name)
         if role is None:
             await self.bot.say("This feed does not exist.")
             return
@@ -4,7 +4,6 @@ Cog used for my server.
 import os
 import json
 
-import aiohttp
 import discord
 import itertools
 from discord.ext import commands
@@ -101,22 +100,20 @@ class Fuyu:
                           "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/57.0.2950.4 Safari/537.36",
             "Content-Type": "application/json"
         }
-        async with aiohttp.ClientSession() as sess:
-            response = await sess.post(AUTHORIZATION_URL,
-                                       params={"client_id": client_id,
-                                               "scope": "bot"},
-                                       headers=headers,
-                                       data=json.dumps(payload))
-            assert isinstance(response, aiohttp.ClientResponse)
-            status = response.status
-            js = await response.json()
-            if status != 200:
-                await self.bot.say("\N{NO ENTRY SIGN} Failed to add bot to server! Error `{}`".format(js))
+        response = await self.bot.http_client.request("POST", AUTHORIZATION_URL,
+                                                      params={"client_id": client_id,
+                                                              "scope": "bot"},
+                                                      headers=headers,
+                                                      data=json.dumps(payload))
+        status = response.status
+        js = response.json()
+        if status != 200:
+            await self.bot.say("\N{NO ENTRY SIGN} Failed to add bot to server! Error `{}`".format(js))
+        else:
+            if 'location' in js and 'invalid_request' in js['location']:
+                await self.bot.say("\N{NO ENTRY SIGN} Invalid client ID.")
             else:
-                if 'location' in js and 'invalid_request' in js['location']:
-                    await self.bot.say("\N{NO ENTRY SIGN} Invalid client ID.")
-                else:
-                    await self.bot.say("\N{THUMBS UP SIGN} Added new bot.")
+                await self.bot.say("\N{THUMBS UP SIGN} Added new bot.")
 
 
 def setup(bot: Chiru):
@@ -1,6 +1,9 @@
 """
 Notifications cog.
 """
+import asyncio
+import collections
+
 import discord
 from discord.ext import commands
 
@@ -8,6 +11,14 @@ from bot import Chiru
 from chiru import checks
 from override import Context
 
+# Event kind -> (message for one event, header for several).
+MESSAGES = collections.OrderedDict([
+    ("join", ("**{}** has joined!", "**{}** members joined:")),
+    ("remove", ("**{}** left", "**{}** members left:")),
+    ("ban", ("**{}** got bent", "**{}** members got bent:")),
+    ("unban", ("**{}** got unbanned.", "**{}** users got unbanned:")),
+])
+
 
 class Notifications(object):
     """
@@ -17,13 +28,23 @@ class Notifications(object):
     def __init__(self, bot: Chiru):
         self.bot = bot
 
+        cfg = self.bot.config.get("notifications", {})
+        # Seconds to buffer events for before sending a summary.
+        self.window = cfg.get("window", 2.0)
+        self.max_window = cfg.get("max_window", 30.0)
+        # Number of events in one window above which the window is doubled.
+        self.burst = cfg.get("burst", 10)
+
+        # Server ID -> _Buffer.
+        self._buffers = {}
+
     @commands.group(pass_context=True, invoke_without_command=True)
     async def notifications(self, ctx: Context):
         """
         Update join/leave/ban/kick/etc notification settings.
         """
         # Since this is the default command, just say the status.
-        get = await ctx.get_config("notifications") or "off"
+        get = await self._get_mode(ctx.server) or "off"
         await self.bot.say("Your server notifications status is **{}**.".format(get))
 
     @notifications.command(pass_context=True)
@@ -32,7 +53,7 @@ class Notifications(object):
         """
         Turn all notifications on.
         """
-        await ctx.set_config("notifications", "all")
+        await self._set_mode(ctx, "all")
         await self.bot.say("Notifications turned on.")
 
     @notifications.command(pass_context=True)
@@ -41,7 +62,7 @@ class Notifications(object):
         """
         Turn all notifications off.
         """
-        await ctx.set_config("notifications", "off")
+        await self._set_mode(ctx, "off")
         await self.bot.say("Notifications turned off.")
 
     @notifications.command(pass_context=True)
@@ -50,7 +71,7 @@ class Notifications(object):
         """
         Only notify on bans.
         """
-        await ctx.set_config("notifications", "bans")
+        await self._set_mode(ctx, "bans")
         await self.bot.say("Notifications set to bans only.")
 
     @notifications.command(pass_context=True)
@@ -59,24 +80,105 @@ class Notifications(object):
         """
         Only notify on joins.
         """
-        await ctx.set_config("notifications", "joins")
+        await self._set_mode(ctx, "joins")
         await self.bot.say("Notifications set to joins only.")
 
+    async def _get_mode(self, server: discord.Server):
+        # Cached by the bot, which also evicts it when another process changes it.
+        return await self.bot.get_config(server, "notifications")
+
+    async def _set_mode(self, ctx: Context, mode: str):
+        await ctx.set_config("notifications", mode)
+
+    def _queue(self, server: discord.Server, kind: str, name: str):
+        """
+        Buffer an event, to be sent in the summary for the current window.
+        """
+        buffer = self._buffers.get(server.id)
+        if buffer is None:
+            buffer = self._buffers[server.id] = _Buffer(self.window)
+
+        buffer.events.setdefault(kind, []).append(name)
+        if not buffer.scheduled:
+            buffer.scheduled = True
+            self.bot.loop.call_later(buffer.window, self._start_flush, server)
+
+    def _start_flush(self, server: discord.Server):
+        task = self.bot.loop.create_task(self._flush(server))
+        task.add_done_callback(self._log_flush_failure)
+
+    def _log_flush_failure(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            e = task.exception()
+            self.bot.logger.error("Could not send notifications: {!r}".format(e),
+                                  exc_info=(type(e), e, e.__traceback__))
+
+    async def _flush(self, server: discord.Server):
+        buffer = self._buffers[server.id]
+        events, buffer.events = buffer.events, {}
+        buffer.scheduled = False
+
+        # Stretch the window while events are flooding in, and shrink it back once they calm down.
+        count = sum(len(names) for names in events.values())
+        if count > self.burst:
+            buffer.window = min(buffer.window * 2, self.max_window)
+        else:
+            buffer.window = max(buffer.window / 2, self.window)
+            if buffer.window == self.window:
+                # Back to normal; a new buffer is made for the next event.
+                del self._buffers[server.id]
+
+        lines = []
+        for kind, (single, multiple) in MESSAGES.items():
+            names = events.get(kind)
+            if not names:
+                continue
+            if len(names) == 1:
+                lines.append(single.format(names[0]))
+            else:
+                lines.append(_summarize(multiple.format(len(names)), names))
+
+        await self.bot.send_message(server.default_channel, "\n".join(lines), wait=False)
+
     async def on_member_join(self, member: discord.Member):
-        if (await self.bot.get_config(member.server, "notifications")) in ["all", "joins"]:
-            await self.bot.send_message(member.server.default_channel, "**{}** has joined!".format(member.name))
+        if (await self._get_mode(member.server)) in ["all", "joins"]:
+            self._queue(member.server, "join", member.name)
 
     async def on_member_ban(self, member: discord.Member):
-        if (await self.bot.get_config(member.server, "notifications")) in ["all", "bans"]:
-            await self.bot.send_message(member.server.default_channel, "**{}** got bent".format(member.name))
+        if (await self._get_mode(member.server)) in ["all", "bans"]:
+            self._queue(member.server, "ban", member.name)
 
     async def on_member_unban(self, server: discord.Server, user: discord.User):
-        if (await self.bot.get_config(server, "notifications")) in ["all", "bans"]:
-            await self.bot.send_message(server.default_channel, "**{}** got unbanned.".format(user.name))
+        if (await self._get_mode(server)) in ["all", "bans"]:
+            self._queue(server, "unban", user.name)
 
     async def on_member_remove(self, member: discord.Member):
-        if (await self.bot.get_config(member.server, "notifications")) in ["all", "joins"]:
-            await self.bot.send_message(member.server.default_channel, "**{}** left".format(member.name))
+        if (await self._get_mode(member.server)) in ["all", "joins"]:
+            self._queue(member.server, "remove", member.name)
+
+
+class _Buffer:
+    __slots__ = ("events", "window", "scheduled")
+
+    def __init__(self, window: float):
+        # Event kind -> names.
+        self.events = {}
+        self.window = window
+        self.scheduled = False
+
+
+def _summarize(header: str, names: list, limit: int = 1500) -> str:
+    """
+    Format a list of names after a header, cutting it off once it gets too long.
+    """
+    fmt = header
+    for i, name in enumerate(names):
+        part = "{}{}".format(" " if i == 0 else ", ", name)
+        if len(fmt) + len(part) > limit:
+            return fmt + ", …"
+        fmt += part
+
+    return fmt
 
 
 def setup(bot: Chiru):
@@ -3,6 +3,7 @@ Owner-only commands.
 """
 import asyncio
 import inspect
+import io
 
 import discord
 import traceback
@@ -12,6 +13,8 @@ from bot import Chiru
 from override import Context
 from chiru import util
 from chiru.checks import is_owner
+from chiru.heap import format_size
+from chiru.profiling import ProfilerBusy
 
 
 class Owner:
@@ -70,7 +73,7 @@ class Owner:
         """
         Change the bot's avatar.
         """
-        avatar = await util.get_file(url)
+        avatar = await util.get_file(self.bot.http_client, url)
         await self.bot.edit_profile(avatar=avatar)
         await self.bot.say(":heavy_check_mark: Changed avatar.")
 
@@ -114,6 +117,185 @@ class Owner:
 
         await self.bot.say("Reloaded all.")
 
+    @commands.command(pass_context=True)
+    @commands.check(is_owner)
+    async def extensions(self, ctx):
+        """
+        Show how long each extension took to import and set up.
+        """
+        timings = sorted(self.bot.extension_timings.items(),
+                         key=lambda item: -(item[1].get("import", 0) + item[1].get("setup", 0)))
+        fmt = "**Extension startup times:**\n"
+        for name, timing in timings:
+            fmt += " - `{}`: `{:.3f}s` import, `{:.3f}s` setup{}\n".format(
+                name, timing.get("import", 0.0), timing.get("setup", 0.0),
+                "" if name in self.bot.extensions else " (not loaded)")
+
+        for chunk in util.chunk(fmt):
+            await self.bot.say(chunk)
+
+    @commands.command(pass_context=True)
+    @commands.check(is_owner)
+    async def cachestats(self, ctx):
+        """
+        Show the hit/miss statistics of the config cache.
+        """
+        stats = self.bot.config_cache.stats()
+        await self.bot.say("Config cache: `{size}`/`{maxsize}` keys, `{hits}` hits, `{misses}` misses "
+                           "(`{ratio:.1%}` hit ratio).".format(**stats))
+
+    @commands.command(pass_context=True)
+    @commands.check(is_owner)
+    async def redisstatus(self, ctx):
+        """
+        Show the state of the redis circuit breaker and the queued writes.
+        """
+        status = self.bot.redis_status()
+        await self.bot.say("Redis breaker: `{breaker}` (`{failures}` failures, opened `{times_opened}` times, retry in "
+                           "`{retry_in:.1f}s`). Queued: `{pending_writes}` writes to `{pending_keys}` keys; `{merged}` "
+                           "of `{queued}` merged. `{stale_hits}` stale reads.".format(**status))
+
+    @commands.command(pass_context=True)
+    @commands.check(is_owner)
+    async def queuestats(self, ctx):
+        """
+        Show the statistics of the outbound message queue.
+        """
+        stats = self.bot.send_queue.stats()
+        await self.bot.say("Send queue: `{depth}` queued over `{channels}` channels, `{sent}` sends, `{merged}` merged "
+                           "messages, `{delay_avg:.3f}s` average / `{delay_max:.3f}s` max delay.".format(**stats))
+
+    @commands.command(pass_context=True)
+    @commands.check(is_owner)
+    async def looplag(self, ctx, limit: int = 3):
+        """
+        Show the event loop lag, and what has been blocking the loop the most.
+        """
+        stats = self.bot.loop_monitor.stats(max(0, min(limit, 10)))
+        await self.bot.say("Loop lag over `{samples}` samples: `{p50:.4f}s` p50, `{p90:.4f}s` p90, `{p99:.4f}s` p99, "
+                           "`{max:.4f}s` max.".format(**stats))
+        for offender in stats["offenders"]:
+            # Only the innermost frames, to keep it readable, and cut to fit in one message with its code block.
+            stack = "".join(offender["stack"].splitlines(True)[-8:])
+            if len(stack) > 1500:
+                stack = "..." + stack[-1497:]
+            await self.bot.say("**{where}**: stalled `{count}` times, `{total:.3f}s` total, `{max:.3f}s` max.\n"
+                               "```{}```".format(stack, **offender))
+
+    @commands.command(pass_context=True)
+    @commands.check(is_owner)
+    async def profile(self, ctx, seconds: float = 10.0, mode: str = "cprofile"):
+        """
+        Profile the event loop for a number of seconds.
+
+        Mode is `cprofile` (traces every call) or `sample` (samples the stack, with less overhead).
+        """
+        seconds = max(0.1, min(seconds, 300))
+        await self.bot.say("Profiling for `{}` seconds...".format(seconds))
+        try:
+            result = await self.bot.profiler.profile(seconds, mode)
+        except (ProfilerBusy, ValueError) as e:
+            await self.bot.say(":x: {}".format(e))
+            return
+
+        for title, text in (("cumulative", result.top_cumulative), ("self", result.top_self)):
+            await self.bot.say("**Top functions by {} time:**".format(title))
+            for chunk in util.chunk(text.strip()):
+                await self.bot.say("```{}```".format(chunk))
+
+        await self.bot.upload(io.BytesIO(result.data), filename=result.filename)
+
+    @commands.group(pass_context=True, invoke_without_command=True)
+    @commands.check(is_owner)
+    async def heap(self, ctx):
+        """
+        Show the status of heap tracing.
+        """
+        if not self.bot.heap.tracing:
+            await self.bot.say("Heap tracing is off.")
+            return
+
+        summary = await self.bot.heap.summary()
+        await self.bot.say("Heap tracing is on: `{}` traced, `{}` peak. Snapshots: {}".format(
+            format_size(summary["current"]), format_size(summary["peak"]),
+            ", ".join("`{}`".format(s["name"]) for s in summary["snapshots"]) or "none"))
+
+    @heap.command(pass_context=True)
+    @commands.check(is_owner)
+    async def start(self, ctx, frames: int = 1):
+        """
+        Start tracing allocations, keeping the given number of frames per allocation.
+        """
+        self.bot.heap.start(max(1, frames))
+        await self.bot.say(":heavy_check_mark: Tracing allocations.")
+
+    @heap.command(pass_context=True)
+    @commands.check(is_owner)
+    async def stop(self, ctx):
+        """
+        Stop tracing allocations, and drop every snapshot.
+        """
+        self.bot.heap.stop()
+        await self.bot.say(":heavy_check_mark: Stopped tracing allocations.")
+
+    @heap.command(pass_context=True)
+    @commands.check(is_owner)
+    async def snapshot(self, ctx, name: str = None):
+        """
+        Take a named snapshot of the traced allocations.
+        """
+        try:
+            name = await self.bot.heap.snapshot(name)
+        except ValueError as e:
+            await self.bot.say(":x: {}".format(e))
+            return
+
+        await self.bot.say(":heavy_check_mark: Took snapshot `{}`.".format(name))
+
+    @heap.command(pass_context=True)
+    @commands.check(is_owner)
+    async def top(self, ctx, name: str = None, group: str = "lineno"):
+        """
+        Show the biggest allocation sites of a snapshot, grouped by `lineno` or `filename`.
+        """
+        try:
+            stats = await self.bot.heap.top(name, group)
+        except ValueError as e:
+            await self.bot.say(":x: {}".format(e))
+            return
+
+        fmt = "\n".join("{:>10} {:>8}  {}".format(format_size(stat["size"]), stat["count"], stat["where"])
+                        for stat in stats)
+        for chunk in util.chunk(fmt or "Nothing traced."):
+            await self.bot.say("```{}```".format(chunk))
+
+    @heap.command(pass_context=True)
+    @commands.check(is_owner)
+    async def diff(self, ctx, old: str, new: str, group: str = "lineno"):
+        """
+        Show the allocation sites that changed the most between two snapshots.
+        """
+        try:
+            stats = await self.bot.heap.diff(old, new, group)
+        except ValueError as e:
+            await self.bot.say(":x: {}".format(e))
+            return
+
+        fmt = "\n".join("{:>11} {:>+8}  {}".format(("+" if stat["size_diff"] >= 0 else "") +
+                                                   format_size(stat["size_diff"]), stat["count_diff"], stat["where"])
+                        for stat in stats)
+        for chunk in util.chunk(fmt or "No differences."):
+            await self.bot.say("```{}```".format(chunk))
+
+    @commands.command(pass_context=True)
+    @commands.check(is_owner)
+    async def shutdown(self, ctx):
+        """
+        Log out and stop the bot. Under the launcher, this shard is not restarted.
+        """
+        await self.bot.say(":wave: Shutting down.")
+        await self.bot.shutdown()
+
     @commands.command(pass_context=True)
     @commands.check(is_owner)
     async def die(self, ctx):
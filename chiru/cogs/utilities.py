@@ -1,14 +1,17 @@
 """
 Utilities cog.
 """
-import asyncio
-
 import datetime
+import functools
+
 import discord
 import time
 from discord.ext import commands
 
 from bot import Chiru
+from chiru import checks, util
+from chiru.bulk import BulkOperation
+from chiru.roleindex import RoleIndex
 from override import Context
 
 
@@ -20,6 +23,14 @@ class Utilities:
     def __init__(self, bot: Chiru):
         self.bot = bot
 
+        # Server ID -> running BulkOperation.
+        self._operations = {}
+
+        # Built here as well as in on_ready, as the cog is usually loaded after the bot is ready.
+        self.roles = RoleIndex()
+        for server in list(self.bot.servers):
+            self.roles.build(server)
+
     @commands.command(pass_context=True)
     async def joinedat(self, ctx: Context, *, target: discord.Member):
         """
@@ -52,12 +63,79 @@ class Utilities:
         """
         Returns the number of people in a specified role.
         """
-        counter = 0
-        for member in ctx.server.members:
-            if role in member.roles:
-                counter += 1
+        await self.bot.say("`{}`".format(self.roles.count(ctx.server, role)))
+
+    async def _say_members(self, server: discord.Server, member_ids: set):
+        names = []
+        for member_id in member_ids:
+            member = server.get_member(member_id)
+            if member is not None:
+                names.append(member.name)
+
+        if not names:
+            await self.bot.say("No members found.")
+            return
+
+        fmt = "`{}` members: {}".format(len(names), ", ".join(sorted(names)))
+        for chunk in util.chunk(fmt):
+            await self.bot.say(chunk)
+
+    @commands.command(pass_context=True)
+    async def rolemembers(self, ctx: Context, *, role: discord.Role):
+        """
+        Lists the members of a specified role.
+        """
+        await self._say_members(ctx.server, self.roles.members(ctx.server, role))
+
+    @commands.command(pass_context=True)
+    async def roleboth(self, ctx: Context, first: discord.Role, second: discord.Role):
+        """
+        Lists the members that have both of the specified roles.
 
-        await self.bot.say("`{}`".format(counter))
+        Quote role names that contain spaces.
+        """
+        await self._say_members(ctx.server, self.roles.members(ctx.server, first) &
+                                self.roles.members(ctx.server, second))
+
+    # Keep the role index up to date.
+
+    async def on_ready(self):
+        for server in list(self.bot.servers):
+            self.roles.build(server)
+
+    async def on_server_join(self, server: discord.Server):
+        self.roles.build(server)
+
+    async def on_server_available(self, server: discord.Server):
+        self.roles.build(server)
+
+    async def on_server_remove(self, server: discord.Server):
+        self.roles.remove_server(server)
+
+    async def on_member_join(self, member: discord.Member):
+        self.roles.add_member(member)
+
+    async def on_member_remove(self, member: discord.Member):
+        self.roles.remove_member(member)
+
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        self.roles.update_member(before, after)
+
+    async def on_server_role_delete(self, role: discord.Role):
+        self.roles.remove_role(role)
+
+    def _start_bulk(self, ctx: Context, description: str, actions, total: int = None) -> BulkOperation:
+        op = BulkOperation(self.bot, description, actions, total=total,
+                           concurrency=self.bot.config.get("bulk", {}).get("concurrency", 5))
+        self._operations[ctx.server.id] = op
+        return op
+
+    async def _run_bulk(self, ctx: Context, op: BulkOperation):
+        try:
+            await op.run(ctx.channel)
+        finally:
+            if self._operations.get(ctx.server.id) is op:
+                del self._operations[ctx.server.id]
 
     @commands.command(pass_context=True)
     @commands.has_permissions(manage_nicknames=True)
@@ -66,16 +144,71 @@ class Utilities:
         """
         Resets the nicknames of all members on a server (if possible).
         """
-        futures = []
-        for member in ctx.server.members:
-            if member.top_role.position < ctx.server.me.top_role.position:
-                futures.append(self.bot.change_nickname(member, None))
+        if ctx.server.id in self._operations:
+            await self.bot.say(":x: A bulk operation is already running on this server.")
+            return
 
-        results = await asyncio.gather(*futures, return_exceptions=True)
+        position = ctx.server.me.top_role.position
+        members = [member for member in ctx.server.members
+                   if member.nick is not None and member.top_role.position < position]
 
-        changed = sum(1 for _ in results if not isinstance(_, Exception))
+        actions = (functools.partial(self.bot.http.change_nickname, ctx.server.id, member.id, None)
+                   for member in members)
+        op = self._start_bulk(ctx, "Resetting nicknames", actions, total=len(members))
+        await self._run_bulk(ctx, op)
 
-        await self.bot.say("Changed `{}` nicknames.".format(changed))
+        await self.bot.say("Changed `{}` nicknames.".format(op.done))
+
+    @commands.command(pass_context=True)
+    @commands.check(checks.has_manage_server)
+    async def cancel(self, ctx: Context):
+        """
+        Cancels the bulk operation running on this server.
+        """
+        op = self._operations.get(ctx.server.id)
+        if op is None:
+            await self.bot.say(":x: No bulk operation is running on this server.")
+            return
+
+        op.cancel()
+        await self.bot.say(":heavy_check_mark: Cancelling `{}`.".format(op.description))
+
+    @commands.group(pass_context=True, invoke_without_command=True)
+    async def prefix(self, ctx: Context):
+        """
+        Shows the command prefix of this server.
+        """
+        custom = self.bot.get_server_prefix(ctx.server)
+        if custom is None:
+            await self.bot.say("This server uses the default prefix.")
+        else:
+            await self.bot.say("This server's prefix is `{}`.".format(custom))
+
+    @prefix.command(name="set", pass_context=True)
+    @commands.check(checks.has_manage_server)
+    async def prefix_set(self, ctx: Context, prefix: str):
+        """
+        Sets a custom command prefix for this server.
+
+        Quote the prefix to include a trailing space, e.g. `"pls "`.
+        The default prefix keeps working alongside it. Prefixes can be up to 16 characters long.
+        """
+        try:
+            await self.bot.set_server_prefix(ctx.server, prefix)
+        except ValueError as e:
+            await self.bot.say(":x: {}".format(e))
+            return
+
+        await self.bot.say(":heavy_check_mark: Prefix set to `{}`.".format(prefix))
+
+    @prefix.command(name="reset", pass_context=True)
+    @commands.check(checks.has_manage_server)
+    async def prefix_reset(self, ctx: Context):
+        """
+        Resets the command prefix of this server to the default.
+        """
+        await self.bot.set_server_prefix(ctx.server, None)
+        await self.bot.say(":heavy_check_mark: Prefix reset.")
 
     @commands.command(pass_context=True)
     async def uptime(self, ctx: Context):
@@ -107,53 +240,50 @@ class Utilities:
             await self.bot.say("OK, cancelling.")
             return
 
+        if ctx.server.id in self._operations:
+            await self.bot.say(":x: A bulk operation is already running on this server.")
+            return
+
         # Nuke roles.
-        for role in ctx.server.roles:
-            try:
-                await self.bot.delete_role(role.server, role)
-            except Exception as e:
-                self.bot.logger.error("Could not delete role: {}".format(e))
-            else:
-                self.bot.logger.info("Deleted role {}.".format(role.name))
+        roles = [role for role in ctx.server.roles if not role.is_everyone]
+        actions = (functools.partial(self.bot.http.delete_role, ctx.server.id, role.id) for role in roles)
+        op = self._start_bulk(ctx, "Nuking roles", actions, total=len(roles))
+        await self._run_bulk(ctx, op)
+        if op.cancelled:
+            return
 
         await self.bot.say("Nuked roles.")
 
         # Nuke channel overrides.
-        for channel in ctx.server.channels:
-            # Reset the default overwrite.
-            assert isinstance(channel, discord.Channel)
+        op = self._start_bulk(ctx, "Nuking overrides", self._overwrite_actions(ctx.server))
+        await self._run_bulk(ctx, op)
+        if op.cancelled:
+            return
+
+        await self.bot.say("Nuked overrides.")
 
-            override = discord.PermissionOverwrite()
-            try:
-                await self.bot.edit_channel_permissions(channel, ctx.server.default_role, override)
-            except Exception as e:
-                self.bot.logger.error("Could not edit permissions: {}".format(e))
-            else:
-                self.bot.logger.info("Edited permissions in {}.".format(channel.name))
+    def _overwrite_actions(self, server: discord.Server):
+        """
+        Lazily generate the calls needed to reset every permission overwrite on a server.
+
+        These are HTTPClient calls, so BulkOperation can tell when one was given up on.
+        """
+        for channel in list(server.channels):
+            # Reset the default overwrite, allowing and denying nothing.
+            assert isinstance(channel, discord.Channel)
+            yield functools.partial(self.bot.http.edit_channel_permissions, channel.id, server.default_role.id,
+                                    0, 0, "role")
 
             for role in channel.changed_roles:
-                try:
-                    await self.bot.delete_channel_permissions(channel, role)
-                except Exception as e:
-                    self.bot.logger.error("Could not edit permissions: {}".format(e))
-                else:
-                    self.bot.logger.info("Edited permissions in {}.".format(channel.name))
-
-            for member in ctx.server.members:
+                yield functools.partial(self.bot.http.delete_channel_permissions, channel.id, role.id)
+
+            for member in list(server.members):
                 overwrite = channel.overwrites_for(member)
 
                 if not any([v[1] for v in overwrite]):
-                    self.bot.logger.info("Skipping {}.".format(member))
                     continue
 
-                try:
-                    await self.bot.delete_channel_permissions(channel, member)
-                except Exception as e:
-                    self.bot.logger.error("Could not edit permissions: {}".format(e))
-                else:
-                    self.bot.logger.info("Edited permissions in {}.".format(channel.name))
-
-        await self.bot.say("Nuked overrides.")
+                yield functools.partial(self.bot.http.delete_channel_permissions, channel.id, member.id)
 
 
 def setup(bot: Chiru):
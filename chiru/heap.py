@@ -0,0 +1,175 @@
+"""
+tracemalloc heap snapshots.
+"""
+import asyncio
+import collections
+import linecache
+import os
+import sys
+import time
+import tracemalloc
+
+# Allocations made by tracemalloc and the import machinery are noise.
+_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, linecache.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+GROUPS = ("lineno", "filename")
+
+
+def format_size(size: int) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            return "{:.1f} {}".format(size, unit)
+        size /= 1024
+
+    return "{:.1f} GiB".format(size)
+
+
+def _short(filename: str) -> str:
+    """
+    Strip the longest sys.path entry off a filename, so site-packages paths stay readable.
+    """
+    for path in sorted((p for p in sys.path if p), key=len, reverse=True):
+        if filename.startswith(path + os.sep):
+            return filename[len(path) + 1:]
+
+    return filename
+
+
+def _where(stat, group: str) -> str:
+    frame = stat.traceback[0]
+    filename = _short(frame.filename)
+    if group == "filename":
+        return filename
+    return "{}:{}".format(filename, frame.lineno)
+
+
+class HeapTracker:
+    """
+    Takes named tracemalloc snapshots, and works out their top allocation sites and the differences between them.
+
+    Everything that walks a snapshot runs in an executor, as it can take a while for a big heap.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, *, max_snapshots: int = 8):
+        self.loop = loop
+        self.max_snapshots = max_snapshots
+
+        # Name -> (time taken, snapshot), oldest first.
+        self._snapshots = collections.OrderedDict()
+        self._counter = 0
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    @property
+    def snapshots(self) -> list:
+        return list(self._snapshots)
+
+    def start(self, frames: int = 1):
+        """
+        Start tracing allocations. Only allocations made after this are seen.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def stop(self):
+        """
+        Stop tracing, and drop every snapshot.
+        """
+        tracemalloc.stop()
+        self._snapshots.clear()
+
+    async def snapshot(self, name: str = None) -> str:
+        """
+        Take a named snapshot, replacing any with the same name.
+
+        :return: The name of the snapshot.
+        """
+        if not tracemalloc.is_tracing():
+            raise ValueError("tracemalloc is not running.")
+
+        if name is None:
+            self._counter += 1
+            name = "snap{}".format(self._counter)
+
+        snapshot = await self.loop.run_in_executor(None, self._take)
+        self._snapshots.pop(name, None)
+        self._snapshots[name] = (time.time(), snapshot)
+        while len(self._snapshots) > self.max_snapshots:
+            self._snapshots.popitem(last=False)
+
+        return name
+
+    @staticmethod
+    def _take() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(_FILTERS)
+
+    def _get(self, name: str = None) -> tracemalloc.Snapshot:
+        if name is None:
+            if not self._snapshots:
+                raise ValueError("No snapshots have been taken.")
+            return next(reversed(self._snapshots.values()))[1]
+
+        try:
+            return self._snapshots[name][1]
+        except KeyError:
+            raise ValueError("No snapshot named `{}`.".format(name)) from None
+
+    @staticmethod
+    def _check_group(group: str):
+        if group not in GROUPS:
+            raise ValueError("Group by one of: {}.".format(", ".join(GROUPS)))
+
+    @staticmethod
+    def _top(snapshot: tracemalloc.Snapshot, group: str, limit: int) -> list:
+        stats = snapshot.statistics(group)
+        return [{"where": _where(stat, group), "size": stat.size, "count": stat.count} for stat in stats[:limit]]
+
+    @staticmethod
+    def _diff(old: tracemalloc.Snapshot, new: tracemalloc.Snapshot, group: str, limit: int) -> list:
+        stats = new.compare_to(old, group)
+        return [{"where": _where(stat, group), "size": stat.size, "size_diff": stat.size_diff,
+                 "count_diff": stat.count_diff} for stat in stats[:limit]]
+
+    async def top(self, name: str = None, group: str = "lineno", limit: int = 10) -> list:
+        """
+        Get the biggest allocation sites of a snapshot (the latest one by default).
+        """
+        self._check_group(group)
+        snapshot = self._get(name)
+        return await self.loop.run_in_executor(None, self._top, snapshot, group, limit)
+
+    async def diff(self, old: str, new: str, group: str = "lineno", limit: int = 10) -> list:
+        """
+        Get the allocation sites that grew or shrank the most between two snapshots.
+        """
+        self._check_group(group)
+        old, new = self._get(old), self._get(new)
+        return await self.loop.run_in_executor(None, self._diff, old, new, group, limit)
+
+    async def summary(self, limit: int = 10) -> dict:
+        """
+        Summarize the traced memory, the latest snapshot, and the change since the one before it.
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        result = {
+            "tracing": self.tracing,
+            "current": current,
+            "peak": peak,
+            "snapshots": [{"name": name, "time": taken} for name, (taken, _) in self._snapshots.items()]
+        }
+
+        names = self.snapshots
+        if names:
+            result["top"] = await self.top(names[-1], "filename", limit)
+        if len(names) > 1:
+            result["diff"] = await self.diff(names[-2], names[-1], "filename", limit)
+
+        return result
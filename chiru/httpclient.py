@@ -0,0 +1,115 @@
+"""
+Bot-wide HTTP client.
+"""
+import asyncio
+import json
+
+import aiohttp
+
+from chiru.cache import LRUCache, MISSING
+
+
+class ResponseTooLarge(Exception):
+    """
+    Raised when a response body goes over the size limit.
+    """
+
+
+class Response:
+    """
+    A fully read HTTP response.
+    """
+    __slots__ = ("url", "status", "headers", "body")
+
+    def __init__(self, url: str, status: int, headers, body: bytes):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body.decode())
+
+
+class HTTPClient:
+    """
+    A pooled HTTP client, with per-request timeouts, a cap on body sizes and a small ETag-aware response cache.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, *, connections: int = 20, timeout: float = 30,
+                 max_size: int = 8 * 1024 * 1024, cache_size: int = 64, max_cached_size: int = 1024 * 1024):
+        self.loop = loop
+        self.timeout = timeout
+        self.max_size = max_size
+        self.max_cached_size = max_cached_size
+
+        self._connector = aiohttp.TCPConnector(limit=connections, loop=loop)
+        self.session = aiohttp.ClientSession(connector=self._connector, loop=loop)
+
+        # URL -> (ETag, Last-Modified, Response).
+        self._cache = LRUCache(maxsize=cache_size)
+
+    @property
+    def cache(self) -> LRUCache:
+        return self._cache
+
+    async def _read(self, response: aiohttp.ClientResponse, max_size: int) -> bytes:
+        length = response.headers.get("Content-Length")
+        if length is not None and int(length) > max_size:
+            raise ResponseTooLarge("{} is {} bytes, over the limit of {}".format(response.url, length, max_size))
+
+        body = bytearray()
+        while True:
+            chunk = await response.content.read(65536)
+            if not chunk:
+                break
+            body += chunk
+            if len(body) > max_size:
+                raise ResponseTooLarge("{} is over the limit of {} bytes".format(response.url, max_size))
+
+        return bytes(body)
+
+    async def request(self, method: str, url: str, *, max_size: int = None, timeout: float = None,
+                      **kwargs) -> Response:
+        """
+        Make a request and read the whole body, streaming it so the size cap is enforced as it downloads.
+        """
+        max_size = max_size or self.max_size
+        with aiohttp.Timeout(timeout or self.timeout, loop=self.loop):
+            async with self.session.request(method, url, **kwargs) as response:
+                assert isinstance(response, aiohttp.ClientResponse)
+                body = await self._read(response, max_size)
+                return Response(url, response.status, response.headers, body)
+
+    async def get(self, url: str, *, use_cache: bool = True, **kwargs) -> Response:
+        """
+        GET a URL, revalidating a cached copy with its ETag or Last-Modified date if there is one.
+        """
+        if not use_cache:
+            return await self.request("GET", url, **kwargs)
+
+        cached = self._cache.get(url)
+        headers = dict(kwargs.pop("headers", None) or {})
+        if cached is not MISSING:
+            etag, last_modified, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        response = await self.request("GET", url, headers=headers, **kwargs)
+        if response.status == 304 and cached is not MISSING:
+            return cached[2]
+
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if response.status == 200 and (etag or last_modified) and len(response.body) <= self.max_cached_size:
+            self._cache.set(url, (etag, last_modified, response))
+
+        return response
+
+    async def close(self):
+        result = self.session.close()
+        # Only a coroutine on newer versions of aiohttp.
+        if asyncio.iscoroutine(result):
+            await result
@@ -0,0 +1,105 @@
+"""
+Compact storage for intersphinx inventories.
+"""
+import sys
+
+
+class Inventory:
+    """
+    The entries of a single objects.inv, stored as parallel arrays.
+
+    Every entry of an inventory shares the same project and version, so they are stored once.
+    URLs are stored as a base URL plus an interned page; the anchor is only stored when it isn't the key itself,
+    which it almost always is.
+    """
+
+    __slots__ = ("project", "version", "base", "keys", "_pages", "_anchors", "_displays", "_index")
+
+    def __init__(self, project: str, version: str, base: str, keys: list, pages: list, anchors: list,
+                 displays: list):
+        self.project = sys.intern(project)
+        self.version = sys.intern(version)
+        self.base = base
+
+        self.keys = keys
+        self._pages = [sys.intern(page) for page in pages]
+        self._anchors = anchors
+        self._displays = displays
+
+        # Key -> row.
+        self._index = {key: row for row, key in enumerate(keys)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    @classmethod
+    def from_intersphinx(cls, data: dict, base: str = "") -> 'Inventory':
+        """
+        Create an inventory from the {type: {key: (project, version, url, display)}} data returned by intersphinx.
+
+        Sphinx directives (the `std:*` types) are skipped.
+        """
+        project = version = ""
+        keys, pages, anchors, displays = [], [], [], []
+        seen = set()
+
+        for kx, value in data.items():
+            if kx.startswith("std"):
+                # Ignore these, they're sphinx directives.
+                continue
+            for key, subvals in value.items():
+                if key in seen:
+                    continue
+                seen.add(key)
+
+                project, version, url, display = subvals[0:4]
+                page, sep, anchor = url.partition("#")
+                keys.append(key)
+                pages.append(page)
+                # None means the anchor is the key; otherwise keep the whole fragment, which may be empty.
+                anchors.append(None if anchor == key else sep + anchor)
+                displays.append(None if display == "-" else display)
+
+        return cls(project, version, base, keys, pages, anchors, displays)
+
+    @classmethod
+    def from_state(cls, state: dict) -> 'Inventory':
+        return cls(state["project"], state["version"], state["base"], state["keys"], state["pages"],
+                   state["anchors"], state["displays"])
+
+    def to_state(self) -> dict:
+        """
+        Get a plain representation of this inventory, for serialization.
+        """
+        return {
+            "project": self.project,
+            "version": self.version,
+            "base": self.base,
+            "keys": self.keys,
+            "pages": self._pages,
+            "anchors": self._anchors,
+            "displays": self._displays
+        }
+
+    def _url(self, row: int) -> str:
+        anchor = self._anchors[row]
+        if anchor is None:
+            anchor = "#" + self.keys[row]
+
+        return "{}{}{}".format(self.base, self._pages[row], anchor)
+
+    def get(self, key: str, default=None):
+        """
+        Get the (project, version, url, display) of an entry.
+        """
+        row = self._index.get(key)
+        if row is None:
+            return default
+
+        return self.project, self.version, self._url(row), self._displays[row] or "-"
+
+    def to_dict(self) -> dict:
+        return {key: self.get(key) for key in self.keys}
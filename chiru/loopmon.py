@@ -0,0 +1,171 @@
+"""
+Event loop lag monitor.
+"""
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time
+import traceback
+
+# Frames from these directories are skipped when working out what blocked the loop.
+_ASYNCIO_DIR = os.path.dirname(asyncio.__file__)
+_THREADING_FILE = threading.__file__
+
+
+class _Offender:
+    __slots__ = ("where", "stack", "count", "total", "max")
+
+    def __init__(self, where: str, stack: str):
+        self.where = where
+        self.stack = stack
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+class LoopMonitor:
+    """
+    Measures event loop lag, and captures the stack of whatever is blocking the loop.
+
+    A heartbeat task on the loop measures how late each of its wakeups is. A watchdog thread checks the time of the
+    last heartbeat; when the loop has been stalled for longer than the threshold, it grabs the loop thread's current
+    stack, which is the callback or coroutine step that is still running.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, *, interval: float = 0.25, threshold: float = 0.1,
+                 history: int = 2048, max_offenders: int = 256, metrics=None):
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self.max_offenders = max_offenders
+
+        # Lag of the most recent heartbeats, in seconds.
+        self._lags = collections.deque(maxlen=history)
+        # Innermost blocking frame -> _Offender. Only the max_offenders worst are kept.
+        self._offenders = {}
+        self._lock = threading.Lock()
+
+        self._beat = time.monotonic()
+        self._captured = None
+        self._pending = None
+        self._thread_id = None
+
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+
+        self._lag_histogram = None
+        self._stalls = None
+        if metrics is not None:
+            self._lag_histogram = metrics.histogram("chiru_loop_lag_seconds", "Event loop lag.")
+            self._stalls = metrics.counter("chiru_loop_stalls_total", "Event loop stalls over the threshold.")
+
+    def start(self):
+        if self._task is not None:
+            return
+
+        self._stop.clear()
+        self._task = self.loop.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _heartbeat(self):
+        self._thread_id = threading.get_ident()
+        while True:
+            expected = self.loop.time() + self.interval
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval, loop=self.loop)
+            lag = max(0.0, self.loop.time() - expected)
+
+            self._lags.append(lag)
+            if self._lag_histogram is not None:
+                self._lag_histogram.observe(lag)
+
+            with self._lock:
+                offender, self._pending = self._pending, None
+                if offender is not None:
+                    # The stall is only fully known now that the loop is running again.
+                    offender.total += lag
+                    offender.max = max(offender.max, lag)
+
+    def _watch(self):
+        while not self._stop.wait(self.threshold / 2):
+            beat = self._beat
+            if beat == self._captured or self._thread_id is None:
+                continue
+
+            if time.monotonic() - beat - self.interval < self.threshold:
+                continue
+
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+
+            self._captured = beat
+            self._record(traceback.extract_stack(frame))
+            del frame
+
+    def _record(self, stack):
+        where = "<unknown>"
+        for filename, lineno, name, _ in reversed(stack):
+            if filename.startswith(_ASYNCIO_DIR) or filename == _THREADING_FILE:
+                continue
+            where = "{}:{} ({})".format(os.path.relpath(filename), lineno, name)
+            break
+
+        with self._lock:
+            offender = self._offenders.get(where)
+            if offender is None:
+                if len(self._offenders) >= self.max_offenders:
+                    # Make room by dropping whatever has blocked the loop the least.
+                    least = min(self._offenders.values(), key=lambda o: o.total)
+                    del self._offenders[least.where]
+                offender = self._offenders[where] = _Offender(where, "".join(traceback.format_list(stack)))
+            offender.count += 1
+            self._pending = offender
+
+        if self._stalls is not None:
+            self._stalls.inc()
+
+    def percentiles(self, *points: float) -> dict:
+        """
+        Get percentiles of the recent lag, e.g. ``percentiles(50, 99)``.
+        """
+        lags = sorted(self._lags)
+        if not lags:
+            return {p: 0.0 for p in points}
+
+        return {p: lags[min(len(lags) - 1, int(len(lags) * p / 100))] for p in points}
+
+    def offenders(self, limit: int = 5) -> list:
+        """
+        Get the frames that have blocked the loop the longest, in total.
+        """
+        with self._lock:
+            offenders = list(self._offenders.values())
+
+        offenders.sort(key=lambda o: o.total, reverse=True)
+        return offenders[:limit]
+
+    def stats(self, limit: int = 5) -> dict:
+        pcts = self.percentiles(50, 90, 99, 100)
+        return {
+            "samples": len(self._lags),
+            "threshold": self.threshold,
+            "p50": pcts[50],
+            "p90": pcts[90],
+            "p99": pcts[99],
+            "max": pcts[100],
+            "offenders": [
+                {"where": o.where, "count": o.count, "total": o.total, "max": o.max, "stack": o.stack}
+                for o in self.offenders(limit)
+            ]
+        }
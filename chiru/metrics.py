@@ -0,0 +1,181 @@
+"""
+Metrics registry, exposed in the Prometheus text format.
+
+Updating a metric is a dict lookup and an add, so it is cheap enough for the message path.
+Label values are passed positionally, in the order of the metric's label names.
+"""
+import bisect
+
+# Default histogram buckets, in seconds.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = None) -> str:
+    pairs = ['{}="{}"'.format(name, _escape(value)) for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(extra)
+
+    if not pairs:
+        return ""
+
+    return "{" + ",".join(pairs) + "}"
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+        # Label values -> value.
+        self._values = {}
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self) -> list:
+        lines = [
+            "# HELP {} {}".format(self.name, self.help),
+            "# TYPE {} {}".format(self.name, self.type)
+        ]
+        for suffix, labels, value in self._samples():
+            lines.append("{}{}{} {}".format(self.name, suffix, labels, _number(value)))
+
+        return lines
+
+
+class Counter(_Metric):
+    """
+    A value that only goes up.
+
+    If a callback is given, it is called at render time to get the (unlabelled) value instead, for counts that are
+    already kept elsewhere.
+    """
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), callback=None):
+        super().__init__(name, help, labelnames)
+        self.callback = callback
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels) -> float:
+        if self.callback is not None:
+            return self.callback()
+
+        return self._values.get(labels, 0)
+
+    def _samples(self):
+        if self.callback is not None:
+            yield "", "", self.callback()
+            return
+
+        for labels, value in sorted(self._values.items()):
+            yield "", _labels(self.labelnames, labels), value
+
+
+class Gauge(_Metric):
+    """
+    A value that can go up and down.
+
+    If a callback is given, it is called at render time to get the (unlabelled) value instead.
+    """
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), callback=None):
+        super().__init__(name, help, labelnames)
+        self.callback = callback
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self):
+        if self.callback is not None:
+            yield "", "", self.callback()
+            return
+
+        for labels, value in sorted(self._values.items()):
+            yield "", _labels(self.labelnames, labels), value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        try:
+            counts = self._values[labels]
+        except KeyError:
+            # One count per bucket, then +Inf, then the sum.
+            counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _samples(self):
+        for labels, counts in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield "_bucket", _labels(self.labelnames, labels, 'le="{}"'.format(_number(bound))), cumulative
+
+            yield "_sum", _labels(self.labelnames, labels), counts[-1]
+            yield "_count", _labels(self.labelnames, labels), cumulative
+
+
+class Registry:
+    """
+    A collection of metrics.
+
+    Creating a metric that already exists returns the existing one, so cogs can safely create their metrics on reload.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError("Metric {} already exists as a {}".format(name, metric.type))
+
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple = (), callback=None) -> Counter:
+        return self._get_or_create(Counter, name, help, labelnames, callback=callback)
+
+    def gauge(self, name: str, help: str, labelnames: tuple = (), callback=None) -> Gauge:
+        return self._get_or_create(Gauge, name, help, labelnames, callback=callback)
+
+    def histogram(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].render())
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,163 @@
+"""
+Live profiling of the event loop.
+"""
+import asyncio
+import cProfile
+import collections
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+
+
+class ProfilerBusy(Exception):
+    """
+    Raised when a profile is requested while another one is running.
+    """
+
+
+class ProfileResult:
+    """
+    The result of a profiling session.
+    """
+
+    def __init__(self, mode: str, seconds: float, data: bytes, filename: str, top_cumulative: str, top_self: str):
+        self.mode = mode
+        self.seconds = seconds
+        # The downloadable file: marshalled pstats, or folded stacks for flamegraph.pl.
+        self.data = data
+        self.filename = filename
+        self.top_cumulative = top_cumulative
+        self.top_self = top_self
+
+
+class _Sampler:
+    """
+    Samples the stack of a thread at a fixed interval, from another thread.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        # Folded stack -> samples.
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("{}:{} ({})".format(os.path.basename(code.co_filename), code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            del frame
+
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+
+def _format_pstats(profile: cProfile.Profile, limit: int) -> tuple:
+    def _top(sort):
+        stream = io.StringIO()
+        stats = pstats.Stats(profile, stream=stream)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    profile.create_stats()
+    return marshal.dumps(profile.stats), _top("cumulative"), _top("tottime")
+
+
+def _format_samples(sampler: _Sampler, limit: int) -> tuple:
+    cumulative = collections.Counter()
+    own = collections.Counter()
+    for stack, count in sampler.stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        # Recursive frames only count once per sample.
+        for frame in set(frames):
+            cumulative[frame] += count
+
+    def _top(counter):
+        total = sampler.samples or 1
+        lines = ["{:>7} {:>6.1%}  {}".format(count, count / total, frame) for frame, count in counter.most_common(limit)]
+        return "{} samples\n  samples  share  function\n{}".format(sampler.samples, "\n".join(lines))
+
+    folded = "\n".join("{} {}".format(stack, count) for stack, count in sampler.stacks.items())
+    return folded.encode(), _top(cumulative), _top(own)
+
+
+class Profiler:
+    """
+    Profiles the event loop for a fixed window, one session at a time.
+
+    The "cprofile" mode traces every call made on the loop thread, and produces a pstats file. The "sample" mode
+    samples the loop thread's stack from another thread instead, which has far less overhead, and produces folded
+    stacks that can be fed to flamegraph.pl.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, *, sample_interval: float = 0.005):
+        self.loop = loop
+        self.sample_interval = sample_interval
+
+        self._lock = asyncio.Lock(loop=loop)
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def profile(self, seconds: float, mode: str = "cprofile", limit: int = 25) -> ProfileResult:
+        """
+        Profile the loop for `seconds`.
+
+        :raises ProfilerBusy: If another session is running, or something else is already using the profiler hook.
+        """
+        if mode not in ("cprofile", "sample"):
+            raise ValueError("Unknown profiling mode {}".format(mode))
+
+        if self._lock.locked():
+            raise ProfilerBusy("A profile is already running.")
+
+        async with self._lock:
+            if mode == "cprofile":
+                if sys.getprofile() is not None:
+                    raise ProfilerBusy("Another profiler is active on the loop thread.")
+
+                profile = cProfile.Profile()
+                # Profiles everything that runs on the loop thread, since this coroutine runs there.
+                profile.enable()
+                try:
+                    await asyncio.sleep(seconds, loop=self.loop)
+                finally:
+                    profile.disable()
+
+                data, top_cumulative, top_self = await self.loop.run_in_executor(None, _format_pstats, profile, limit)
+                filename = "chiru-{}.pstats".format(time.strftime("%Y%m%d-%H%M%S"))
+            else:
+                sampler = _Sampler(threading.get_ident(), self.sample_interval)
+                sampler.start()
+                try:
+                    await asyncio.sleep(seconds, loop=self.loop)
+                finally:
+                    await self.loop.run_in_executor(None, sampler.stop)
+
+                data, top_cumulative, top_self = await self.loop.run_in_executor(None, _format_samples, sampler,
+                                                                                 limit)
+                filename = "chiru-{}.folded".format(time.strftime("%Y%m%d-%H%M%S"))
+
+        return ProfileResult(mode, seconds, data, filename, top_cumulative, top_self)
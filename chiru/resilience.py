@@ -0,0 +1,343 @@
+"""
+Fault tolerance for the Redis config layer.
+"""
+import collections
+import time
+
+# Marks a pending delete of a whole key.
+DELETE = object()
+
+
+class RedisUnavailable(Exception):
+    """
+    Raised when Redis can't be used right now: it timed out, the connection failed, or the circuit breaker is open.
+    """
+
+
+def _text(value) -> str:
+    """
+    Get the string Redis would hand back for a value.
+    """
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a failing service, so they fail fast instead of each waiting for a timeout.
+
+    After `threshold` failures in a row, the breaker opens and rejects every call. Once `reset_timeout` seconds have
+    passed, it lets a single trial call through (half-open); if that succeeds the breaker closes, and if it fails the
+    breaker opens again for twice as long, up to `max_reset_timeout`.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, *, threshold: int = 5, reset_timeout: float = 1.0, max_reset_timeout: float = 60.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._timeout = reset_timeout
+        self._opened_at = 0.0
+
+    @property
+    def retry_in(self) -> float:
+        """
+        Seconds until the next trial call is allowed.
+        """
+        if self.state != self.OPEN:
+            return 0.0
+
+        return max(0.0, self._opened_at + self._timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        """
+        Check if a call may go through.
+        """
+        if self.state == self.CLOSED:
+            return True
+
+        if self.state == self.OPEN and self.retry_in == 0:
+            # Only this call gets through until it succeeds or fails.
+            self.state = self.HALF_OPEN
+            return True
+
+        return False
+
+    def trip(self):
+        """
+        Open the breaker, whatever state it is in.
+        """
+        if self.state == self.HALF_OPEN:
+            self._timeout = min(self.max_reset_timeout, self._timeout * 2)
+        elif self.state == self.CLOSED:
+            self._timeout = self.reset_timeout
+            self.opened += 1
+
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+
+    def release(self):
+        """
+        Give up a trial call without an outcome (it was cancelled, or failed for an unrelated reason).
+        """
+        if self.state == self.HALF_OPEN:
+            self.state = self.OPEN
+            # Let the next call try again straight away.
+            self._opened_at = time.monotonic() - self._timeout
+
+    def record_success(self) -> bool:
+        """
+        :return: True if this closed the breaker.
+        """
+        self.failures = 0
+        if self.state == self.CLOSED:
+            return False
+
+        self.state = self.CLOSED
+        self._timeout = self.reset_timeout
+        return True
+
+    def record_failure(self) -> bool:
+        """
+        :return: True if this opened the breaker.
+        """
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.threshold):
+            self.trip()
+            return True
+
+        return False
+
+
+class _PendingKey:
+    """
+    The writes waiting for a single key, merged together.
+    """
+
+    __slots__ = ("replace", "adds", "removes", "fields", "deleted_fields")
+
+    def __init__(self):
+        # (value, set kwargs), DELETE, or None if the key is only modified.
+        self.replace = None
+        self.adds = set()
+        self.removes = set()
+        self.fields = {}
+        self.deleted_fields = set()
+
+    @property
+    def size(self) -> int:
+        return (self.replace is not None) + len(self.adds) + len(self.removes) + len(self.fields) + \
+               len(self.deleted_fields)
+
+    def _clear(self):
+        self.adds.clear()
+        self.removes.clear()
+        self.fields.clear()
+        self.deleted_fields.clear()
+
+    def under(self, older: '_PendingKey'):
+        """
+        Merge writes that were queued before these ones underneath them.
+        """
+        if self.replace is not None:
+            # The older writes are overwritten anyway.
+            return
+
+        self.replace = older.replace
+        self.adds |= older.adds - self.removes
+        self.removes |= older.removes - self.adds
+        for field in older.deleted_fields:
+            if field not in self.fields:
+                self.deleted_fields.add(field)
+        for field, value in older.fields.items():
+            if field not in self.fields and field not in self.deleted_fields:
+                self.fields[field] = value
+
+    def commands(self) -> list:
+        """
+        Get the Redis commands that apply these writes, as (method name, args, kwargs).
+        """
+        commands = []
+        if self.replace is DELETE:
+            commands.append(("delete", (), {}))
+        elif self.replace is not None:
+            value, kwargs = self.replace
+            commands.append(("set", (value,), kwargs))
+
+        if self.removes:
+            commands.append(("srem", tuple(self.removes), {}))
+        if self.adds:
+            commands.append(("sadd", tuple(self.adds), {}))
+        if self.deleted_fields:
+            commands.append(("hdel", tuple(self.deleted_fields), {}))
+        for field, value in self.fields.items():
+            commands.append(("hset", (field, value), {}))
+
+        return commands
+
+
+class PendingWrites:
+    """
+    Writes that haven't reached Redis yet, merged per key.
+
+    Writes to the same key are collapsed as they arrive: a SET or DEL replaces everything queued before it, adding a
+    member cancels a queued removal of it, and so on. Reads can be passed through the overlay methods to see the
+    queued writes, and the batch being written, on top of whatever Redis (or the cache) returned.
+    """
+
+    def __init__(self):
+        # Key -> _PendingKey, oldest first.
+        self._keys = collections.OrderedDict()
+        # The batch taken by `take` that is being written.
+        self._writing = {}
+        self.queued = 0
+        self.merged = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key: str):
+        return key in self._keys or key in self._writing
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    @property
+    def size(self) -> int:
+        """
+        The number of pending writes, after merging.
+        """
+        return sum(entry.size for entry in self._keys.values())
+
+    def _entry(self, key: str) -> _PendingKey:
+        self.queued += 1
+        try:
+            entry = self._keys[key]
+        except KeyError:
+            entry = self._keys[key] = _PendingKey()
+        else:
+            self.merged += 1
+
+        return entry
+
+    def set(self, key: str, value, **kwargs):
+        entry = self._entry(key)
+        entry._clear()
+        entry.replace = (_text(value), kwargs)
+
+    def delete(self, key: str):
+        entry = self._entry(key)
+        entry._clear()
+        entry.replace = DELETE
+
+    def sadd(self, key: str, member):
+        entry = self._entry(key)
+        member = _text(member)
+        entry.removes.discard(member)
+        entry.adds.add(member)
+
+    def srem(self, key: str, member):
+        entry = self._entry(key)
+        member = _text(member)
+        entry.adds.discard(member)
+        entry.removes.add(member)
+
+    def hset(self, key: str, field: str, value):
+        entry = self._entry(key)
+        entry.deleted_fields.discard(field)
+        entry.fields[field] = _text(value)
+
+    def hdel(self, key: str, field: str):
+        entry = self._entry(key)
+        entry.fields.pop(field, None)
+        entry.deleted_fields.add(field)
+
+    def take(self, limit: int = None) -> collections.OrderedDict:
+        """
+        Remove up to `limit` keys (all of them by default), oldest first, to be written.
+
+        They stay visible to reads until `finish` or `restore` is called.
+        """
+        if limit is None or limit >= len(self._keys):
+            taken, self._keys = self._keys, collections.OrderedDict()
+        else:
+            taken = collections.OrderedDict()
+            for _ in range(limit):
+                key, entry = self._keys.popitem(last=False)
+                taken[key] = entry
+
+        self._writing = taken
+        return taken
+
+    def finish(self):
+        """
+        Forget the batch from `take`, once it has been written.
+        """
+        self._writing = {}
+
+    def restore(self, taken: collections.OrderedDict):
+        """
+        Put back keys from `take` that could not be written, underneath anything queued since.
+        """
+        keys = collections.OrderedDict()
+        for key, entry in taken.items():
+            newer = self._keys.get(key)
+            if newer is not None:
+                newer.under(entry)
+                entry = newer
+            keys[key] = entry
+
+        for key, entry in self._keys.items():
+            if key not in keys:
+                keys[key] = entry
+
+        self._keys = keys
+        self._writing = {}
+
+    # Overlays, for reads.
+
+    def _entries(self, key: str) -> list:
+        """
+        Get the writes to a key, oldest first.
+        """
+        return [entry for entry in (self._writing.get(key), self._keys.get(key)) if entry is not None]
+
+    def string(self, key: str, value):
+        for entry in self._entries(key):
+            if entry.replace is not None:
+                value = None if entry.replace is DELETE else entry.replace[0]
+
+        return value
+
+    def members(self, key: str, members: list) -> list:
+        for entry in self._entries(key):
+            if entry.replace is DELETE:
+                members = []
+            members = [m for m in members if m not in entry.removes]
+            members += [m for m in entry.adds if m not in members]
+
+        return members
+
+    def hash(self, key: str, mapping: dict) -> dict:
+        for entry in self._entries(key):
+            mapping = {} if entry.replace is DELETE else dict(mapping)
+            for field in entry.deleted_fields:
+                mapping.pop(field, None)
+            mapping.update(entry.fields)
+
+        return mapping
+
+    def field(self, key: str, field: str, value):
+        for entry in self._entries(key):
+            if field in entry.fields:
+                value = entry.fields[field]
+            elif field in entry.deleted_fields or entry.replace is DELETE:
+                value = None
+
+        return value
@@ -0,0 +1,78 @@
+"""
+Incrementally maintained role membership index.
+"""
+import discord
+
+
+class RoleIndex:
+    """
+    A per-server index of role ID -> set of member IDs.
+
+    Built once per server, and kept up to date from member and role events.
+    """
+
+    def __init__(self):
+        # Server ID -> role ID -> member IDs.
+        self._servers = {}
+
+    def build(self, server: discord.Server):
+        roles = {}
+        for member in list(server.members):
+            for role in member.roles:
+                roles.setdefault(role.id, set()).add(member.id)
+
+        self._servers[server.id] = roles
+
+    def remove_server(self, server: discord.Server):
+        self._servers.pop(server.id, None)
+
+    def add_member(self, member: discord.Member):
+        roles = self._servers.get(member.server.id)
+        if roles is None:
+            return
+
+        for role in member.roles:
+            roles.setdefault(role.id, set()).add(member.id)
+
+    def remove_member(self, member: discord.Member):
+        roles = self._servers.get(member.server.id)
+        if roles is None:
+            return
+
+        for role in member.roles:
+            members = roles.get(role.id)
+            if members is not None:
+                members.discard(member.id)
+
+    def update_member(self, before: discord.Member, after: discord.Member):
+        roles = self._servers.get(after.server.id)
+        if roles is None:
+            return
+
+        old = {role.id for role in before.roles}
+        new = {role.id for role in after.roles}
+        for role_id in old - new:
+            members = roles.get(role_id)
+            if members is not None:
+                members.discard(after.id)
+        for role_id in new - old:
+            roles.setdefault(role_id, set()).add(after.id)
+
+    def remove_role(self, role: discord.Role):
+        roles = self._servers.get(role.server.id)
+        if roles is not None:
+            roles.pop(role.id, None)
+
+    def members(self, server: discord.Server, role: discord.Role) -> set:
+        """
+        Get the IDs of the members that have a role.
+
+        Servers that haven't been indexed yet are indexed on the spot.
+        """
+        if server.id not in self._servers:
+            self.build(server)
+
+        return self._servers[server.id].get(role.id, set())
+
+    def count(self, server: discord.Server, role: discord.Role) -> int:
+        return len(self.members(server, role))
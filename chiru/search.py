@@ -0,0 +1,133 @@
+"""
+Fuzzy search helpers.
+
+fuzzywuzzy is slow to import, so it is only imported once a search or an index needs it.
+"""
+import array
+import bisect
+import collections
+import heapq
+
+
+def normalize(query: str) -> str:
+    """
+    Normalize a query the same way the index and the scorers do.
+    """
+    from fuzzywuzzy.utils import full_process
+    return full_process(query)
+
+
+def _ngrams(processed: str, n: int):
+    padded = " {} ".format(processed)
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+class NgramIndex:
+    """
+    An n-gram inverted index over a list of keys.
+
+    Queries only score a small candidate set (the keys sharing the most n-grams with the query, plus prefix matches)
+    with the fuzzy scorer, instead of every key. Queries that share nothing with any key fall back to scoring every key,
+    like `process.extractOne` does.
+    """
+
+    def __init__(self, keys, n: int = 3, max_candidates: int = 64):
+        self.n = n
+        self.max_candidates = max_candidates
+
+        from fuzzywuzzy.utils import full_process
+
+        # Shared with the caller when possible, rather than copied.
+        self.keys = keys if isinstance(keys, list) else list(keys)
+        processed = [full_process(key) for key in self.keys]
+
+        # Processed key -> first key index, for exact matches.
+        self._exact = {}
+        # Gram -> key indexes.
+        self._postings = collections.defaultdict(list)
+        # Number of distinct grams in each key.
+        self._sizes = array.array("I")
+        for idx, p in enumerate(processed):
+            self._exact.setdefault(p, idx)
+            grams = _ngrams(p, n)
+            self._sizes.append(len(grams))
+            for gram in grams:
+                self._postings[gram].append(idx)
+        # Arrays of machine ints are much smaller than lists of int objects.
+        self._postings = {gram: array.array("I", idxs) for gram, idxs in self._postings.items()}
+
+        # Sorted processed keys, for prefix matches.
+        order = sorted(range(len(processed)), key=processed.__getitem__)
+        self._sorted = [processed[i] for i in order]
+        self._sorted_idx = array.array("I", order)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _prefix_matches(self, processed: str, limit: int):
+        start = bisect.bisect_left(self._sorted, processed)
+        return [self._sorted_idx[pos] for pos in range(start, min(start + limit, len(self._sorted)))
+                if self._sorted[pos].startswith(processed)]
+
+    def _candidates(self, processed: str):
+        grams = _ngrams(processed, self.n)
+        counter = collections.Counter()
+        for gram in grams:
+            posting = self._postings.get(gram)
+            if posting is not None:
+                counter.update(posting)
+
+        # Rank by the Dice coefficient of the gram sets, which tracks QRatio far better than the raw overlap, since
+        # it penalises long keys.
+        size = len(grams)
+        sizes = self._sizes
+        best = heapq.nlargest(self.max_candidates, counter.items(), key=lambda t: t[1] / (size + sizes[t[0]]))
+        return [idx for idx, _ in best]
+
+    def search(self, query: str, limit: int = 1, scorer=None):
+        """
+        Search the index.
+
+        :param scorer: The fuzzywuzzy scorer to use. Defaults to QRatio.
+        :return: A list of up to `limit` (key, score) tuples, best first.
+        """
+        from fuzzywuzzy.fuzz import QRatio
+        from fuzzywuzzy.utils import full_process
+
+        scorer = scorer or QRatio
+        processed = full_process(query)
+        if not processed:
+            return []
+
+        exact = self._exact.get(processed)
+        if exact is not None and limit == 1:
+            # Nothing scores higher than an exact match.
+            return [(self.keys[exact], 100)]
+
+        candidates = set(self._candidates(processed))
+        candidates.update(self._prefix_matches(processed, self.max_candidates))
+        if exact is not None:
+            candidates.add(exact)
+        if not candidates:
+            candidates = range(len(self.keys))
+
+        scored = [(scorer(query, self.keys[idx]), idx) for idx in candidates]
+        # Highest score first, ties broken by key order like `process.extract`.
+        scored.sort(key=lambda t: (-t[0], t[1]))
+        return [(self.keys[idx], score) for score, idx in scored[:limit]]
+
+
+def search_many(indexes: dict, query: str, limit: int = 1, scorer=None):
+    """
+    Search several named indexes, merging their results.
+
+    :return: A list of up to `limit` (key, score, name) tuples, best first.
+    """
+    results = []
+    for name, index in indexes.items():
+        for key, score in index.search(query, limit, scorer=scorer):
+            results.append((key, score, name))
+
+    # Stable sort, so earlier indexes win ties.
+    results.sort(key=lambda t: -t[1])
+    return results[:limit]
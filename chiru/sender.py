@@ -0,0 +1,238 @@
+"""
+Rate-limited outbound message queue.
+"""
+import asyncio
+import collections
+import time
+
+from chiru import util
+
+# Discord's message length limit, minus the zero-width space Chiru prefixes every message with.
+MAX_LENGTH = 1999
+
+
+class TokenBucket:
+    """
+    A token bucket allowing `rate` actions every `per` seconds.
+    """
+
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+
+    @property
+    def full(self) -> bool:
+        self._refill()
+        return self._tokens >= self.rate
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate / self.per)
+        self._updated = now
+
+    def delay(self) -> float:
+        """
+        Take a token, if one is available.
+
+        :return: 0 if a token was taken, otherwise the number of seconds until one is available.
+        """
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+
+        return (1 - self._tokens) * self.per / self.rate
+
+    async def acquire(self, loop: asyncio.AbstractEventLoop):
+        while True:
+            delay = self.delay()
+            if not delay:
+                return
+
+            await asyncio.sleep(delay, loop=loop)
+
+
+class _Pending:
+    __slots__ = ("content", "tts", "mergeable", "future", "queued_at")
+
+    def __init__(self, content: str, tts: bool, mergeable: bool, future: asyncio.Future):
+        self.content = content
+        self.tts = tts
+        # Only messages nobody waits on can be merged, as merged messages all resolve to the same discord.Message.
+        self.mergeable = mergeable and not tts
+        self.future = future
+        self.queued_at = time.monotonic()
+
+
+class _ChannelQueue:
+    __slots__ = ("destination", "pending", "bucket", "worker")
+
+    def __init__(self, destination, bucket: TokenBucket):
+        self.destination = destination
+        self.pending = collections.deque()
+        self.bucket = bucket
+        self.worker = None
+
+
+class MessageQueue:
+    """
+    A per-channel outbound message queue.
+
+    Each channel is paced by its own token bucket. Consecutive short fire-and-forget messages to the same channel are
+    merged into one send, and messages over the length limit are split.
+    """
+
+    def __init__(self, send, loop: asyncio.AbstractEventLoop, *, rate: int = 5, per: float = 5.0,
+                 merge: bool = True):
+        """
+        :param send: A coroutine function taking (destination, content, tts) that actually sends a message.
+        """
+        self._send = send
+        self.loop = loop
+        self.rate = rate
+        self.per = per
+        self.merge = merge
+
+        # Channel ID -> _ChannelQueue. Idle queues are kept until their bucket refills, so bursts stay paced.
+        self._queues = {}
+        self.max_idle = 1024
+
+        self.sent = 0
+        self.merged = 0
+        # Seconds between queueing and sending, for the most recent sends.
+        self._delays = collections.deque(maxlen=512)
+
+    @property
+    def depth(self) -> int:
+        """
+        The number of messages waiting to be sent.
+        """
+        return sum(len(q.pending) for q in self._queues.values())
+
+    def put(self, destination, content: str, *, tts: bool = False, merge: bool = False,
+            parts: bool = False) -> asyncio.Future:
+        """
+        Queue a message.
+
+        :param merge: If the message may be merged with neighbouring ones. Only pass True if nothing will edit or delete
+            the sent message, since every merged message resolves to the same one.
+        :param parts: If the future should resolve to the list of messages sent, one per chunk, even if the message
+            didn't need splitting.
+        :return: A future resolving to the sent message. If it had to be split, it resolves to the last chunk's message
+            once every chunk has been sent, or raises the error of the first chunk that could not be sent.
+        """
+        key = getattr(destination, "id", destination)
+        queue = self._queues.get(key)
+        if queue is None:
+            if len(self._queues) >= self.max_idle:
+                self._prune()
+            queue = self._queues[key] = _ChannelQueue(destination, TokenBucket(self.rate, self.per))
+
+        chunks = [content] if len(content) <= MAX_LENGTH else util.chunk(content)
+        futures = []
+        for chunk in chunks:
+            future = asyncio.Future(loop=self.loop)
+            queue.pending.append(_Pending(chunk, tts, self.merge and merge, future))
+            futures.append(future)
+
+        if queue.worker is None:
+            queue.worker = self.loop.create_task(self._drain(queue))
+
+        if parts:
+            return self._combine(futures, list)
+
+        if len(futures) == 1:
+            return futures[0]
+
+        return self._combine(futures, lambda messages: messages[-1])
+
+    def _combine(self, futures: list, result) -> asyncio.Future:
+        """
+        Combine the futures of a split message's chunks into one, resolving to `result(list of sent messages)`.
+        """
+        combined = asyncio.Future(loop=self.loop)
+
+        def _done(_):
+            if combined.done() or not all(f.done() for f in futures):
+                return
+
+            errors = [f.exception() for f in futures if not f.cancelled() and f.exception() is not None]
+            if errors:
+                combined.set_exception(errors[0])
+            elif any(f.cancelled() for f in futures):
+                combined.cancel()
+            else:
+                combined.set_result(result([f.result() for f in futures]))
+
+        for future in futures:
+            future.add_done_callback(_done)
+
+        return combined
+
+    def _prune(self):
+        """
+        Forget idle queues whose bucket has refilled.
+        """
+        for key, queue in list(self._queues.items()):
+            if queue.worker is None and not queue.pending and queue.bucket.full:
+                del self._queues[key]
+
+    def _take(self, queue: _ChannelQueue) -> list:
+        """
+        Take the next message off a queue, along with any that can be merged into it.
+        """
+        first = queue.pending.popleft()
+        batch = [first]
+        if not first.mergeable:
+            return batch
+
+        length = len(first.content)
+        while queue.pending:
+            nxt = queue.pending[0]
+            if not nxt.mergeable or length + 1 + len(nxt.content) > MAX_LENGTH:
+                break
+            length += 1 + len(nxt.content)
+            batch.append(queue.pending.popleft())
+
+        return batch
+
+    async def _drain(self, queue: _ChannelQueue):
+        try:
+            while queue.pending:
+                await queue.bucket.acquire(self.loop)
+                batch = self._take(queue)
+                content = "\n".join(p.content for p in batch)
+
+                now = time.monotonic()
+                for p in batch:
+                    self._delays.append(now - p.queued_at)
+
+                try:
+                    message = await self._send(queue.destination, content, batch[0].tts)
+                except Exception as e:
+                    for p in batch:
+                        if not p.future.done():
+                            p.future.set_exception(e)
+                else:
+                    self.sent += 1
+                    self.merged += len(batch) - 1
+                    for p in batch:
+                        if not p.future.done():
+                            p.future.set_result(message)
+        finally:
+            queue.worker = None
+
+    def stats(self) -> dict:
+        delays = list(self._delays)
+        return {
+            "channels": sum(1 for q in self._queues.values() if q.worker is not None),
+            "depth": self.depth,
+            "sent": self.sent,
+            "merged": self.merged,
+            "delay_avg": sum(delays) / len(delays) if delays else 0.0,
+            "delay_max": max(delays) if delays else 0.0
+        }
+
@@ -1,17 +1,16 @@
 """
 Utilities
 """
-import aiohttp
 
-async def get_file(url):
+
+async def get_file(client, url):
     """
-    Get a file from the web using aiohttp.
+    Get a file from the web using the bot's HTTP client.
+
+    :param client: The :class:`chiru.httpclient.HTTPClient` to use, usually `bot.http_client`.
     """
-    with aiohttp.ClientSession() as sess:
-        async with sess.get(url) as get:
-            assert isinstance(get, aiohttp.ClientResponse)
-            data = await get.read()
-            return data
+    response = await client.get(url)
+    return response.body
 
 
 def safe_roles(roles: list):
@@ -0,0 +1,172 @@
+"""
+Sharded launcher.
+
+Runs one Chiru process per shard, and restarts shards that crash.
+"""
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+import logbook
+import yaml
+from logbook import StreamHandler
+
+StreamHandler(sys.stderr).push_application()
+logger = logbook.Logger("Launcher")
+
+# Exit code a shard uses to ask not to be restarted (the owner shut it down, or it can't log in). Any other exit, even
+# a clean one, is restarted. The same as bot.SHUTDOWN_EXIT_CODE; not imported from there, so the supervisor doesn't
+# have to load discord.py.
+SHUTDOWN_EXIT_CODE = 64
+
+
+def run_shard(config_path: str, shard_id: int, shard_count: int):
+    """
+    Entry point of a shard process.
+    """
+    sys.argv = [sys.argv[0], config_path]
+    from bot import Chiru, _get_command_prefix
+
+    client = Chiru(command_prefix=_get_command_prefix, description="AAAA",
+                   shard_id=shard_id, shard_count=shard_count)
+    client.main()
+
+
+class Shard:
+    __slots__ = ("shard_id", "process", "started", "restarts", "next_start")
+
+    def __init__(self, shard_id: int):
+        self.shard_id = shard_id
+        self.process = None
+        self.started = 0.0
+        self.restarts = 0
+        self.next_start = 0.0
+
+
+class Launcher:
+    """
+    Supervises one process per shard.
+
+    Startups are staggered, since Discord only allows one IDENTIFY every few seconds. Shards that exit are restarted
+    with exponential backoff, unless they exit with SHUTDOWN_EXIT_CODE or the launcher itself is stopping.
+    """
+
+    def __init__(self, config_path: str, shard_count: int, *, stagger: float = 5.0, backoff: float = 5.0,
+                 max_backoff: float = 300.0, stable_after: float = 600.0, target=run_shard):
+        self.config_path = config_path
+        self.shard_count = shard_count
+        self.stagger = stagger
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self.target = target
+
+        # Don't inherit the parent's state; each shard builds its own loop and connections.
+        self._context = multiprocessing.get_context("spawn")
+        self.shards = [Shard(i) for i in range(shard_count)]
+        self._last_start = -stagger
+        self._running = False
+        # Seconds between checks on the shard processes.
+        self.poll_interval = 0.5
+
+    def _start(self, shard: Shard):
+        shard.process = self._context.Process(target=self.target, name="chiru-shard-{}".format(shard.shard_id),
+                                              args=(self.config_path, shard.shard_id, self.shard_count))
+        shard.process.start()
+        shard.started = self._last_start = time.monotonic()
+        logger.info("Started shard {} (pid {}).".format(shard.shard_id, shard.process.pid))
+
+    def _reap(self, shard: Shard, now: float):
+        """
+        Handle a shard process that has exited.
+
+        :return: True if the shard should be restarted.
+        """
+        code = shard.process.exitcode
+        shard.process = None
+        if code == SHUTDOWN_EXIT_CODE:
+            logger.info("Shard {} asked to shut down; not restarting it.".format(shard.shard_id))
+            return False
+
+        if now - shard.started >= self.stable_after:
+            # It ran long enough that this is a fresh failure, not a crash loop.
+            shard.restarts = 0
+
+        delay = min(self.max_backoff, self.backoff * 2 ** shard.restarts)
+        shard.restarts += 1
+        shard.next_start = now + delay
+        logger.error("Shard {} exited with code {}; restarting in {:.1f} seconds.".format(shard.shard_id, code, delay))
+        return True
+
+    def run(self):
+        self._running = True
+        now = time.monotonic()
+        # Shards still to be (re)started.
+        waiting = set(self.shards)
+        for shard in self.shards:
+            shard.next_start = now + shard.shard_id * self.stagger
+
+        try:
+            while self._running and (waiting or any(s.process is not None for s in self.shards)):
+                now = time.monotonic()
+                for shard in self.shards:
+                    if shard.process is not None:
+                        if shard.process.is_alive():
+                            continue
+                        if self._reap(shard, now):
+                            waiting.add(shard)
+
+                    if shard in waiting and now >= shard.next_start and now - self._last_start >= self.stagger:
+                        waiting.discard(shard)
+                        self._start(shard)
+
+                time.sleep(self.poll_interval)
+        finally:
+            self.stop()
+
+    def stop(self, timeout: float = 10.0):
+        self._running = False
+        alive = [s.process for s in self.shards if s.process is not None and s.process.is_alive()]
+        for process in alive:
+            process.terminate()
+
+        deadline = time.monotonic() + timeout
+        for process in alive:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("Shard process {} did not stop; killing it.".format(process.pid))
+                os.kill(process.pid, signal.SIGKILL)
+
+
+def main():
+    try:
+        config_path = sys.argv[1]
+    except IndexError:
+        config_path = "config.yml"
+
+    with open(config_path) as f:
+        config = yaml.load(f)
+
+    shard_cfg = config.get("shards", {})
+    shard_count = shard_cfg.get("count") or multiprocessing.cpu_count()
+    logger.info("Launching {} shards from `{}`.".format(shard_count, config_path))
+
+    launcher = Launcher(config_path, shard_count,
+                        stagger=shard_cfg.get("stagger", 5.0),
+                        backoff=shard_cfg.get("backoff", 5.0),
+                        max_backoff=shard_cfg.get("max_backoff", 300.0))
+
+    def _terminate(*args):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        launcher.run()
+    except KeyboardInterrupt:
+        logger.info("Stopping shards.")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,7 @@ class Context(commands.Context):
     """
     Overriden context.
     """
+
     def __init__(self, **attrs):
         self.bot = attrs.pop('bot', None)
         self.args = attrs.pop('args', [])
@@ -42,4 +43,10 @@ class Context(commands.Context):
         return await self.bot.get_config(self.server, key)
 
     async def set_config(self, key, value):
-        return await self.bot.set_config(self.server, key, value)
\ No newline at end of file
+        return await self.bot.set_config(self.server, key, value)
+
+    async def get_many_config(self, keys):
+        return await self.bot.get_many_config(self.server, keys)
+
+    async def set_many_config(self, mapping):
+        return await self.bot.set_many_config(self.server, mapping)
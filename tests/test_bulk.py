@@ -0,0 +1,64 @@
+"""
+Tests for the bulk operation executor, against a stand-in bot.
+"""
+import types
+
+import pytest
+
+pytest.importorskip("discord")
+
+from chiru.bulk import BulkOperation  # noqa: E402
+
+
+class StandInBot:
+    def __init__(self, loop):
+        self.loop = loop
+        self.errors = []
+        self.logger = types.SimpleNamespace(error=self.errors.append, warning=self.errors.append)
+
+    async def send_message(self, destination, content):
+        return content
+
+    async def edit_message(self, message, content):
+        return content
+
+
+def _action(result=None, error: Exception = None):
+    async def action():
+        if error is not None:
+            raise error
+        return result
+
+    return action
+
+
+def test_results(loop):
+    bot = StandInBot(loop)
+    actions = [
+        _action({"id": "1"}),
+        # What HTTPClient returns for a 204.
+        _action(""),
+        # What HTTPClient returns once it gives up on a rate limited request.
+        _action(None),
+        _action(error=RuntimeError("Missing Permissions")),
+    ]
+    op = BulkOperation(bot, "Resetting nicknames", actions, total=len(actions), concurrency=2)
+    loop.run_until_complete(op.run("general"))
+
+    assert (op.done, op.failed) == (2, 2)
+    assert bot.errors == ["Resetting nicknames failed: discord.py gave up retrying a rate limit.",
+                          "Resetting nicknames failed: Missing Permissions"]
+    assert op._format() == "**Resetting nicknames** (finished): `4`/`4` processed, `2` failed."
+
+
+def test_cancel_stops_new_actions(loop):
+    def actions():
+        yield _action("")
+        op.cancel()
+        yield _action("")
+        yield _action("")
+
+    op = BulkOperation(StandInBot(loop), "Nuking roles", actions(), concurrency=1)
+    loop.run_until_complete(op.run("general"))
+
+    assert op.done == 1
@@ -0,0 +1,149 @@
+"""
+Tests for the on-disk pydoc inventory cache, against a local HTTP stand-in.
+"""
+import asyncio
+import logging
+import os
+import types
+import zlib
+
+import pytest
+
+pytest.importorskip("discord")
+pytest.importorskip("sphinx")
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web
+
+from chiru.cogs import docs as docs_cog
+from chiru.httpclient import HTTPClient
+
+ETAG = '"v1"'
+LAST_MODIFIED = "Sat, 01 Oct 2016 00:00:00 GMT"
+
+
+def _objects_inv() -> bytes:
+    header = (b"# Sphinx inventory version 2\n"
+              b"# Project: Spam\n"
+              b"# Version: 1.0\n"
+              b"# The remainder of this file is compressed using zlib.\n")
+    body = (b"spam.eggs py:function 1 spam.html#$ -\n"
+            b"spam.Ham py:class 1 spam.html#$ -\n")
+    return header + zlib.compress(body)
+
+
+class InventoryServer:
+    """
+    Serves one objects.inv, answering conditional requests with 304.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.requests = []
+        self.body = _objects_inv()
+
+        self.app = web.Application(loop=loop)
+        self.app.router.add_route("GET", "/objects.inv", self.handle)
+        self._handler = None
+        self._server = None
+        self.url = None
+
+    async def handle(self, request):
+        self.requests.append(dict(request.headers))
+        if request.headers.get("If-None-Match") == ETAG or \
+                request.headers.get("If-Modified-Since") == LAST_MODIFIED:
+            return web.Response(status=304)
+
+        return web.Response(body=self.body, headers={"ETag": ETAG, "Last-Modified": LAST_MODIFIED})
+
+    async def start(self):
+        self._handler = self.app.make_handler()
+        self._server = await self.loop.create_server(self._handler, "127.0.0.1", 0)
+        port = self._server.sockets[0].getsockname()[1]
+        self.url = "http://127.0.0.1:{}/objects.inv".format(port)
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        await self._handler.finish_connections()
+
+
+@pytest.fixture
+def server(loop):
+    server = InventoryServer(loop)
+    loop.run_until_complete(server.start())
+    yield server
+    loop.run_until_complete(server.stop())
+
+
+def _docs(loop, server, cache_path) -> docs_cog.Docs:
+    bot = types.SimpleNamespace(
+        loop=loop,
+        logger=logging.getLogger("test"),
+        config={"docs": {"spam": server.url}, "docs_cache": str(cache_path)},
+        http_client=HTTPClient(loop)
+    )
+    return docs_cog.Docs(bot)
+
+
+def _run(loop, docs: docs_cog.Docs):
+    try:
+        loop.run_until_complete(docs.setup())
+    finally:
+        loop.run_until_complete(docs.bot.http_client.close())
+
+
+def test_fresh_download_is_cached(loop, server, tmpdir):
+    cache_path = tmpdir.join("pydoc.cache")
+    docs = _docs(loop, server, cache_path)
+    _run(loop, docs)
+
+    assert "spam.eggs" in docs.invdata["spam"]
+    assert "If-None-Match" not in server.requests[0]
+    assert cache_path.check()
+    # Written to a temporary file, then moved into place.
+    assert not tmpdir.join("pydoc.cache.tmp").check()
+
+
+def test_cached_copy_is_revalidated(loop, server, tmpdir):
+    cache_path = tmpdir.join("pydoc.cache")
+    _run(loop, _docs(loop, server, cache_path))
+    before = cache_path.read_binary()
+
+    docs = _docs(loop, server, cache_path)
+    _run(loop, docs)
+
+    assert server.requests[-1].get("If-None-Match") == ETAG
+    assert server.requests[-1].get("If-Modified-Since") == LAST_MODIFIED
+    # 304: served from the cache, which is left alone.
+    assert "spam.Ham" in docs.invdata["spam"]
+    assert docs._source_stats["spam"]["cached"]
+    assert cache_path.read_binary() == before
+
+
+def test_corrupt_cache_is_ignored(loop, server, tmpdir):
+    cache_path = tmpdir.join("pydoc.cache")
+    cache_path.write_binary(b"\xc1 not msgpack")
+
+    docs = _docs(loop, server, cache_path)
+    _run(loop, docs)
+
+    # Nothing usable was cached, so the request isn't conditional.
+    assert "If-None-Match" not in server.requests[0]
+    assert "spam.eggs" in docs.invdata["spam"]
+    assert docs._load_cache()["spam"]["etag"] == ETAG
+
+
+def test_failed_save_keeps_old_cache(loop, server, tmpdir, monkeypatch):
+    cache_path = tmpdir.join("pydoc.cache")
+    docs = _docs(loop, server, cache_path)
+    _run(loop, docs)
+    before = cache_path.read_binary()
+
+    def _fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(docs_cog.msgpack, "packb", _fail)
+    with pytest.raises(OSError):
+        docs._save_cache(docs._load_cache())
+
+    assert cache_path.read_binary() == before
@@ -0,0 +1,140 @@
+"""
+Tests for the feeds migration, against a fake redis connection.
+"""
+import types
+
+import pytest
+
+aioredis = pytest.importorskip("aioredis")
+pytest.importorskip("discord")
+
+from chiru.cogs import feeds  # noqa: E402
+
+
+def _watch_error(commands: int) -> Exception:
+    # What aioredis 0.2.8 raises when EXEC is aborted because a watched key changed.
+    return aioredis.MultiExecError([aioredis.WatchVariableError("WATCH variable has changed")] * commands)
+
+
+class FakeTransaction:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+        self.futures = []
+
+    def _queue(self, *command):
+        self.commands.append(command)
+        future = self.redis.loop.create_future()
+        self.futures.append(future)
+        return future
+
+    def hset(self, key, field, value):
+        return self._queue("hset", key, field, value)
+
+    def delete(self, *keys):
+        return self._queue("delete", *keys)
+
+    async def execute(self):
+        if self.redis.conflicts:
+            self.redis.conflicts -= 1
+            error = _watch_error(len(self.commands))
+            for future in self.futures:
+                future.set_exception(error.args[-1][0])
+            raise error
+
+        for future in self.futures:
+            future.set_result(1)
+
+        for command, key, *args in self.commands:
+            if command == "hset":
+                self.redis.hashes.setdefault(key, {})[args[0]] = args[1]
+            else:
+                for old in (key,) + tuple(args):
+                    self.redis.data.pop(old, None)
+
+
+class FakeRedis:
+    def __init__(self, loop, data: dict, conflicts: int = 0):
+        self.loop = loop
+        self.data = dict(data)
+        self.hashes = {}
+        self.conflicts = conflicts
+        self.watched = []
+
+    async def scan(self, cursor, match=None, count=None):
+        return 0, sorted(self.data)
+
+    async def watch(self, *keys):
+        self.watched.append(keys)
+
+    async def mget(self, *keys):
+        return [self.data.get(key) for key in keys]
+
+    def multi_exec(self):
+        return FakeTransaction(self)
+
+
+def _cog(redis: FakeRedis):
+    said = []
+    published = []
+
+    async def _execute(func):
+        return await func(redis)
+
+    async def flush_writes():
+        return 0
+
+    async def _publish_invalidation(conn, *keys):
+        published.extend(keys)
+
+    async def say(content):
+        said.append(content)
+
+    bot = types.SimpleNamespace(loop=redis.loop, _execute=_execute, flush_writes=flush_writes, say=say,
+                                _publish_invalidation=_publish_invalidation,
+                                config_cache=types.SimpleNamespace(pop=lambda key: None))
+    return feeds.Feeds(bot), said, published
+
+
+def _migrate(loop, cog):
+    loop.run_until_complete(feeds.Feeds.migrate.callback(cog, None))
+
+
+OLD_KEYS = {b"cfg:1:feeds:news": b"10", b"cfg:2:feeds:a:b": b"20"}
+
+
+def test_watch_failed_matches_aioredis_error():
+    assert feeds._watch_failed(_watch_error(2))
+    assert not feeds._watch_failed(aioredis.MultiExecError([aioredis.ReplyError("WRONGTYPE")]))
+
+
+def test_migrate_moves_keys(loop):
+    redis = FakeRedis(loop, OLD_KEYS)
+    cog, said, published = _cog(redis)
+    _migrate(loop, cog)
+
+    assert redis.data == {}
+    assert redis.hashes == {"cfg:1:feeds": {"news": b"10"}, "cfg:2:feeds": {"a:b": b"20"}}
+    assert set(published) == {"cfg:1:feeds", "cfg:1:feeds#news", "cfg:2:feeds", "cfg:2:feeds#a:b"}
+    assert said == ["Migrated `2` feeds across `2` servers."]
+
+
+def test_migrate_retries_watch_conflicts(loop):
+    redis = FakeRedis(loop, OLD_KEYS, conflicts=feeds.MIGRATE_ATTEMPTS - 1)
+    cog, said, _ = _cog(redis)
+    _migrate(loop, cog)
+
+    assert len(redis.watched) == feeds.MIGRATE_ATTEMPTS
+    assert redis.data == {}
+    assert said == ["Migrated `2` feeds across `2` servers."]
+
+
+def test_migrate_reports_batch_that_kept_changing(loop):
+    redis = FakeRedis(loop, OLD_KEYS, conflicts=feeds.MIGRATE_ATTEMPTS)
+    cog, said, published = _cog(redis)
+    _migrate(loop, cog)
+
+    assert redis.data == OLD_KEYS
+    assert published == []
+    assert said == [":x: The batch of `2` keys starting at `cfg:1:feeds:news` kept changing after `5` attempts. "
+                    "Migrated `0` feeds before that; run this again to finish."]
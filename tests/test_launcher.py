@@ -0,0 +1,111 @@
+"""
+Tests for the sharded launcher, with stand-in workers instead of real shards.
+"""
+import json
+import os
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("logbook")
+
+import launcher
+
+
+def stand_in_shard(workdir: str, shard_id: int, shard_count: int):
+    """
+    A stand-in worker. It records each start, then exits with the next code planned for its shard, or stays up once
+    the plan runs out.
+    """
+    with open(os.path.join(workdir, "plan.json")) as f:
+        plan = json.load(f).get(str(shard_id), [])
+
+    starts = os.path.join(workdir, "starts-{}".format(shard_id))
+    with open(starts, "a") as f:
+        f.write("{} {}\n".format(time.monotonic(), shard_count))
+    with open(starts) as f:
+        run = len(f.readlines()) - 1
+
+    if run < len(plan):
+        os._exit(plan[run])
+
+    while True:
+        time.sleep(1)
+
+
+def _starts(workdir, shard_id: int) -> list:
+    try:
+        with open(os.path.join(str(workdir), "starts-{}".format(shard_id))) as f:
+            return [float(line.split()[0]) for line in f]
+    except FileNotFoundError:
+        return []
+
+
+def _launch(workdir, plan: dict, shard_count: int) -> launcher.Launcher:
+    with open(os.path.join(str(workdir), "plan.json"), "w") as f:
+        json.dump({str(k): v for k, v in plan.items()}, f)
+
+    supervisor = launcher.Launcher(str(workdir), shard_count, stagger=0.2, backoff=0.1, max_backoff=0.4,
+                                   target=stand_in_shard)
+    supervisor.poll_interval = 0.05
+    thread = threading.Thread(target=supervisor.run, daemon=True)
+    thread.start()
+    supervisor.thread = thread
+    return supervisor
+
+
+def _wait_for(condition, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def _stop(supervisor: launcher.Launcher):
+    supervisor.stop()
+    supervisor.thread.join(10)
+    assert not supervisor.thread.is_alive()
+    assert all(s.process is None or not s.process.is_alive() for s in supervisor.shards)
+
+
+def test_starts_are_staggered(tmpdir):
+    supervisor = _launch(tmpdir, {}, 3)
+    try:
+        assert _wait_for(lambda: all(_starts(tmpdir, i) for i in range(3)))
+        started = sorted(shard.started for shard in supervisor.shards)
+        assert all(b - a >= 0.2 for a, b in zip(started, started[1:]))
+    finally:
+        _stop(supervisor)
+
+
+def test_crashes_are_restarted(tmpdir):
+    supervisor = _launch(tmpdir, {0: [1, 1]}, 1)
+    try:
+        assert _wait_for(lambda: len(_starts(tmpdir, 0)) == 3)
+        assert supervisor.shards[0].restarts == 2
+    finally:
+        _stop(supervisor)
+
+
+def test_clean_exits_are_restarted(tmpdir):
+    supervisor = _launch(tmpdir, {0: [0]}, 1)
+    try:
+        assert _wait_for(lambda: len(_starts(tmpdir, 0)) == 2)
+    finally:
+        _stop(supervisor)
+
+
+def test_shutdown_exit_is_not_restarted(tmpdir):
+    supervisor = _launch(tmpdir, {0: [launcher.SHUTDOWN_EXIT_CODE]}, 2)
+    try:
+        assert _wait_for(lambda: _starts(tmpdir, 0) and _starts(tmpdir, 1))
+        assert _wait_for(lambda: supervisor.shards[0].process is None)
+        time.sleep(1)
+        assert len(_starts(tmpdir, 0)) == 1
+        # The other shard is unaffected.
+        assert supervisor.shards[1].process.is_alive()
+    finally:
+        _stop(supervisor)
@@ -0,0 +1,62 @@
+"""
+Tests for the notifications cog, against a stand-in bot.
+"""
+import asyncio
+import types
+
+import pytest
+
+pytest.importorskip("discord")
+
+from chiru.cogs import notifications  # noqa: E402
+
+
+class StandInBot:
+    def __init__(self, loop):
+        self.loop = loop
+        self.config = {"notifications": {"window": 0.01}}
+        self.modes = {}
+        self.sent = []
+        self.errors = []
+        self.fail = False
+        self.logger = types.SimpleNamespace(error=lambda msg, **kwargs: self.errors.append(msg))
+
+    async def get_config(self, server, key):
+        return self.modes.get(server.id)
+
+    async def send_message(self, destination, content, *, wait=True):
+        if self.fail:
+            raise RuntimeError("Missing Permissions")
+        self.sent.append(content)
+
+
+def _member(name: str):
+    server = types.SimpleNamespace(id="1", default_channel="general")
+    return types.SimpleNamespace(name=name, server=server)
+
+
+def test_mode_changes_are_seen(loop):
+    bot = StandInBot(loop)
+    cog = notifications.Notifications(bot)
+
+    bot.modes["1"] = "off"
+    loop.run_until_complete(cog.on_member_join(_member("cirno")))
+    # Changed by another process; nothing is cached in the cog.
+    bot.modes["1"] = "all"
+    loop.run_until_complete(cog.on_member_join(_member("daiyousei")))
+    loop.run_until_complete(asyncio.sleep(0.05, loop=loop))
+
+    assert bot.sent == ["**daiyousei** has joined!"]
+
+
+def test_failed_flush_is_logged(loop):
+    bot = StandInBot(loop)
+    bot.modes["1"] = "all"
+    bot.fail = True
+    cog = notifications.Notifications(bot)
+
+    loop.run_until_complete(cog.on_member_join(_member("cirno")))
+    loop.run_until_complete(asyncio.sleep(0.05, loop=loop))
+
+    assert len(bot.errors) == 1
+    assert bot.errors[0].startswith("Could not send notifications: RuntimeError('Missing Permissions'")
@@ -0,0 +1,86 @@
+"""
+Compares the n-gram index against a full `process.extractOne` scan with QRatio.
+"""
+import random
+
+import pytest
+
+pytest.importorskip("fuzzywuzzy")
+
+from fuzzywuzzy import process
+from fuzzywuzzy.fuzz import QRatio
+
+from chiru.search import NgramIndex, search_many
+
+
+def _keys() -> list:
+    import asyncio
+    import collections
+    import json
+    import os
+    import re
+    keys = []
+    for module in (asyncio, collections, json, os, re):
+        keys += ["{}.{}".format(module.__name__, name) for name in sorted(dir(module)) if not name.startswith("_")]
+    return keys
+
+
+def _typo(rng: random.Random, key: str) -> str:
+    chars = list(key)
+    i = rng.randrange(len(chars) - 1)
+    chars[i], chars[i + 1] = chars[i + 1], chars[i]
+    return "".join(chars)
+
+
+@pytest.fixture(scope="module")
+def keys():
+    return _keys()
+
+
+@pytest.fixture(scope="module")
+def index(keys):
+    return NgramIndex(keys)
+
+
+def _best(keys, query):
+    key, score = process.extractOne(query, keys, scorer=QRatio)
+    return key, score
+
+
+def test_exact_matches(keys, index):
+    for key in keys[::7]:
+        assert index.search(key) == [(key, 100)]
+
+
+def test_prefix_queries_match_full_scan(keys, index):
+    rng = random.Random(1)
+    for key in rng.sample(keys, 100):
+        query = key[:max(3, len(key) // 2)]
+        assert index.search(query)[0][1] == _best(keys, query)[1], query
+
+
+def test_typos_match_full_scan(keys, index):
+    rng = random.Random(2)
+    queries = [_typo(rng, key) for key in rng.sample(keys, 200)]
+    same = sum(index.search(query)[0][1] == _best(keys, query)[1] for query in queries)
+    # Candidate pruning may miss the best key now and then, but rarely.
+    assert same >= len(queries) * 0.95
+
+
+def test_prefix_hits_are_ranked_by_score():
+    index = NgramIndex(["os.path.join", "os.path", "os.pathconf_names", "posixpath.join"])
+    assert index.search("os.path.jion", limit=2) == process.extract("os.path.jion", index.keys, scorer=QRatio,
+                                                                    limit=2)
+
+
+def test_no_shared_ngrams_falls_back_to_full_scan():
+    keys = ["alpha", "beta", "gamma"]
+    index = NgramIndex(keys)
+    assert index.search("xyz") == [_best(keys, "xyz")]
+
+
+def test_search_many(keys, index):
+    other = NgramIndex(["json.dumps", "json.loads"])
+    results = search_many({"stdlib": index, "other": other}, "json.dumps", limit=2)
+    assert results[0] == ("json.dumps", 100, "stdlib")
+    assert results[1] == ("json.dumps", 100, "other")
@@ -0,0 +1,168 @@
+"""
+Tests for the outbound message queue, against a fake HTTP layer.
+"""
+import asyncio
+
+import pytest
+
+from chiru.sender import MAX_LENGTH, MessageQueue, TokenBucket
+
+
+class FakeMessage:
+    def __init__(self, id: int, channel, content: str):
+        self.id = id
+        self.channel = channel
+        self.content = content
+
+
+class FakeHTTP:
+    """
+    Stands in for Discord's create message endpoint.
+    """
+
+    def __init__(self, fail_on: set = None):
+        self.sent = []
+        self.fail_on = fail_on or set()
+
+    async def send(self, destination, content, tts):
+        number = len(self.sent)
+        self.sent.append((destination, content, tts))
+        if number in self.fail_on:
+            raise RuntimeError("429 Too Many Requests")
+        return FakeMessage(number, destination, content)
+
+
+def _queue(loop, http, **kwargs):
+    # A large bucket, so nothing in these tests is paced.
+    kwargs.setdefault("rate", 100)
+    return MessageQueue(http.send, loop, **kwargs)
+
+
+async def _drain(queue: MessageQueue):
+    while queue.depth or any(q.worker is not None for q in queue._queues.values()):
+        await asyncio.sleep(0)
+
+
+def test_awaited_messages_are_not_merged(loop):
+    http = FakeHTTP()
+    queue = _queue(loop, http)
+
+    async def run():
+        first = queue.put("chan", "one")
+        second = queue.put("chan", "two")
+        return await first, await second
+
+    first, second = loop.run_until_complete(run())
+    assert [content for _, content, _ in http.sent] == ["one", "two"]
+    assert first is not second
+    assert (first.content, second.content) == ("one", "two")
+
+
+def test_fire_and_forget_messages_are_merged(loop):
+    http = FakeHTTP()
+    queue = _queue(loop, http)
+
+    async def run():
+        futures = [queue.put("chan", str(i), merge=True) for i in range(3)]
+        return [await future for future in futures]
+
+    messages = loop.run_until_complete(run())
+    assert [content for _, content, _ in http.sent] == ["0\n1\n2"]
+    assert messages[0] is messages[1] is messages[2]
+    assert queue.stats()["merged"] == 2
+
+
+def test_awaited_message_is_not_merged_into_fire_and_forget(loop):
+    http = FakeHTTP()
+    queue = _queue(loop, http)
+
+    async def run():
+        queue.put("chan", "a", merge=True)
+        status = queue.put("chan", "status")
+        queue.put("chan", "b", merge=True)
+        result = await status
+        await _drain(queue)
+        return result
+
+    status = loop.run_until_complete(run())
+    assert [content for _, content, _ in http.sent] == ["a", "status", "b"]
+    assert status.content == "status"
+
+
+def test_merging_respects_length_limit(loop):
+    http = FakeHTTP()
+    queue = _queue(loop, http)
+    half = "x" * (MAX_LENGTH // 2)
+
+    async def run():
+        for _ in range(3):
+            queue.put("chan", half, merge=True)
+        await _drain(queue)
+
+    loop.run_until_complete(run())
+    assert all(len(content) <= MAX_LENGTH for _, content, _ in http.sent)
+    assert len(http.sent) == 2
+
+
+def test_channels_are_queued_separately(loop):
+    http = FakeHTTP()
+    queue = _queue(loop, http)
+
+    async def run():
+        queue.put("a", "1", merge=True)
+        queue.put("b", "2", merge=True)
+        await _drain(queue)
+
+    loop.run_until_complete(run())
+    assert sorted((dest, content) for dest, content, _ in http.sent) == [("a", "1"), ("b", "2")]
+
+
+def test_split_message_returns_last_chunk(loop):
+    http = FakeHTTP()
+    queue = _queue(loop, http)
+    content = "y" * (MAX_LENGTH + 100)
+
+    message = loop.run_until_complete(queue.put("chan", content))
+    assert len(http.sent) > 1
+    assert isinstance(message, FakeMessage)
+    assert message.id == len(http.sent) - 1
+
+
+def test_parts_returns_every_chunk(loop):
+    http = FakeHTTP()
+    queue = _queue(loop, http)
+    content = "y" * (MAX_LENGTH + 100)
+
+    messages = loop.run_until_complete(queue.put("chan", content, parts=True))
+    assert len(messages) == len(http.sent) > 1
+    assert "".join(m.content for m in messages) == content
+
+    assert [m.content for m in loop.run_until_complete(queue.put("chan", "short", parts=True))] == ["short"]
+
+
+def test_split_message_raises_if_a_chunk_fails(loop):
+    # The first chunk fails; the last one is sent fine.
+    http = FakeHTTP(fail_on={0})
+    queue = _queue(loop, http)
+
+    with pytest.raises(RuntimeError):
+        loop.run_until_complete(queue.put("chan", "z" * (MAX_LENGTH + 100)))
+
+
+def test_send_failure_reaches_caller(loop):
+    http = FakeHTTP(fail_on={0})
+    queue = _queue(loop, http)
+
+    with pytest.raises(RuntimeError):
+        loop.run_until_complete(queue.put("chan", "hello"))
+
+    # The queue keeps working afterwards.
+    assert loop.run_until_complete(queue.put("chan", "again")).content == "again"
+
+
+def test_token_bucket():
+    bucket = TokenBucket(2, 10.0)
+    assert bucket.delay() == 0
+    assert bucket.delay() == 0
+    assert 0 < bucket.delay() <= 5.0
+    assert not bucket.full
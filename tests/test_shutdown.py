@@ -0,0 +1,61 @@
+"""
+Tests for the exit codes Chiru.main() hands to the launcher.
+"""
+import asyncio
+import sys
+
+import pytest
+import yaml
+
+discord = pytest.importorskip("discord")
+
+import bot as chiru_bot  # noqa: E402
+import launcher  # noqa: E402
+
+
+@pytest.fixture
+def client(loop, tmpdir, monkeypatch):
+    path = tmpdir.join("config.yml")
+    path.write(yaml.dump({"oauth2_token": "", "loop_monitor": {"enabled": False}}))
+    monkeypatch.setattr(sys, "argv", [sys.argv[0], str(path)])
+
+    client = chiru_bot.Chiru(command_prefix=chiru_bot._get_command_prefix, description="test", loop=loop)
+    yield client
+
+    if not client.is_closed:
+        loop.run_until_complete(client.close())
+    # The tasks the constructor started (extension preloading and so on).
+    tasks = [task for task in asyncio.Task.all_tasks(loop) if not task.done()]
+    for task in tasks:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*tasks, loop=loop, return_exceptions=True))
+
+
+def test_exit_codes_match():
+    assert chiru_bot.SHUTDOWN_EXIT_CODE == launcher.SHUTDOWN_EXIT_CODE
+
+
+def test_login_failure_is_not_restarted(client, monkeypatch):
+    def run(*args, **kwargs):
+        raise discord.LoginFailure("Improper credentials have been passed.")
+
+    monkeypatch.setattr(client, "run", run)
+    with pytest.raises(SystemExit) as e:
+        client.main()
+
+    assert e.value.code == launcher.SHUTDOWN_EXIT_CODE
+
+
+def test_shutdown_is_not_restarted(client, monkeypatch):
+    monkeypatch.setattr(client, "run", lambda *args, **kwargs: client.loop.run_until_complete(client.shutdown()))
+    with pytest.raises(SystemExit) as e:
+        client.main()
+
+    assert e.value.code == launcher.SHUTDOWN_EXIT_CODE
+    assert client.is_closed
+
+
+def test_other_exits_are_restarted(client, monkeypatch):
+    # e.g. the gateway connection was lost for good; main() returns, and the process exits with 0.
+    monkeypatch.setattr(client, "run", lambda *args, **kwargs: None)
+    assert client.main() is None